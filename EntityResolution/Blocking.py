@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import random
+import time
+import zlib
+DEBUG = False
+def Debug(*args):
+    if DEBUG:
+        print(*args)
+
+######################################
+# Blocking narrows the secondaries of each primary down to a small set of
+# candidates before any rule runs. Every entity is given keys, and two
+# entities are candidates when they share at least one key:
+#   - prefix keys: the first characters of the normalized identifier
+#   - LSH keys: bands of a MinHash signature over character n-grams, so
+#     that similar strings share a band with high probability
+# Exclusion keys work the other way around: entities that share one are
+# never candidates (e.g. entities inserted by the same activity).
+# Buckets holding more than maxBucketSize entities are ignored, as a key
+# that common (say the "REQ" prefix of every requirement) tells nothing.
+######################################
+
+PRIME = 4294967311 # smallest prime above 2**32
+
+def stableHash(string):
+    # hash() is salted per process, the engine runs in a multiprocessing pool
+    return zlib.crc32(string.encode("utf-8"))
+
+def ngrams(string, n):
+    string = string.replace(" ", "")
+    if len(string) <= n:
+        return {string} if string != "" else set()
+    return {string[i:i+n] for i in range(len(string)-n+1)}
+
+# Key functions are classes rather than closures so that the engine, which
+# holds the blocker, can still be sent to the multiprocessing pool
+class IdentifierPrefixKey:
+    def __init__(self, getText, normalize, length=4):
+        self.getText = getText
+        self.normalize = normalize
+        self.length = length
+
+    def __call__(self, e):
+        text = self.getText(e)
+        if text is None:
+            return []
+        text = self.normalize(text).replace(" ", "")
+        if text == "":
+            return []
+        return [text[:self.length]]
+
+class MinHashKeys:
+    def __init__(self, getText, normalize, n=3, bands=8, rows=4, seed=0):
+        self.getText = getText
+        self.normalize = normalize
+        self.n = n
+        self.bands = bands
+        self.rows = rows
+        rand = random.Random(seed)
+        self.permutations = [(rand.randrange(1, PRIME), rand.randrange(0, PRIME)) for _ in range(bands*rows)]
+
+    def __call__(self, e):
+        text = self.getText(e)
+        if text is None:
+            return []
+        hashes = [stableHash(g) for g in ngrams(self.normalize(text), self.n)]
+        if len(hashes) == 0:
+            return []
+        signature = [min((a*h+b) % PRIME for h in hashes) for a, b in self.permutations]
+        return ["{}:{}".format(band, ",".join(str(v) for v in signature[band*self.rows:(band+1)*self.rows])) for band in range(self.bands)]
+
+class Blocker:
+    keyFunctions = None
+    exclusionFunctions = None
+    buckets = None
+    entityKeys = None
+    entityExclusions = None
+    allowed = None
+    maxBucketSize = None
+    indexTime = 0.0
+
+    def __init__(self, maxBucketSize=500):
+        self.maxBucketSize = maxBucketSize
+        self.keyFunctions = list()
+        self.exclusionFunctions = list()
+        self.buckets = {}
+        self.entityKeys = {}
+        self.entityExclusions = {}
+        self.allowed = {}
+
+    def addKey(self, name, keyFunction):
+        self.keyFunctions.append([name, keyFunction])
+
+    def addExclusion(self, name, keyFunction):
+        self.exclusionFunctions.append([name, keyFunction])
+
+    def index(self, entities):
+        start = time.time()
+        self.buckets = {}
+        self.entityKeys = {}
+        self.entityExclusions = {}
+        self.allowed = {}
+        for e in entities:
+            keys = set()
+            for name, keyFunction in self.keyFunctions:
+                for k in keyFunction(e):
+                    keys.add((name, k))
+            self.entityKeys[e] = keys
+            for k in keys:
+                if k not in self.buckets:
+                    self.buckets[k] = set()
+                self.buckets[k].add(e)
+            exclusions = set()
+            for name, keyFunction in self.exclusionFunctions:
+                for k in keyFunction(e):
+                    exclusions.add((name, k))
+            self.entityExclusions[e] = exclusions
+        self.indexTime = time.time() - start
+        Debug("Indexed {} entities into {} buckets".format(len(self.entityKeys), len(self.buckets)))
+
+    def candidates(self, eP, secondaries):
+        # Primaries of the same class share their list of secondaries; keep
+        # the list itself so that its id cannot be reused by another one
+        cached = self.allowed.get(id(secondaries))
+        if cached is not None and cached[0] is secondaries:
+            allowed = cached[1]
+        else:
+            allowed = set(secondaries)
+            self.allowed[id(secondaries)] = (secondaries, allowed)
+        found = set()
+        for k in self.entityKeys.get(eP, set()):
+            if self.maxBucketSize is None or len(self.buckets[k]) <= self.maxBucketSize:
+                found |= self.buckets[k]
+        exclusions = self.entityExclusions.get(eP, set())
+        return sorted(eS for eS in found if eS in allowed and eS != eP and len(exclusions & self.entityExclusions.get(eS, set())) == 0)
+
+    def report(self):
+        sizes = [len(b) for b in self.buckets.values()]
+        ignored = len([size for size in sizes if self.maxBucketSize is not None and size > self.maxBucketSize])
+        return "  indexed {} things into {} buckets ({} too large to use) in {:.2f}s".format(len(self.entityKeys), len(self.buckets), ignored, self.indexTime)
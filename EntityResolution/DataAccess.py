@@ -4,7 +4,150 @@ import json
 import semtk3
 import os.path
 import time
+import sqlite3
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 import RACK_CONSTANTS as rc
+
+STORE_PATH = "cache/entities.db"
+BATCH_SIZE = 200 # things per bulk CONSTRUCT query
+
+#####################################
+# Entity store: the data of prefetched things, one row per GUID in the same
+# shape cacheData writes to cache/<guid>.json
+#####################################
+store = None
+storePid = None
+def getStore():
+    global store, storePid
+    # sqlite connections must not cross the fork into multiprocessing workers
+    if store is None or storePid != os.getpid():
+        os.makedirs(os.path.dirname(STORE_PATH), exist_ok=True)
+        store = sqlite3.connect(STORE_PATH, timeout=60)
+        store.execute("CREATE TABLE IF NOT EXISTS entities (guid TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        store.commit()
+        storePid = os.getpid()
+    return store
+
+def storedData(guid):
+    row = getStore().execute("SELECT data FROM entities WHERE guid = ?", (guid,)).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0])
+
+def storedGuids(guids):
+    found = set()
+    guids = list(guids)
+    for i in range(0, len(guids), 500):
+        batch = guids[i:i+500]
+        rows = getStore().execute("SELECT guid FROM entities WHERE guid IN ({})".format(",".join("?"*len(batch))), batch)
+        found.update(r[0] for r in rows)
+    return found
+
+def refs(value):
+    if type(value) == dict and '@id' in value:
+        return [value['@id']]
+    if type(value) == list:
+        return [v['@id'] for v in value if type(v) == dict and '@id' in v]
+    return []
+
+def summary(el):
+    return {k: el[k] for k in ('@id', '@type', 'PROV_S:identifier') if k in el}
+
+def splitGraph(res, guids):
+    # Cut the JSON-LD of a bulk query into the graph dataQuery would have
+    # returned for each thing: the thing itself, and the type and identifier of
+    # the things it links to or that link to it
+    context = res.get("@context", {})
+    if "@graph" in res:
+        elements = res["@graph"]
+    else:
+        elements = [{k: v for k, v in res.items() if k != "@context"}]
+    byId = {}
+    incoming = {}
+    for el in elements:
+        byId[el['@id']] = el
+        for p in el:
+            for ref in refs(el[p]):
+                if ref not in incoming:
+                    incoming[ref] = []
+                incoming[ref].append((el, p))
+    records = {}
+    for guid in guids:
+        key = "semtk:"+guid
+        if key not in byId:
+            continue
+        neighbors = {}
+        for p in byId[key]:
+            for ref in refs(byId[key][p]):
+                if ref != key and ref in byId and ref not in neighbors:
+                    neighbors[ref] = summary(byId[ref])
+        for el, p in incoming.get(key, []):
+            if el['@id'] == key:
+                continue
+            if el['@id'] not in neighbors:
+                neighbors[el['@id']] = summary(el)
+            neighbors[el['@id']][p] = {'@id': key}
+        records[guid] = {"@context": context, "@graph": [byId[key]] + list(neighbors.values())}
+    return records
+
+def prefetch(entities):
+    # Fetch the data of many things with a few bulk queries, skipping those already stored
+    guids = sorted(set(e.split("#")[-1] for e in entities))
+    stored = storedGuids(guids)
+    missing = [g for g in guids if g not in stored]
+    print("Prefetching {} of {} things..".format(len(missing), len(guids)))
+    start = time.time()
+    for i in range(0, len(missing), BATCH_SIZE):
+        batch = missing[i:i+BATCH_SIZE]
+        res = semtk3.query_raw_sparql(rc.bulkDataQuery.replace("{{GUIDS}}", " ".join("<uri://semtk#"+g+">" for g in batch)),
+                                      result_type=semtk3.RESULT_TYPE_GRAPH_JSONLD)
+        records = splitGraph(res, batch)
+        with getStore() as db:
+            db.executemany("INSERT OR REPLACE INTO entities (guid, data) VALUES (?, ?)",
+                           [(g, json.dumps(records[g])) for g in batch if g in records])
+        print("  {} / {}".format(min(i+BATCH_SIZE, len(missing)), len(missing)))
+    print("  Prefetch done in {:.1f}s.".format(time.time()-start))
+
+#####################################
+# Per-thing cache: cache/<guid>.json, for things that were not prefetched.
+# Files are written under a temporary name and renamed into place, so a file
+# is either absent or complete. Fetches are single-flight across the worker
+# processes: the worker holding the lock of a GUID fetches it, the others
+# block on the lock and then read what it wrote. GUIDs share a fixed set of
+# LOCK_STRIPES lock files, picked by hash, rather than one file each.
+#####################################
+CACHE_DIR = "cache"
+LOCK_DIR = "cache/locks"
+LOCK_STRIPES = 64
+
+@contextmanager
+def fetchLock(guid):
+    if fcntl is None: # no flock (Windows): concurrent workers may fetch the same thing twice
+        yield
+        return
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    stripe = zlib.crc32(guid.encode("utf-8")) % LOCK_STRIPES
+    with open(os.path.join(LOCK_DIR, "{}.lock".format(stripe)), "a") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+def readCache(guid):
+    try:
+        with open(os.path.join(CACHE_DIR, guid+".json"), "r") as dataFile:
+            return json.load(dataFile)
+    except (FileNotFoundError, ValueError):
+        # Missing, or left truncated by a crash before writes were atomic
+        return None
+
 def cacheData(e):
     guid = e.split("#")[-1]
     graph = "http://rack001/Data"
@@ -12,113 +155,116 @@ def cacheData(e):
                                                         .replace("{{GUID}}",guid) \
                                                         .replace("{{GRAPH}}",graph),\
                                                         result_type=semtk3.RESULT_TYPE_GRAPH_JSONLD)
-    with open("cache/"+guid+".json", "w") as dataFile:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, guid+".json")
+    tmpPath = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmpPath, "w") as dataFile:
         json.dump(res, dataFile, indent = 4)
+    os.replace(tmpPath, path)
+    return res
 
-def getRelationships(e):
-    relationships = []
-    guid = e.split("#")[-1]
-    data = getData(e)["@graph"]
-    if type(data) == list:
-        identData = {}
-        for el in data:
-            identData[el['@id']] = el['PROV_S:identifier']
-        for el in data:
-            if el['@id'][6:] == guid:
-                for p in el:
-                    if type(el[p]) == dict:
-                        relationships.append((p,  identData[el[p]['@id']],  "Outgoing"))
-            else:
-                for p in el:
-                    if type(el[p]) == dict:
-                        relationships.append((p,  el['PROV_S:identifier'],    "Incoming"))
-    return relationships
-    
-def getDataProperties(e):
-    dataProperties = []
+#####################################
+# Entity records: the data of a thing parsed once per process, with what the
+# accessors return already extracted, so rules comparing thousands of pairs
+# do not re-read and re-walk the same graph. The least recently used records
+# are dropped beyond MAX_RECORDS.
+#####################################
+MAX_RECORDS = 20000
+records = OrderedDict()
+
+def buildRecord(e):
     guid = e.split("#")[-1]
-    data = getData(e)["@graph"]
-    if type(data) == list:
-        for el in data:
-            if el['@id'][6:] == guid:
-                for p in el:
-                    if type(el[p]) != dict:
-                        dataProperties.append((p,  el[p]))
-                break
+    data = getData(e)
+    context = data.get("@context", {})
+    elements = data["@graph"]
+    if type(elements) != list:
+        # No graph means there is a single element at the root
+        elements = [elements]
+        if "@context" in elements[0]:
+            context = elements[0]["@context"]
+    byId = {}
+    base = None
+    for el in elements:
+        if '@id' not in el:
+            base = el
+            continue
+        byId[el['@id']] = el
+        if el['@id'][6:] == guid:
+            base = el
+    record = {"guid": guid, "byId": byId, "element": base,
+              "identifier": None, "description": None, "type": None,
+              "dataInsertedBy": [], "dataProperties": [], "relationships": []}
+    if base is None:
+        return record
+    record["identifier"] = base.get('PROV_S:identifier')
+    record["description"] = base.get('PROV_S:description')
+    if '@type' in base:
+        ns, _type = base['@type'].split(":")
+        record["type"] = context[ns]+_type
+    inserted = base.get('PROV_S:dataInsertedBy')
+    if type(inserted) == dict:
+        inserted = [inserted]
+    for i in inserted or []:
+        if i['@id'] in byId:
+            record["dataInsertedBy"].append(byId[i['@id']].get('PROV_S:identifier'))
+    for p in base:
+        if type(base[p]) != dict:
+            record["dataProperties"].append((p,  base[p]))
+    for el in elements:
+        if el is base:
+            for p in el:
+                if type(el[p]) == dict:
+                    record["relationships"].append((p,  byId.get(el[p]['@id'], {}).get('PROV_S:identifier'),  "Outgoing"))
+        else:
+            for p in el:
+                if type(el[p]) == dict:
+                    record["relationships"].append((p,  el.get('PROV_S:identifier'),    "Incoming"))
+    return record
+
+def getRecord(e):
+    record = records.get(e)
+    if record is None:
+        record = buildRecord(e)
+        records[e] = record
+        if len(records) > MAX_RECORDS:
+            records.popitem(last=False)
     else:
-        for p in data:
-            if type(data[p]) != dict:
-                dataProperties.append((p,  el[p]))  
-    return dataProperties
+        records.move_to_end(e)
+    return record
+
+def forgetRecords():
+    records.clear()
+
+def getRelationships(e):
+    return list(getRecord(e)["relationships"])
+
+def getDataProperties(e):
+    return list(getRecord(e)["dataProperties"])
 
 def getDescription(e):
-    guid = e.split("#")[-1]
-    data = getData(e)["@graph"]
-    if type(data) == list:
-        for el in data:
-            if el['@id'][6:] == guid:
-                if 'PROV_S:description' in el:
-                    return el['PROV_S:description']
-                else:
-                    return None
-    else:
-        if 'PROV_S:description' in data:
-            return data['PROV_S:description']
-        else:
-            return None
+    return getRecord(e)["description"]
 
 def getType(e):
-    guid = e.split("#")[-1]
-    data = getData(e)["@graph"]
-    context = None
-    if "@context" in getData(e):
-        context = getData(e)["@context"]
-    elif "@context" in data:
-        context = data['@context']
-    else:
-        print("ERROR: Could not find context from data graph!!!")
-        print("{}".format())
-    if type(data) == list:
-        for el in data:
-            if el['@id'][6:] == guid:
-                if '@type' in el:
-                    ns, _type = el['@type'].split(":")
-                    return context[ns]+_type
-                else:
-                    return None
-    else:
-        if '@type' in data:
-            ns, _type = data['@type'].split(":")
-            return context[ns]+_type
-        else:
-            return None
-    
+    return getRecord(e)["type"]
+
 def getIdentifier(e):
-    guid = e.split("#")[-1]
-    data = getData(e)["@graph"]
-    if type(data) == list:
-        for el in data:            
-            if el['@id'][6:] == guid:
-                if 'PROV_S:identifier' in el:
-                    return el['PROV_S:identifier']
-                else:
-                    return None
-    else:
-        if 'PROV_S:identifier' in data:
-            return data['PROV_S:identifier']
-        else:
-            return None
-            
+    return getRecord(e)["identifier"]
+
+def getDataInsertedBy(e):
+    return list(getRecord(e)["dataInsertedBy"])
+
 def getData(e):
     guid = e.split("#")[-1]
-    data = None
-    if not os.path.exists("cache/"+guid+".json"):
-        cacheData(e)
-    #This is to handle the case with multiprocssing where one thread has created the file but not yet populated with data
-    while os.path.getsize("cache/"+guid+".json") ==0:
-        time.sleep(0.1)
-    with open("cache/"+guid+".json", "r") as dataFile:
-        data = json.load(dataFile)
+    data = storedData(guid)
+    if data is not None:
+        return data
+    data = readCache(guid)
+    if data is None:
+        with fetchLock(guid):
+            # Another worker may have fetched it while this one waited
+            data = readCache(guid)
+            if data is None:
+                data = cacheData(e)
     if "@graph" not in data:
         data = {"@graph":data}
     return data
@@ -201,7 +201,14 @@ class MainWindow(tk.Tk):
         for k in instances:
             for i in instances[k]:
                 primaryDict[i] = secondaryDict[k]
-        
+
+        # Pull the data of every thing up front with a few bulk queries, rather
+        # than one query per thing while the rules run
+        things = set(primaryDict)
+        for k in secondaryDict:
+            things.update(secondaryDict[k])
+        da.prefetch(things)
+
         import ResolveThings
         ResolveThings.run(primaryDict)
         self.loadData()
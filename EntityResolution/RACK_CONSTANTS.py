@@ -115,3 +115,44 @@ where {
         ?OBJ2_type rdfs:subClassOf* PROV_S:THING .
     }
 }"""
+
+# Same as dataQuery for a batch of things at once, {{GUIDS}} is a list of <uri://semtk#guid>
+bulkDataQuery = """prefix rdf:<http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+prefix semtk:<uri://semtk#>
+prefix XMLSchema:<http://www.w3.org/2001/XMLSchema#>
+prefix PROV_S:<http://arcos.rack/PROV-S#>
+prefix rdfs:<http://www.w3.org/2000/01/rdf-schema#>
+CONSTRUCT {
+	?THING a ?THING_type .
+	?THING ?dp ?o .
+
+	?THING ?p ?OBJ .
+	?OBJ a ?OBJ_type .
+		?OBJ PROV_S:identifier ?OBJ_identifier .
+
+	?OBJ2 ?ap ?THING .
+	?OBJ2 a ?OBJ2_type .
+		?OBJ2 PROV_S:identifier ?OBJ2_identifier .
+}
+		FROM <http://rack001/data>
+		FROM <http://rack001/model>
+where {
+    VALUES ?THING { {{GUIDS}} }
+    ?THING a ?THING_type .
+    ?THING_type rdfs:subClassOf* PROV_S:THING .
+    optional{
+        ?THING ?p ?OBJ .
+        ?OBJ a ?OBJ_type .
+        ?OBJ PROV_S:identifier ?OBJ_identifier .
+        ?OBJ_type rdfs:subClassOf* PROV_S:THING .
+    }
+    optional{
+        ?THING ?dp ?o
+    }
+    optional{
+        ?OBJ2 ?ap ?THING .
+        ?OBJ2 a ?OBJ2_type .
+        ?OBJ2 PROV_S:identifier ?OBJ2_identifier .
+        ?OBJ2_type rdfs:subClassOf* PROV_S:THING .
+    }
+}"""
@@ -4,6 +4,8 @@ import json
 from colorama import Fore,  Style
 import multiprocessing
 import os.path
+import random
+import time
 DEBUG = False
 def Debug(*args):
     if DEBUG:
@@ -18,6 +20,10 @@ def Debug(*args):
 # 1.0 == confirmedSameAs    
 ######################################
 
+# What relative rules add to the score of a likely match, by default on the
+# scale of the SequenceMatcher rules. Rules on another scale set their own.
+MATCH_LEVEL = 1.0
+
 reportString = """{} / {} - {}
   Best Match:{}
   Score:{}{}{}
@@ -31,6 +37,9 @@ class ResolutionEngine:
     sourceConnection = None
     resolvedConnection = None
     logString = ""
+    blocker = None
+    recallSample = 0
+    matchLevel = MATCH_LEVEL
     
     def __init__(self):
         self.entityList = list()
@@ -56,24 +65,59 @@ class ResolutionEngine:
     def addRelativeRule(self, ruleFunction):
         self.ruleList.append(["Relative", ruleFunction])
 
-    def work(self, eP):
-        print("Running Analysis on {}".format(eP))
+    def setBlocker(self, blocker, recallSample=0):
+        # Only candidates from the blocker are compared with each primary. With a
+        # recallSample, that many primaries are also compared with all their
+        # secondaries to check that blocking keeps their best matches.
+        self.blocker = blocker
+        self.recallSample = recallSample
+
+    def setMatchLevel(self, matchLevel):
+        self.matchLevel = matchLevel
+
+    def matchThreshold(self):
+        # Score above which a best match is likely the same thing, which is also
+        # what counts towards the recall of blocking
+        return 1 + self.matchLevel
+
+    def __secondaries__(self, eP):
+        if self.blocker is None:
+            return self.entityList[eP]
+        return self.blocker.candidates(eP, self.entityList[eP])
+
+    def __bestMatch__(self, eP, secondaries):
+        # Rules that can score a whole row of secondaries at once do it up front
+        for ruleType, rule in self.ruleList:
+            if hasattr(rule, "prepare"):
+                rule.prepare(eP, secondaries)
         maxScore = 0
         bestMatch = None
         resolutions = {}
         Score = 0.0
-        for eS in self.entityList[eP]:
+        for eS in secondaries:
             if eS!=eP:
                 Score = self.__runRules__(eP,eS)
                 resolutions[eS] = Score
                 if Score > maxScore:
                     maxScore = Score
                     bestMatch = eS
+        return bestMatch, maxScore, resolutions, Score
+
+    def checkRecall(self, eP):
+        bestMatch, maxScore, _, _ = self.__bestMatch__(eP, self.entityList[eP])
+        if maxScore <= self.matchThreshold():
+            return None
+        return bestMatch in self.__secondaries__(eP)
+
+    def work(self, eP):
+        print("Running Analysis on {}".format(eP))
+        secondaries = self.__secondaries__(eP)
+        bestMatch, maxScore, resolutions, Score = self.__bestMatch__(eP, secondaries)
         color = Fore.WHITE
-        if Score> 2:
-            color = Fore.YELLOW
-        elif Score > 4:
+        if maxScore > 1 + 3*self.matchLevel:
             color = Fore.GREEN
+        elif maxScore > self.matchThreshold():
+            color = Fore.YELLOW
 
         with open("Resolutions/"+eP.split("#")[-1]+".json", "w") as out:
             json.dump(resolutions, out, indent=4)
@@ -82,6 +126,7 @@ class ResolutionEngine:
             out.write("{},{},{}\n".format(eP,bestMatch ,maxScore))
             
         print(reportString.format(len(os.listdir("Resolutions")), len(self.entityList), eP, bestMatch, color,str(maxScore),Style.RESET_ALL))
+        return len(resolutions), len(self.entityList[eP]) - (1 if eP in self.entityList[eP] else 0)
 
     def runAllAnalysis(self):
         
@@ -99,8 +144,32 @@ class ResolutionEngine:
         #for k in self.entityList.keys():
         #    self.work(k)
         print("  analyzing {} things for commonality.".format(len(self.entityList)))
+        things = set(self.entityList.keys())
+        for secondaries in self.entityList.values():
+            things.update(secondaries)
+        for ruleType, rule in self.ruleList:
+            if hasattr(rule, "index"):
+                print("  Indexing..")
+                rule.index(sorted(things))
+                print(rule.report())
+        if self.blocker is not None:
+            print("  Blocking..")
+            self.blocker.index(sorted(things))
+            print(self.blocker.report())
+        start = time.time()
         with multiprocessing.Pool() as pool:
-            pool.map(self.work, self.entityList.keys())
+            counts = pool.map(self.work, self.entityList.keys())
+            elapsed = time.time() - start
+            compared = sum(c for c, _ in counts)
+            allPairs = sum(a for _, a in counts)
+            print("  compared {} pairs in {:.2f}s ({:.0f} pairs/s)".format(compared, elapsed, compared/elapsed if elapsed > 0 else 0))
+            if self.blocker is not None:
+                print("  blocking skipped {} of {} pairs ({:.1f}%)".format(allPairs-compared, allPairs, 100.0*(allPairs-compared)/allPairs if allPairs > 0 else 0))
+                if self.recallSample > 0:
+                    sample = random.Random(0).sample(sorted(self.entityList.keys()), min(self.recallSample, len(self.entityList)))
+                    kept = [k for k in pool.map(self.checkRecall, sample) if k is not None]
+                    if len(kept) > 0:
+                        print("  blocking recall: kept {} of {} best matches scoring above {} in a sample of {}".format(kept.count(True), len(kept), self.matchThreshold(), len(sample)))
         print("  Analysis Complete.")
         ######################################################################
         
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import DataAccess as da
 import ResolutionEngine as re
-from difflib import SequenceMatcher
+import Blocking as bl
+import Similarity as sim
+import re as regex
 data = {}
 entities = {}
 DEBUG = False
@@ -15,38 +17,14 @@ def Debug(*args):
 #####################################
 # helper Functions
 #####################################
+NOT_ALNUM = regex.compile(r"[\W_]+")
 def cleanString(string):
-    cleanString = ""
-    for c in string:
-        if c.isalnum():
-            cleanString+=c
-        else:
-            cleanString += " "
-    while cleanString.find("  ")!=-1:
-        cleanString = cleanString.replace("  "," ")
-
-    return cleanString.upper().rstrip(" ").lstrip(" ")
+    # Runs of characters other than letters and digits become one space
+    return NOT_ALNUM.sub(" ", string).upper().strip(" ")
 #####################################
 # Rules Definitions
 #####################################
             
-def fuzzyDescriptionCompare(e1,e2):
-    Debug("descriptionCompare")
-    if da.getDescription(e1) != None and da.getDescription(e2) != None:
-        t1 = cleanString(da.getDescription(e1))
-        t2 = cleanString(da.getDescription(e2))
-        matcher = SequenceMatcher(None, t1, t2)
-        return True, matcher.ratio()*2
-    else:
-        return False, 1.0
-def fuzzyIdentifierCompare(e1,e2):
-    Debug("fuzzyIdentifierCompare")
-    global data
-    t1 = cleanString(da.getIdentifier(e1))
-    t2 = cleanString(da.getIdentifier(e2))
-    matcher = SequenceMatcher(None, t1, t2)
-    return True, matcher.ratio() * 2
-            
 def identifierCompare(e1,e2):
     Debug("identifierCompare")
     global data
@@ -59,29 +37,8 @@ def identifierCompare(e1,e2):
         return False, 5.0
         
 def getDataInsertedBy(e):
-    guid = e.split("#")[-1]
-    data = da.getData(e)
-    ## Create a Hash based on the GUID and find the base Element
-    elements={}
-    baseElement = None
-    if "@graph" not in data: # No Graph tag means there is a single element at the root.
-        baseElement = data
-        return list()
-
-    for el in data["@graph"]:
-        elements[el["@id"].split(":")[-1]] = el
-        if el["@id"].split(":")[-1] == guid:
-            baseElement = el
-    dataInsertedByIdentifiers = []   
-    ## Get dataInsertedBy Elements and collect the identifiers
-    if type(baseElement['PROV_S:dataInsertedBy']) is dict:
-        dataInsertedByIdentifiers.append(elements[baseElement['PROV_S:dataInsertedBy']['@id'].split(":")[-1]]['PROV_S:identifier'])
-    elif type(baseElement['PROV_S:dataInsertedBy']) is list:
-        for i in baseElement['PROV_S:dataInsertedBy']:
-            dataInsertedByIdentifiers.append(elements[i['@id'].split(":")[-1]]['PROV_S:identifier'])
-    else:
-        print("***** ERRROR 1 *****")
-    return dataInsertedByIdentifiers
+    # Identifiers of the activities that inserted the thing
+    return da.getDataInsertedBy(e)
     
     
 def dataInsertedByCheck(e1,e2):
@@ -98,13 +55,38 @@ def dataInsertedByCheck(e1,e2):
     
     return False, 1.0
     
-def run(entities):
+#####################################
+# Blocking
+#####################################
+def createBlocker():
+    blocker = bl.Blocker()
+    blocker.addKey("identifierPrefix", bl.IdentifierPrefixKey(da.getIdentifier, cleanString))
+    blocker.addKey("identifierLSH", bl.MinHashKeys(da.getIdentifier, cleanString))
+    blocker.addKey("descriptionLSH", bl.MinHashKeys(da.getDescription, cleanString, n=4))
+    # Things inserted by the same activity are assumed different (see dataInsertedByCheck)
+    blocker.addExclusion("dataInsertedBy", getDataInsertedBy)
+    return blocker
+
+#####################################
+# Similarity
+#####################################
+def createSimilarityRules(mode="tfidf"):
+    # "sequence" reproduces the SequenceMatcher scores of the rules before "tfidf"
+    fuzzyIdentifierCompare = sim.SimilarityRule(da.getIdentifier, cleanString, mode)
+    fuzzyDescriptionCompare = sim.SimilarityRule(da.getDescription, cleanString, mode, n=4, whenMissing=(False, 1.0))
+    return fuzzyIdentifierCompare, fuzzyDescriptionCompare
+
+def run(entities, blocking=True, recallSample=20, similarity="tfidf"):
     resEngine = re.ResolutionEngine()
     resEngine.addEntities(entities)
+    if blocking:
+        resEngine.setBlocker(createBlocker(), recallSample)
     resEngine.addAbsoluteRule(dataInsertedByCheck) 
     resEngine.addAbsoluteRule(identifierCompare)
+    fuzzyIdentifierCompare, fuzzyDescriptionCompare = createSimilarityRules(similarity)
     resEngine.addRelativeRule(fuzzyIdentifierCompare)
     resEngine.addRelativeRule(fuzzyDescriptionCompare)
+    resEngine.setMatchLevel(fuzzyIdentifierCompare.matchLevel())
     
     resEngine.runAllAnalysis()
     
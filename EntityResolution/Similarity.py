@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+import math
+import time
+from difflib import SequenceMatcher
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+DEBUG = False
+def Debug(*args):
+    if DEBUG:
+        print(*args)
+
+######################################
+# Similarity rules score a primary against all its secondaries at once
+# instead of one pair at a time. The text of every thing (identifier,
+# description, ...) is normalized once, and in "tfidf" mode turned once into
+# a sparse vector of character n-grams and words weighted by TF-IDF; scores
+# are cosine similarities, computed for a whole row of secondaries with a
+# scipy sparse product when scipy is installed, and with dictionaries
+# otherwise. "sequence" mode keeps the SequenceMatcher ratio the rules used
+# before, on the same normalized text, to validate tfidf mode against.
+# Scores are doubled, as before, so both modes weigh the same in the total.
+######################################
+
+MODES = ["tfidf", "sequence"]
+SCALE = 2.0
+
+# Similarity from which two texts are likely the same thing, in each mode.
+# SequenceMatcher finds common characters even in unrelated identifiers, so
+# its ratios run higher than tfidf cosines: on random pairs of identifiers,
+# a ratio above 0.5 is about as rare as a cosine above 0.18.
+MATCH_SIMILARITY = {"tfidf": 0.18, "sequence": 0.5}
+
+def features(text, n):
+    padded = " "+text+" "
+    grams = {}
+    for i in range(max(len(padded)-n+1, 1)):
+        g = padded[i:i+n]
+        grams[g] = grams.get(g, 0) + 1
+    for word in text.split(" "):
+        if word != "":
+            grams["w:"+word] = grams.get("w:"+word, 0) + 1
+    return grams
+
+class SimilarityRule:
+    getText = None
+    normalize = None
+    mode = None
+    n = 3
+    whenMissing = None
+    texts = None
+    vectors = None
+    idf = None
+    vocabulary = None
+    matrices = None
+    row = None
+    rowFor = None
+    indexTime = 0.0
+
+    def __init__(self, getText, normalize, mode="tfidf", n=3, whenMissing=None):
+        # whenMissing is what the rule returns when either thing has no text,
+        # None makes the rule fail as the old rules did on missing identifiers
+        if mode not in MODES:
+            raise ValueError("Unknown similarity mode {}, expected one of {}".format(mode, ", ".join(MODES)))
+        self.getText = getText
+        self.normalize = normalize
+        self.mode = mode
+        self.n = n
+        self.whenMissing = whenMissing
+        self.texts = {}
+        self.vectors = {}
+        self.idf = {}
+        self.vocabulary = {}
+        self.matrices = {}
+        self.row = {}
+
+    def __getstate__(self):
+        # Texts, vectors and matrices are rebuilt in each worker rather than
+        # pickled with every task sent to the pool
+        state = dict(self.__dict__)
+        state["texts"] = {}
+        state["vectors"] = {}
+        state["matrices"] = {}
+        state["row"] = {}
+        state["rowFor"] = None
+        return state
+
+    def text(self, e):
+        if e not in self.texts:
+            text = self.getText(e)
+            if text is not None:
+                text = self.normalize(text)
+            self.texts[e] = text
+        return self.texts[e]
+
+    def index(self, entities):
+        # Document frequencies over every thing, for the IDF weights
+        start = time.time()
+        self.idf = {}
+        self.vocabulary = {}
+        if self.mode == "tfidf":
+            df = {}
+            documents = 0
+            for e in entities:
+                text = self.text(e)
+                if text is None:
+                    continue
+                documents += 1
+                for g in features(text, self.n):
+                    df[g] = df.get(g, 0) + 1
+            for g in sorted(df):
+                self.idf[g] = math.log((1+documents)/(1+df[g])) + 1
+                self.vocabulary[g] = len(self.vocabulary)
+        self.vectors = {}
+        self.matrices = {}
+        self.indexTime = time.time() - start
+        Debug("Indexed {} features".format(len(self.vocabulary)))
+
+    def vector(self, e):
+        if e not in self.vectors:
+            text = self.text(e)
+            vector = {}
+            if text is not None:
+                for g, count in features(text, self.n).items():
+                    vector[g] = count * self.idf.get(g, 1.0)
+                norm = math.sqrt(sum(w*w for w in vector.values()))
+                if norm > 0:
+                    vector = {g: w/norm for g, w in vector.items()}
+            self.vectors[e] = vector
+        return self.vectors[e]
+
+    def similarity(self, e1, e2):
+        t1 = self.text(e1)
+        t2 = self.text(e2)
+        if self.mode == "sequence":
+            return SequenceMatcher(None, t1, t2).ratio()
+        v1 = self.vector(e1)
+        v2 = self.vector(e2)
+        if len(v2) < len(v1):
+            v1, v2 = v2, v1
+        return sum(w*v2.get(g, 0.0) for g, w in v1.items())
+
+    def matrix(self, secondaries):
+        # Lists of secondaries shared by primaries of a class are kept, along
+        # with the matrix, so their id cannot be reused by another list
+        cached = self.matrices.get(id(secondaries))
+        if cached is not None and cached[0] is secondaries:
+            return cached[1]
+        rows, columns, values = [], [], []
+        for i, eS in enumerate(secondaries):
+            for g, w in self.vector(eS).items():
+                if g in self.vocabulary:
+                    rows.append(i)
+                    columns.append(self.vocabulary[g])
+                    values.append(w)
+        m = scipy.sparse.csr_matrix((values, (rows, columns)), shape=(len(secondaries), len(self.vocabulary)))
+        if len(self.matrices) > 64:
+            self.matrices = {}
+        self.matrices[id(secondaries)] = (secondaries, m)
+        return m
+
+    def prepare(self, eP, secondaries):
+        # Score eP against all its secondaries in one go, the engine then
+        # calls the rule pair by pair and gets these scores back
+        self.row = {}
+        self.rowFor = eP
+        if self.text(eP) is None:
+            return
+        if self.mode == "tfidf" and numpy is not None and len(self.vocabulary) > 0:
+            v = self.vector(eP)
+            p = numpy.zeros(len(self.vocabulary))
+            for g, w in v.items():
+                if g in self.vocabulary:
+                    p[self.vocabulary[g]] = w
+            scores = self.matrix(secondaries).dot(p)
+            for i, eS in enumerate(secondaries):
+                self.row[eS] = float(scores[i])
+        else:
+            for eS in secondaries:
+                if self.text(eS) is not None:
+                    self.row[eS] = self.similarity(eP, eS)
+
+    def __call__(self, e1, e2):
+        if self.whenMissing is not None and (self.text(e1) is None or self.text(e2) is None):
+            return self.whenMissing
+        if self.rowFor == e1 and e2 in self.row:
+            score = self.row[e2]
+        else:
+            score = self.similarity(e1, e2)
+        return True, score * SCALE
+
+    def matchLevel(self):
+        # What the rule adds to the score of a likely match
+        return MATCH_SIMILARITY[self.mode] * SCALE
+
+    def report(self):
+        return "  indexed {} features in {:.2f}s ({} mode{})".format(len(self.vocabulary), self.indexTime, self.mode,
+                                                                      ", scipy" if self.mode == "tfidf" and numpy is not None else "")
@@ -0,0 +1,25 @@
+"""Benchmarks of formatting query results and parsing query constraints"""
+
+import pytest
+from pytest_benchmark.fixture import BenchmarkFixture
+
+from rack import ExportFormat, format_semtk_table, generate_constraints
+from rack.cache import CachedTable
+from synthetic import CDR_COLUMNS, ROWS
+
+@pytest.mark.parametrize("export_format", list(ExportFormat), ids=str)
+def test_format_semtk_table(benchmark: BenchmarkFixture, export_format: ExportFormat) -> None:
+    rows = [[f"REQ-{i:06}", f"Requirement {i}", f"The system shall handle case {i}, including \"quoted\" values", "synthetic-benchmark", "", ""]
+            for i in range(ROWS)]
+    table = CachedTable(CDR_COLUMNS, rows)
+
+    output = benchmark(format_semtk_table, table, export_format, True)
+    assert "REQ-000000" in output
+
+def test_generate_constraints(benchmark: BenchmarkFixture) -> None:
+    texts = []
+    for i in range(1000):
+        texts += [f"identifier~^REQ-{i}", f"title=Requirement {i}", f"count>={i}", f"date:{i}<=>{i + 10}"]
+
+    constraints = benchmark(generate_constraints, texts)
+    assert len(constraints) == len(texts)
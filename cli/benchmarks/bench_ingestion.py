@@ -0,0 +1,32 @@
+"""End-to-end benchmarks of data imports against the SemTK stand-in"""
+
+from pathlib import Path
+from typing import Iterator, Optional
+
+import pytest
+from pytest_benchmark.fixture import BenchmarkFixture
+
+from rack import ingest_data_driver, Url
+from rack.standin import StandIn, isolated_state
+from synthetic import ROWS, write_import
+
+# Simulated SemTK service times, in seconds per request and per row
+INGEST_LATENCY = 0.005
+ROW_LATENCY = 0.00001
+
+@pytest.fixture
+def standin(tmp_path: Path) -> Iterator[StandIn]:
+    """The in-memory SemTK of the tests, slowed down to the latencies above."""
+    with isolated_state(tmp_path), StandIn(latency={"ingest": INGEST_LATENCY}, row_latency=ROW_LATENCY).installed() as standin:
+        yield standin
+
+@pytest.mark.parametrize("jobs", [1, 4])
+@pytest.mark.parametrize("chunk_rows", [None, 500], ids=["whole", "chunked"])
+def test_ingest_data_driver(benchmark: BenchmarkFixture, tmp_path: Path, standin: StandIn, jobs: int, chunk_rows: Optional[int]) -> None:
+    config = write_import(tmp_path / "data", csvs=4)
+
+    def ingest() -> None:
+        ingest_data_driver(config, Url("http://localhost"), None, None, None, None, True, chunk_rows, jobs)
+
+    benchmark.pedantic(ingest, rounds=3, iterations=1)
+    assert sum(len(rows) for rows in standin.graph("http://rack001/bench").rows.values()) == 4 * ROWS
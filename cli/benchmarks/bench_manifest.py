@@ -0,0 +1,33 @@
+"""Benchmarks of reading and building ingestion packages"""
+
+from pathlib import Path
+
+from pytest_benchmark.fixture import BenchmarkFixture
+import yaml
+
+from rack import IngestionBuilder
+from rack.manifest import Manifest
+from rack.package import PackageWriter
+from synthetic import DEPTH, FANOUT, write_manifest_tree
+
+def test_ingestion_builder_manifest(benchmark: BenchmarkFixture, tmp_path: Path) -> None:
+    top = write_manifest_tree(tmp_path / "manifest", DEPTH, FANOUT)
+
+    def build() -> IngestionBuilder:
+        builder = IngestionBuilder(PackageWriter())
+        builder.manifest(top, True)
+        return builder
+
+    builder = benchmark(build)
+    assert len(builder.manifests) == sum(FANOUT ** level for level in range(DEPTH + 1))
+
+def test_manifest_from_yaml(benchmark: BenchmarkFixture) -> None:
+    steps = [{"data": f"data{i}/import.yaml"} if i % 2 else {"model": f"model{i}/model.yaml"} for i in range(1000)]
+    text = yaml.safe_dump({
+        "name": "bench",
+        "footprint": {"data-graphs": [f"http://rack001/data{i}" for i in range(50)], "nodegroups": ["^query "]},
+        "steps": steps,
+    })
+
+    manifest = benchmark(Manifest.fromYAML, text)
+    assert len(manifest.steps) == len(steps)
@@ -0,0 +1,96 @@
+"""Synthetic RACK inputs of configurable size for the benchmarks.
+
+Sizes are read from the environment so the same suite can run as a quick
+check or as a load test:
+
+    RACK_BENCH_ROWS     rows of every generated CSV (default: 2000)
+    RACK_BENCH_CLASSES  classes of every generated OWL file (default: 200)
+    RACK_BENCH_DEPTH    levels of nested manifests (default: 2)
+    RACK_BENCH_FANOUT   manifests included by every manifest (default: 3)
+"""
+
+import csv
+import os
+from pathlib import Path
+from typing import List
+
+import yaml
+
+ROWS = int(os.environ.get('RACK_BENCH_ROWS') or 2000)
+CLASSES = int(os.environ.get('RACK_BENCH_CLASSES') or 200)
+DEPTH = int(os.environ.get('RACK_BENCH_DEPTH') or 2)
+FANOUT = int(os.environ.get('RACK_BENCH_FANOUT') or 3)
+
+# Columns of the generated CDR CSVs, after those of REQUIREMENT ingestion
+CDR_COLUMNS = ['identifier', 'title', 'description', 'dataInsertedBy_identifier', 'satisfies_identifier', 'wasDerivedFrom_identifier']
+
+def write_cdr_csv(path: Path, rows: int = ROWS, prefix: str = 'REQ') -> Path:
+    """A CDR CSV whose rows refer to each other, as exported requirements do."""
+    with open(path, mode='w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CDR_COLUMNS)
+        for i in range(rows):
+            writer.writerow([
+                f'{prefix}-{i:06}',
+                f'Requirement {i}',
+                f'The system shall handle case {i}, including "quoted" values',
+                'synthetic-benchmark',
+                f'{prefix}-{i // 10:06}' if i >= 10 else '',
+                f'{prefix}-{i - 1:06}' if i else '',
+            ])
+    return path
+
+def write_owl(path: Path, classes: int = CLASSES, prefix: str = 'Bench') -> Path:
+    """An OWL file declaring a chain of subclasses, each with a property."""
+    base = f'http://arcos.rack/{prefix}'
+    lines = [
+        '<?xml version="1.0"?>',
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"',
+        '    xmlns:rdfs="http://www.w3.org/2000/01/rdf-schema#"',
+        '    xmlns:owl="http://www.w3.org/2002/07/owl#"',
+        f'    xml:base="{base}">',
+        f'  <owl:Ontology rdf:about="{base}"/>',
+    ]
+    for i in range(classes):
+        lines.append(f'  <owl:Class rdf:about="{base}#C{i}">')
+        if i:
+            lines.append(f'    <rdfs:subClassOf rdf:resource="{base}#C{i - 1}"/>')
+        lines.append('  </owl:Class>')
+        lines.append(f'  <owl:DatatypeProperty rdf:about="{base}#p{i}"><rdfs:domain rdf:resource="{base}#C{i}"/></owl:DatatypeProperty>')
+    lines.append('</rdf:RDF>')
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return path
+
+def write_import(directory: Path, csvs: int = 2, rows: int = ROWS, data_graph: str = 'http://rack001/bench') -> Path:
+    """A data import.yaml ingesting csvs generated CSV files, half by
+    nodegroup and half by class."""
+    directory.mkdir(parents=True, exist_ok=True)
+    steps: List[dict] = []
+    for i in range(csvs):
+        name = f'REQ{i}.csv'
+        write_cdr_csv(directory / name, rows, f'REQ{i}')
+        if i % 2:
+            steps.append({'class': 'http://arcos.rack/REQUIREMENTS#REQUIREMENT', 'csv': name})
+        else:
+            steps.append({'nodegroup': 'ingest_REQUIREMENT', 'csv': name})
+    config = directory / 'import.yaml'
+    config.write_text(yaml.safe_dump({'data-graph': data_graph, 'ingestion-steps': steps}), encoding='utf-8')
+    return config
+
+def write_manifest_tree(directory: Path, depth: int = DEPTH, fanout: int = FANOUT, rows: int = ROWS, name: str = 'bench') -> Path:
+    """A manifest with a model and a data step that includes fanout manifests
+    of the same shape, depth levels deep. Returns the top-level manifest."""
+    directory.mkdir(parents=True, exist_ok=True)
+    write_owl(directory / 'model.owl', prefix=name)
+    (directory / 'model.yaml').write_text(yaml.safe_dump({'files': ['model.owl']}), encoding='utf-8')
+    write_import(directory / 'data', rows=rows, data_graph=f'http://rack001/{name}')
+
+    steps: List[dict] = [{'model': 'model.yaml'}, {'data': 'data/import.yaml'}]
+    if depth > 0:
+        for i in range(fanout):
+            child = write_manifest_tree(directory / f'sub{i}', depth - 1, fanout, rows, f'{name}_{i}')
+            steps.append({'manifest': f'sub{i}/{child.name}'})
+
+    manifest = directory / 'manifest.yaml'
+    manifest.write_text(yaml.safe_dump({'name': name, 'description': 'Synthetic benchmark manifest', 'steps': steps}), encoding='utf-8')
+    return manifest
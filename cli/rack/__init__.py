@@ -17,29 +17,51 @@ This simple process can be adapted to import other data into RACK for experiment
 """
 # standard imports
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 import csv
 from enum import Enum, unique
+import gzip
+import json
 from io import StringIO
 import logging
 from os import environ
 from pathlib import Path
+import posixpath
 import re
 import sys
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TypeVar, cast
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple, TypeVar, cast
 from types import SimpleNamespace
 from tempfile import TemporaryDirectory
 import shutil
+from zipfile import ZipFile
 
 # library imports
 from colorama import Fore, Style
-from jsonschema import validate
-from tabulate import tabulate
-import requests
-import semtk3
-from semtk3.semtktable import SemtkTable
-import yaml
-
-from rack.manifest import Manifest
+
+from rack.lazy import lazy_import
+
+# Heavy libraries are loaded on first use, so that each subcommand (and
+# `rack --help`) only pays for the ones it needs
+if TYPE_CHECKING:
+    import semtk3
+    from semtk3.semtktable import SemtkTable
+    import yaml
+else:
+    semtk3 = lazy_import('semtk3')
+    yaml = lazy_import('yaml')
+
+from rack.cache import ALL_GRAPHS, CachedTable, QueryCache, invalidate_graphs
+from rack.cardinality import CONCISE_COLUMNS, DEFAULT_CARDINALITY_JOBS, DEFAULT_SLOWEST, VIOLATION_COLUMNS, concise_row, list_restrictions, run_checks
+from rack.ledger import NODEGROUP_STORE, IngestionLedger, PackageHasher, mark_changed, record_loaded, write_reduced_package
+from rack.manifest import Manifest, find_toplevel_manifest
+from rack.nodegroups import DEFAULT_NODEGROUP_JOBS, LocalItem, NodegroupIndex, NodegroupSyncError, current_index, item_type_name, plan_sync, read_store_data, run_batch, store_item, write_store_data
+from rack.package import DEFAULT_COMPRESSION_LEVEL, BuildCache, PackageWriter
+from rack.profile import Profile, ProfileStep, add_step, compare_profiles, profile_step, profiling
+from rack.progress import IngestionProgress, format_bytes, plan_progress_steps
+from rack.server import DEFAULT_SOCKET_PATH
+from rack.session import DEFAULT_BACKOFF, DEFAULT_RETRIES, get_session
 from rack.types import Connection, Url
 from rack.defaults import *
 
@@ -68,11 +90,34 @@ class ExportFormat(Enum):
     """Enumeration of data export formats"""
     TEXT = "text"  # plain text
     CSV = "csv"  # comma-separated values
+    TSV = "tsv"  # tab-separated values
 
     def __str__(self) -> str:
         """For inclusion in --help"""
         return self.value
 
+@unique
+class IngestionStep(Enum):
+    """Enumeration of the kinds of ingestion-steps in a data import.yaml"""
+    OWL = "owl"
+    CLASS = "class"
+    NODEGROUP = "nodegroup"
+    NODEGROUP_JSON = "nodegroup_json"
+    COUNT = "count"
+
+    @staticmethod
+    def of(step: Dict[str, Any]) -> 'IngestionStep':
+        """Classify a step that validated against INGEST_CSV_CONFIG_SCHEMA"""
+        if 'owl' in step:
+            return IngestionStep.OWL
+        if 'nodegroup_json' in step:
+            return IngestionStep.NODEGROUP_JSON
+        if 'count' in step:
+            return IngestionStep.COUNT
+        if 'class' in step:
+            return IngestionStep.CLASS
+        return IngestionStep.NODEGROUP
+
 INGEST_CSV_CONFIG_SCHEMA: Dict[str, Any] = {
     'type': 'object',
     'additionalProperties': False,
@@ -160,6 +205,25 @@ INGEST_OWL_CONFIG_SCHEMA: Dict[str, Any] = {
     }
 }
 
+# Compiled validators, so that each schema is checked only once per process
+config_validators: Dict[int, Any] = {}
+
+def validate_config(config: Any, schema: Dict[str, Any]) -> None:
+    """Validate a configuration like jsonschema.validate, but reuse the
+    compiled validator for the schema."""
+    from jsonschema.exceptions import best_match
+    from jsonschema.validators import validator_for
+
+    validator = config_validators.get(id(schema))
+    if validator is None:
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        validator = cls(schema)
+        config_validators[id(schema)] = validator
+    error = best_match(validator.iter_errors(config))
+    if error is not None:
+        raise error
+
 def str_good(s: str) -> str:
     return Fore.GREEN + s + Style.RESET_ALL
 
@@ -217,6 +281,7 @@ def sparql_connection(base_url: Url, model_graphs: Optional[List[Url]], data_gra
     """Generate a SPARQL connection value."""
 
     semtk3.set_host(base_url)
+    get_session()
     # Default to RACK in a Box triple-store location
     model_graphs = model_graphs or [MODEL_GRAPH]
     data_graph = data_graph or DEFAULT_DATA_GRAPH
@@ -228,17 +293,46 @@ def clear_graph(conn: Connection, which_graph: Graph = Graph.DATA) -> None:
     """Clear all the existing data in the data or model graph"""
     semtk3.clear_graph(conn, which_graph.value, 0)
 
-def format_semtk_table(semtk_table: SemtkTable, export_format: ExportFormat = ExportFormat.TEXT, headers: bool = True) -> str:
+def forget_cleared_graphs(triple_store: Optional[Url], graphs: List[Url]) -> None:
+    """Drop cleared graphs from the ingestion ledger so that their packages load
+    again, and retire cached query results that read from them"""
+    ledger = IngestionLedger()
+    ledger.forget_graphs(triple_store or DEFAULT_TRIPLE_STORE, graphs)
+    ledger.save()
+    invalidate_graphs(graphs)
+
+def forget_nodegroup_store() -> None:
+    """Drop the nodegroups steps from the ingestion ledger once stored items
+    were deleted, so that their packages store them again, and retire cached
+    query results that read from the store. The store belongs to SemTK rather
+    than to a triple store, so this applies to every triple store."""
+    ledger = IngestionLedger()
+    for triple_store in list(ledger.entries):
+        ledger.forget_graphs(Url(triple_store), [NODEGROUP_STORE])
+    ledger.save()
+    invalidate_graphs([NODEGROUP_STORE])
+
+def export_delimiter(export_format: ExportFormat) -> str:
+    return '\t' if export_format == ExportFormat.TSV else ','
+
+def open_export_file(path: Path) -> TextIO:
+    """Open an export output file, compressing it when the name ends in .gz"""
+    if path.suffix == '.gz':
+        return gzip.open(path, mode='wt', encoding='utf-8', newline='')
+    return open(path, mode='w', encoding='utf-8', newline='')
+
+def format_semtk_table(semtk_table: 'SemtkTable', export_format: ExportFormat = ExportFormat.TEXT, headers: bool = True) -> str:
 
     if export_format == ExportFormat.TEXT:
+        from tabulate import tabulate
         if headers is True:
             return tabulate(semtk_table.get_rows(), headers=semtk_table.get_column_names())
         else:
             return tabulate(semtk_table.get_rows())
 
-    elif export_format == ExportFormat.CSV:
+    elif export_format in (ExportFormat.CSV, ExportFormat.TSV):
         output = StringIO()
-        writer = csv.writer(output)
+        writer = csv.writer(output, delimiter=export_delimiter(export_format))
         if headers is True:
             writer.writerow(semtk_table.get_column_names())
         for row in semtk_table.get_rows():
@@ -276,110 +370,294 @@ def generate_constraints(constraint_texts: List[str]) -> List[Any]:
 
     return result
 
-def run_query(conn: Connection, nodegroup: str, export_format: ExportFormat = ExportFormat.TEXT, headers: bool = True, path: Optional[Path] = None, constraints: Optional[List[str]] = None) -> None:
+def sparql_id(item: Dict[str, Any]) -> str:
+    return str(item.get('SparqlID') or item.get('sparqlID') or '')
+
+def unordered_columns(nodegroup: str) -> Optional[List[str]]:
+    """The columns returned by a stored nodegroup that its ORDER BY leaves
+    out, or None when the nodegroup is not in the store. LIMIT/OFFSET pages
+    only partition the results when this is empty: without a total order
+    the triple store may return rows in a different order for every page."""
+    with TemporaryDirectory() as tmpdir:
+        semtk3.retrieve_items_from_store('^' + re.escape(nodegroup) + '$', tmpdir, semtk3.STORE_ITEM_TYPE_NODEGROUP)
+        items = read_store_data(Path(tmpdir))
+    if not items:
+        return None
+    obj = json.loads(items[0].json_str or '{}')
+    sng = obj.get('sNodeGroup', obj)
+    returned = []
+    for node in sng.get('sNodeList', []):
+        for item in [node] + node.get('propList', []):
+            if item.get('isReturned'):
+                returned.append(sparql_id(item))
+            if item.get('isBindingReturned') and item.get('binding'):
+                returned.append(str(item['binding']))
+    ordered = {sparql_id(entry) for entry in sng.get('orderBy', [])}
+    return [column for column in returned if column not in ordered]
+
+def select_pages(nodegroup: str, runtime_constraints: List[Any], page_size: int) -> Iterator['SemtkTable']:
+    """Run a select query one LIMIT/OFFSET page at a time until a short page
+    comes back. The nodegroup must order its rows, see unordered_columns."""
+    offset = 0
+    while True:
+        semtk_table = semtk3.select_by_id(nodegroup, limit_override=page_size, offset_override=offset, runtime_constraints=runtime_constraints)
+        yield semtk_table
+        if len(semtk_table.get_rows()) < page_size:
+            return
+        offset += page_size
+
+def stream_query(pages: Iterable['SemtkTable'], out: TextIO, export_format: ExportFormat, headers: bool) -> None:
+    """Write query results to out page by page, so only one page is held in memory."""
+    writer = csv.writer(out, delimiter=export_delimiter(export_format))
+    for (i, semtk_table) in enumerate(pages):
+        if i == 0 and headers:
+            writer.writerow(semtk_table.get_column_names())
+        writer.writerows(semtk_table.get_rows())
+
+def run_query(conn: Connection, nodegroup: str, export_format: ExportFormat = ExportFormat.TEXT, headers: bool = True, path: Optional[Path] = None, constraints: Optional[List[str]] = None, page_size: Optional[int] = None, cache: Optional[QueryCache] = None) -> None:
     semtk3.SEMTK3_CONN_OVERRIDE = conn
 
     runtime_constraints = generate_constraints(constraints or [])
 
-    semtk_table = semtk3.select_by_id(nodegroup, runtime_constraints=runtime_constraints)
+    if page_size is not None:
+        if export_format == ExportFormat.TEXT:
+            print(str_bad('Paged export requires the csv or tsv format'))
+            sys.exit(1)
+        gaps = unordered_columns(nodegroup)
+        pages: Iterable['SemtkTable']
+        if gaps is None or gaps:
+            logger.warning('Nodegroup %s does not order its results by %s, so pages could overlap or miss rows; exporting it in a single query',
+                           nodegroup, ', '.join(gaps) if gaps else 'all returned columns')
+            pages = [semtk3.select_by_id(nodegroup, runtime_constraints=runtime_constraints)]
+        else:
+            pages = select_pages(nodegroup, runtime_constraints, page_size)
+        if path is None:
+            stream_query(pages, sys.stdout, export_format, headers)
+        else:
+            with open_export_file(path) as f:
+                stream_query(pages, f, export_format, headers)
+        return
+
+    if cache is None:
+        semtk_table = semtk3.select_by_id(nodegroup, runtime_constraints=runtime_constraints)
+    else:
+        key = cache.key('select', conn, nodegroup, runtime_constraints)
+        semtk_table = cache.get_table(key)
+        if semtk_table is None:
+            semtk_table = semtk3.select_by_id(nodegroup, runtime_constraints=runtime_constraints)
+            cache.put_table(key, semtk_table)
+        else:
+            logger.debug('Using cached results for %s', nodegroup)
+
     formatted_table = format_semtk_table(semtk_table, export_format=export_format, headers=headers)
     if path is None:
         print(formatted_table)
     else:
-        with open(path, mode='w', encoding='utf-8') as f:
+        with open_export_file(path) as f:
             print(formatted_table, file=f)
 
-def run_count_query(conn: Connection, nodegroup: str, constraints: Optional[List[str]] = None) -> None:
+def run_count_query(conn: Connection, nodegroup: str, constraints: Optional[List[str]] = None, cache: Optional[QueryCache] = None) -> None:
     semtk3.SEMTK3_CONN_OVERRIDE = conn
 
     runtime_constraints = generate_constraints(constraints or [])
 
-    semtk_table = semtk3.count_by_id(nodegroup, runtime_constraints=runtime_constraints)
-    print(semtk_table.get_rows()[0][0])
+    if cache is None:
+        print(semtk3.count_by_id(nodegroup, runtime_constraints=runtime_constraints).get_rows()[0][0])
+        return
 
-def ingest_csv(conn: Connection, nodegroup: str, csv_name: Path) -> None:
-    """Ingest a CSV file using the named nodegroup."""
+    key = cache.key('count', conn, nodegroup, runtime_constraints)
+    count = cache.get(key)
+    if count is None:
+        count = semtk3.count_by_id(nodegroup, runtime_constraints=runtime_constraints).get_rows()[0][0]
+        cache.put(key, count)
+    else:
+        logger.debug('Using cached count for %s', nodegroup)
+    print(count)
+
+def iter_csv_chunks(csv_name: Path, chunk_rows: int) -> Iterator[str]:
+    """Read a CSV file in chunks of at most chunk_rows records, each chunk
+    starting with a copy of the header line. Records are kept byte-for-byte,
+    including quoted fields that span multiple lines."""
+
+    with open(csv_name, mode='r', encoding='utf-8-sig', newline='') as csv_file:
+
+        def records() -> Iterator[str]:
+            record = ''
+            quotes = 0
+            for line in csv_file:
+                record += line
+                quotes += line.count('"')
+                # a record is complete once its quotes are balanced
+                if quotes % 2 == 0:
+                    yield record
+                    record = ''
+                    quotes = 0
+            if record:
+                yield record
+
+        reader = records()
+        header = next(reader, None)
+        if header is None:
+            return
+        if not header.endswith('\n'):
+            header += '\n'
+
+        chunk: List[str] = []
+        for record in reader:
+            chunk.append(record)
+            if len(chunk) == chunk_rows:
+                yield header + ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield header + ''.join(chunk)
+
+def combine_ingestion_status(messages: List[str]) -> str:
+    """Combine the status messages of several ingestion calls by summing the
+    counts they report. Messages that do not share a common shape are joined."""
+
+    if len(messages) == 1:
+        return messages[0]
+
+    number_re = re.compile(r'\d+')
+    templates = {number_re.sub('#', str(m)) for m in messages}
+    if len(templates) != 1:
+        return '; '.join(str(m) for m in messages)
+
+    totals = [sum(column) for column in zip(*([int(n) for n in number_re.findall(str(m))] for m in messages))]
+    counts = iter(totals)
+    return number_re.sub(lambda _: str(next(counts)), str(messages[0]))
+
+IngestFunction = Callable[[str], Tuple[Any, Optional[str]]]
+
+def ingest_csv_chunks(ingest: IngestFunction, csv_name: Path, chunk_rows: Optional[int], target: str = '') -> Tuple[str, List[str]]:
+    """Send a CSV file to an ingestion function either whole or, when chunk_rows
+    is set, in chunks of at most chunk_rows records. Returns the combined
+    status message and the warnings of all chunks."""
+
+    if chunk_rows is None:
+        with open(csv_name, mode='r', encoding='utf-8-sig') as csv_file:
+            chunks: Iterable[str] = [csv_file.read()]
+    else:
+        chunks = iter_csv_chunks(csv_name, chunk_rows)
 
-    def suffix(result: dict) -> str:
+    messages = []
+    warnings = []
+    with profile_step('csv', target, csv_name.name) as profiled:
+        for (i, chunk) in enumerate(chunks):
+            profiled.bytes += len(chunk.encode('utf-8'))
+            try:
+                (statusMsg, warningMsg) = ingest(chunk)
+            except Exception:
+                if chunk_rows is not None:
+                    logger.error('Ingestion failed on chunk %d (starting at record %d); earlier chunks were loaded', i + 1, i * chunk_rows + 1)
+                raise
+            messages.append(statusMsg)
+            if warningMsg:
+                if chunk_rows is not None:
+                    warnings.append(f'Chunk {i + 1} (starting at record {i * chunk_rows + 1}):')
+                warnings.extend(warningMsg.rstrip().split("\n"))
+
+        status = combine_ingestion_status(messages)
+        # The record count is the first number SemTK reports
+        records = re.search(r'\d+', status)
+        profiled.rows = int(records.group()) if records else None
+        profiled.warnings = len([m for m in warnings if not m.startswith('Chunk ')])
+
+    if chunk_rows is not None and len(messages) != 1:
+        return (f'{status} Chunks: {len(messages)}', warnings)
+    return (status, warnings)
+
+def load_csv(conn: Connection, nodegroup: str, csv_name: Path, chunk_rows: Optional[int] = None) -> Tuple[str, List[str]]:
+    """Load a CSV file using the named nodegroup without reporting status."""
+    return ingest_csv_chunks(lambda csv: semtk3.ingest_by_id(nodegroup, csv, conn), csv_name, chunk_rows, nodegroup)
+
+def load_csv_by_class(conn: Connection, classuri: str, csv_name: Path, chunk_rows: Optional[int] = None) -> Tuple[str, List[str]]:
+    """Load a CSV file using the automatic class ingestion without reporting status."""
+    return ingest_csv_chunks(lambda csv: semtk3.ingest_using_class_template(classuri, csv, conn), csv_name, chunk_rows, classuri)
+
+def report_csv_load(label: str, load: Callable[[], Tuple[str, List[str]]]) -> None:
+    """Run or wait for a CSV load under a Loading status line, logging its warnings."""
+
+    def suffix(result: str) -> str:
         return f' Records: {result}'
 
-    @with_status(f'Loading {str_highlight(nodegroup)}', suffix)
-    def go() -> dict:
-        with open(csv_name, mode='r', encoding='utf-8-sig') as csv_file:
-            csv = csv_file.read()
-
-        (statusMsg, warningMsg) = semtk3.ingest_by_id(nodegroup, csv, conn)
-        if (warningMsg):
-            for m in ["Ingestion Warnings:"] + warningMsg.rstrip().split("\n"):
+    @with_status(f'Loading {str_highlight(label)}', suffix)
+    def go() -> str:
+        (statusMsg, warnings) = load()
+        if warnings:
+            for m in ["Ingestion Warnings:"] + warnings:
                 logger.warning(m)
         return statusMsg
     go()
 
-def ingest_csv_by_class(conn: Connection, classuri: str, csv_name: Path) -> None:
-    """Ingest a CSV file using the automatic class ingestion."""
-
-    def suffix(result: dict) -> str:
-        return f' Records: {result}'
-
-    @with_status(f'Loading {str_highlight(classuri)}', suffix)
-    def go() -> dict:
-        with open(csv_name, mode='r', encoding='utf-8-sig') as csv_file:
-            csv = csv_file.read()
+def ingest_csv(conn: Connection, nodegroup: str, csv_name: Path, chunk_rows: Optional[int] = None) -> None:
+    """Ingest a CSV file using the named nodegroup."""
+    report_csv_load(nodegroup, lambda: load_csv(conn, nodegroup, csv_name, chunk_rows))
 
-        (statusMsg, warningMsg) = semtk3.ingest_using_class_template(classuri, csv, conn)
-        if (warningMsg):
-            for m in ["Ingestion Warnings:"] + warningMsg.rstrip().split("\n"):
-                logger.warning(m)
-        return statusMsg
-    go()
+def ingest_csv_by_class(conn: Connection, classuri: str, csv_name: Path, chunk_rows: Optional[int] = None) -> None:
+    """Ingest a CSV file using the automatic class ingestion."""
+    report_csv_load(classuri, lambda: load_csv_by_class(conn, classuri, csv_name, chunk_rows))
 
 def ingest_owl(conn: Connection, owl_file: Path) -> None:
     """Upload an OWL file into the model graph."""
     @with_status(f'Ingesting {str_highlight(str(owl_file))}')
     def go() -> None:
         return semtk3.upload_owl(owl_file, conn, "rack", "rack")
-    go()
+    with profile_step('owl', '', owl_file.name, owl_file.stat().st_size):
+        go()
 
 def utility_copygraph_driver(base_url: Url, triple_store: Optional[Url], triple_store_type: Optional[str], from_graph: Url, to_graph: Url) -> None:
     semtk3.set_host(base_url)
+    get_session()
     triple_store = triple_store or DEFAULT_TRIPLE_STORE
     triple_store_type = triple_store_type or DEFAULT_TRIPLE_STORE_TYPE
 
     @with_status(f'Copying {str_highlight(from_graph)} to {str_highlight(to_graph)}')
     def go() -> dict:
         return semtk3.copy_graph(from_graph, to_graph, triple_store, triple_store_type, triple_store, triple_store_type)
-    go()
+    try:
+        go()
+    finally:
+        invalidate_graphs([to_graph])
 
 class IngestionBuilder:
-    def __init__(self, base_dir: str) -> None:
+    def __init__(self, package: PackageWriter) -> None:
         self.fresh: int = 0
         self.model_graphs: Set[str] = set()
         self.data_graphs: Set[str] = set()
         self.manifests: Set[Path] = set()
         self.steps: List[Any] = []
-        self.base_dir: Path = Path(base_dir)
+        self.package: PackageWriter = package
+        self.nodegroup_dirs: Dict[Tuple[Tuple[str, str], ...], str] = {}
 
     def next_fresh(self) -> int:
         result = self.fresh
         self.fresh = result + 1
         return result
 
+    def add_file(self, from_path: Path, to_dir: str) -> str:
+        """Add a file to the package, returning the path a YAML file in to_dir
+        uses to refer to it (which leads elsewhere for duplicate files)."""
+        stored = self.package.add_file(posixpath.join(to_dir, from_path.name), from_path)
+        return posixpath.relpath(stored, to_dir)
+
+    def add_yaml(self, obj: Any, to_path: str) -> None:
+        self.package.add_bytes(to_path, yaml.safe_dump(obj).encode('utf-8-sig'))
+
     def model(
         self,
         from_path: Path,
-        to_path: Path,
+        to_path: str,
     ) -> None:
         with open(from_path, mode='r', encoding='utf-8-sig') as f:
             obj = yaml.safe_load(f)
 
         frombase = from_path.parent
-        tobase = to_path.parent
+        tobase = posixpath.dirname(to_path)
 
         files = obj['files']
         for (i,file) in enumerate(files):
-            file = Path(file)
-            shutil.copyfile(frombase.joinpath(file), tobase.joinpath(file.name), follow_symlinks=True)
-            files[i] = file.name
+            files[i] = self.add_file(frombase.joinpath(file), tobase)
 
         c = obj.get('model-graphs')
         if c is None:
@@ -389,28 +667,23 @@ class IngestionBuilder:
         elif isinstance(c, list):
             self.model_graphs.update(c)
 
-        with open(to_path, mode='w', encoding='utf-8-sig', newline='\n') as out:
-            yaml.safe_dump(obj, out)
+        self.add_yaml(obj, to_path)
 
     def data(
         self,
         from_path: Path,
-        to_path: Path,
+        to_path: str,
     ) -> None:
         with open(from_path, mode='r', encoding='utf-8-sig') as f:
             obj = yaml.safe_load(f)
         frombase = from_path.parent
-        tobase = to_path.parent
+        tobase = posixpath.dirname(to_path)
 
         for step in obj['ingestion-steps']:
             if 'owl' in step:
-                path = Path(step['owl'])
-                shutil.copyfile(frombase.joinpath(path), tobase.joinpath(path.name), follow_symlinks=True)
-                step['owl'] = path.name
+                step['owl'] = self.add_file(frombase.joinpath(step['owl']), tobase)
             if 'csv' in step:
-                path = Path(step['csv'])
-                shutil.copyfile(frombase.joinpath(path), tobase.joinpath(path.name), follow_symlinks=True)
-                step['csv'] = path.name
+                step['csv'] = self.add_file(frombase.joinpath(step['csv']), tobase)
 
         self.data_graphs.add(obj.get('data-graph', DEFAULT_DATA_GRAPH))
 
@@ -425,25 +698,34 @@ class IngestionBuilder:
             elif isinstance(c, list):
                 self.model_graphs.update(c)
 
-        with open(to_path, mode='w', encoding='utf-8-sig', newline='\n') as out:
-            yaml.safe_dump(obj, out)
+        self.add_yaml(obj, to_path)
 
     def nodegroups(
         self,
         from_path: Path,
-        to_path: Path,
-    ) -> None:
-        shutil.copyfile(from_path.joinpath('store_data.csv'), to_path.joinpath('store_data.csv'), follow_symlinks=True)
+        to_dir: str,
+    ) -> str:
+        """Add a nodegroups directory to the package, returning the directory
+        the step should use. A directory identical to one already added is
+        shared rather than stored again."""
+        files = ['store_data.csv']
         with open(from_path.joinpath('store_data.csv'), 'r') as f:
             for row in csv.DictReader(f):
-                json = row['jsonFile']
-                shutil.copyfile(from_path.joinpath(json), to_path.joinpath(json), follow_symlinks=True)
+                files.append(row['jsonFile'])
+
+        contents = tuple(sorted((file, self.package.digest(from_path.joinpath(file).resolve())) for file in files))
+        existing = self.nodegroup_dirs.get(contents)
+        if existing is not None:
+            self.package.duplicates += len(files)
+            return existing
+        self.nodegroup_dirs[contents] = to_dir
 
-    def new_directory(self, name: str, kind: str) -> Tuple[Path, Path]:
-        dirname = Path(name) / Path(f'{self.next_fresh():02}_{kind}')
-        subdir = self.base_dir / dirname
-        subdir.mkdir(parents=True, exist_ok=False)
-        return dirname, subdir
+        for file in files:
+            self.package.add_bytes(posixpath.join(to_dir, file), from_path.joinpath(file).read_bytes())
+        return to_dir
+
+    def new_directory(self, name: str, kind: str) -> str:
+        return posixpath.join(name, f'{self.next_fresh():02}_{kind}')
 
     def manifest(
         self,
@@ -473,46 +755,56 @@ class IngestionBuilder:
             else:
                 if manifest_dir is None:
                     manifest_dir = f'{self.next_fresh():02}_{manifest_name}'
-                    self.base_dir.joinpath(manifest_dir).mkdir()
 
                 if 'model' in step:
                     path = Path(step['model'])
-                    dirname, subdir = self.new_directory(manifest_dir, 'model')
-                    self.model(from_base / path, subdir / path.name)
-                    self.steps.append({"model": dirname.joinpath(path.name).as_posix()})
+                    dirname = self.new_directory(manifest_dir, 'model')
+                    self.model(from_base / path, posixpath.join(dirname, path.name))
+                    self.steps.append({"model": posixpath.join(dirname, path.name)})
 
                 elif 'data' in step:
                     path = Path(step['data'])
-                    dirname, subdir = self.new_directory(manifest_dir, 'data')
-                    self.data(from_base / path, subdir / path.name)
-                    self.steps.append({'data': dirname.joinpath(path.name).as_posix()})
+                    dirname = self.new_directory(manifest_dir, 'data')
+                    self.data(from_base / path, posixpath.join(dirname, path.name))
+                    self.steps.append({'data': posixpath.join(dirname, path.name)})
 
                 elif 'nodegroups' in step:
                     path = Path(step['nodegroups'])
-                    dirname, subdir = self.new_directory(manifest_dir, 'nodegroups')
-                    self.nodegroups(from_base / path, subdir)
-                    self.steps.append({'nodegroups': dirname.as_posix()})
+                    dirname = self.new_directory(manifest_dir, 'nodegroups')
+                    self.steps.append({'nodegroups': self.nodegroups(from_base / path, dirname)})
         
         if is_top_level:
             obj['steps'] = self.steps
-            with open(self.base_dir / 'manifest.yaml', mode='w', encoding='utf-8-sig', newline='\n') as out:
-                yaml.safe_dump(obj, out)
+            self.add_yaml(obj, 'manifest.yaml')
 
 def build_manifest_driver(
     manifest_path: Path,
-    zipfile_path: Path
+    zipfile_path: Path,
+    compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+    jobs: Optional[int] = None,
+    build_cache: Optional[Path] = None,
 ) -> None:
 
-    with TemporaryDirectory() as outdir:
-        builder = IngestionBuilder(outdir)
-        builder.manifest(manifest_path, True)
-        shutil.make_archive(str(zipfile_path), 'zip', outdir)
+    cache = BuildCache(build_cache) if build_cache is not None else None
+    package = PackageWriter(cache)
+    builder = IngestionBuilder(package)
+    builder.manifest(manifest_path, True)
+    # Like shutil.make_archive, which this used to call, add the .zip suffix
+    package_path = Path(f'{zipfile_path}.zip')
+    digest = package.write(package_path, compression_level, jobs)
+
+    if package.duplicates:
+        print(f'Stored {package.duplicates} duplicate files only once')
+    if cache is not None:
+        print(f'Build cache: reused {cache.hits} compressed files, compressed {cache.misses}')
 
-        for x in builder.model_graphs:
-            print(f'Model graph: {x}')
+    print(f'Package {str_highlight(str(package_path))} SHA-256: {digest}')
 
-        for x in builder.data_graphs:
-            print(f'Data graph: {x}')
+    for x in builder.model_graphs:
+        print(f'Model graph: {x}')
+
+    for x in builder.data_graphs:
+        print(f'Data graph: {x}')
 
 
 def ingest_manifest_driver(
@@ -521,42 +813,139 @@ def ingest_manifest_driver(
     triple_store_type: Optional[str],
     clear: bool,
     optimize: bool,
-    optimization_url: Optional[Url] = None) -> None:
-
-    manifest = Manifest.getToplevelManifest(manifest_path)
-
-    resp = semtk3.load_ingestion_package(
-        triple_store or DEFAULT_TRIPLE_STORE,
-        triple_store_type or DEFAULT_TRIPLE_STORE_TYPE,
-        manifest_path,
-        clear,
-        MODEL_GRAPH,
-        DEFAULT_DATA_GRAPH,
-    )
-
-    loglevel = logger.getEffectiveLevel()
-    for line_bytes in resp.iter_lines():
-        level, _, msg = line_bytes.decode().partition(': ')
-        if level == "INFO" and logging.INFO >= loglevel:
-            print(msg)
-        elif level == "DEBUG" and logging.DEBUG >= loglevel:
-            print("Debug: " + str_highlight(msg))
-        elif level == "WARNING" and logging.WARNING >= loglevel:
-            print(str_warn("Warning: " + msg))
-        elif level == "ERROR" and logging.ERROR >= loglevel:
-            print("Error: " + str_bad(msg))
+    optimization_url: Optional[Url] = None,
+    force: bool = False,
+    progress_json: Optional[Path] = None) -> None:
+
+    triple_store = triple_store or DEFAULT_TRIPLE_STORE
+    get_session()
+
+    with ZipFile(manifest_path) as package_zip, TemporaryDirectory() as tmpdir:
+        hasher = PackageHasher(package_zip)
+        plan = hasher.plan(find_toplevel_manifest(hasher.names))
+        manifest = plan.manifest
+
+        ledger = IngestionLedger()
+        if clear:
+            ledger.forget_graphs(triple_store, manifest.getModelgraphsFootprint() + manifest.getDatagraphsFootprint())
+
+        if not mark_changed(plan, ledger, triple_store, force or clear):
+            ledger.save()
+            if progress_json is not None:
+                unchanged_progress = IngestionProgress([], progress_json)
+                unchanged_progress.start()
+                unchanged_progress.finish('unchanged')
+            print(f'Ingestion package {str_highlight(manifest.getName())} is unchanged since its last import (use --force to reload)')
+            return
+
+        package_path = manifest_path
+        unchanged = list(plan.unchanged_steps())
+        if unchanged:
+            for step in unchanged:
+                print(f'Skipping unchanged {str_highlight(step.key)}')
+            package_path = Path(tmpdir) / manifest_path.name
+            write_reduced_package(hasher, plan, package_path)
+
+        progress = IngestionProgress(plan_progress_steps(hasher, plan), progress_json)
+        print(f'Loading {len(progress.steps)} steps, {format_bytes(progress.total_bytes)} and {progress.total_rows:,} rows')
+        progress.start()
+
+        failed = False
+        status = 'failed'
+        try:
+            resp = semtk3.load_ingestion_package(
+                triple_store,
+                triple_store_type or DEFAULT_TRIPLE_STORE_TYPE,
+                package_path,
+                clear,
+                MODEL_GRAPH,
+                DEFAULT_DATA_GRAPH,
+            )
+
+            loglevel = logger.getEffectiveLevel()
+            for line_bytes in resp.iter_lines():
+                level, _, msg = line_bytes.decode().partition(': ')
+                if level == "INFO" and logging.INFO >= loglevel:
+                    print(msg)
+                elif level == "DEBUG" and logging.DEBUG >= loglevel:
+                    print("Debug: " + str_highlight(msg))
+                elif level == "WARNING" and logging.WARNING >= loglevel:
+                    print(str_warn("Warning: " + msg))
+                elif level == "ERROR" and logging.ERROR >= loglevel:
+                    print("Error: " + str_bad(msg))
+                failed = failed or level == "ERROR"
+
+                report = progress.observe(level, msg)
+                if report is not None and logging.INFO >= loglevel:
+                    print(str_highlight(report))
+            status = 'failed' if failed else 'ok'
+        finally:
+            progress.finish(status)
+            for profiled in progress.profile_steps():
+                add_step(profiled)
+            # A package can write to any graph, including ones outside its footprint
+            invalidate_graphs([ALL_GRAPHS, NODEGROUP_STORE])
+
+        if not failed:
+            print(progress.summary())
+
+        # Only trust the ledger with steps from a load that completed cleanly
+        if not failed:
+            record_loaded(plan, ledger, triple_store)
+        ledger.save()
 
     if optimize and manifest.getNeedsOptimization(triple_store_type or DEFAULT_TRIPLE_STORE_TYPE):
         invoke_optimization(optimization_url)
 
+def profile_compare_driver(old_path: Path, new_path: Path, threshold: float, min_seconds: float) -> None:
+    """Compare the step timings of two import profiles, failing when a step
+    became slower by more than threshold (a fraction) and min_seconds."""
+    old = Profile.read(old_path)
+    new = Profile.read(new_path)
+    comparisons = compare_profiles(old, new)
+
+    def seconds(step: Optional[Any]) -> Any:
+        return '' if step is None else step.seconds
+
+    def rows(step: Optional[Any]) -> Any:
+        return '' if step is None or step.rows is None else step.rows
+
+    def outcome(comparison: Any) -> str:
+        if comparison.old is None:
+            return str_warn('NEW')
+        if comparison.new is None:
+            return str_warn('REMOVED')
+        if comparison.regressed(threshold, min_seconds):
+            return str_bad('SLOWER')
+        return str_good('OK')
+
+    table = []
+    for comparison in comparisons:
+        change = comparison.change()
+        (kind, target, name) = comparison.key
+        table.append([kind, target, name, seconds(comparison.old), seconds(comparison.new),
+                      '' if change is None else f'{change:+.0%}', rows(comparison.old), rows(comparison.new), outcome(comparison)])
+    from tabulate import tabulate
+    print(tabulate(table, headers=['Kind', 'Target', 'File', 'Old (s)', 'New (s)', 'Change', 'Old rows', 'New rows', 'Result'], floatfmt='.3f'))
+
+    regressions = [comparison for comparison in comparisons if comparison.regressed(threshold, min_seconds)]
+    total = f'Total: {old.seconds:.3f}s -> {new.seconds:.3f}s'
+    if old.seconds > 0:
+        total += f' ({new.seconds / old.seconds - 1:+.0%})'
+    print(total)
+    if regressions:
+        print(str_bad(f'{len(regressions)} steps slower by more than {threshold:.0%} and {min_seconds}s'))
+        sys.exit(1)
+
 def invoke_optimization(url: Optional[Url]) -> None:
     url = url or DEFAULT_OPTIMIZE_URL
     @with_status(f'Optimizing triplestore')
     def go() -> None:
-        response = requests.get(str(url)).json()
+        response = get_session().get(str(url)).json()
         if not response['success']:
             raise Exception(response['message'])
-    go()
+    with profile_step('optimize', str(url)):
+        go()
 
 def cardinality_driver(
         base_url: Url,
@@ -567,7 +956,11 @@ def cardinality_driver(
         headers: bool,
         export_format: ExportFormat,
         concise: bool,
-        max_rows: int
+        max_rows: int,
+        jobs: int = DEFAULT_CARDINALITY_JOBS,
+        timeout: Optional[float] = None,
+        slowest: int = DEFAULT_SLOWEST,
+        whole: bool = False
         ) -> None:
     """Generate an output table with all cardinality violations in the given datagraphs"""
 
@@ -583,17 +976,111 @@ def cardinality_driver(
         extra_data_graphs = []
 
     conn = sparql_connection(base_url, model_graphs, data_graph, extra_data_graphs, triple_store, triple_store_type)
-    
-    semtk_table = semtk3.get_cardinality_violations(conn, max_rows=max_rows, concise_format=concise)
-    print(format_semtk_table(semtk_table, export_format=export_format, headers=headers))
 
-def ingest_data_driver(config_path: Path, base_url: Url, model_graphs: Optional[List[Url]], data_graphs: Optional[List[Url]], triple_store: Optional[Url], triple_store_type: Optional[str], clear: bool) -> None:
-    """Use an import.yaml file to ingest multiple CSV files into the data graph."""
+    if whole:
+        semtk_table = semtk3.get_cardinality_violations(conn, max_rows=max_rows, concise_format=concise)
+        print(format_semtk_table(semtk_table, export_format=export_format, headers=headers))
+        return
+
+    semtk3.SEMTK3_CONN_OVERRIDE = conn
+    model_graphs = model_graphs or [MODEL_GRAPH]
+    restrictions = list_restrictions(model_graphs)
+    logger.info('Checking %d cardinality restrictions', len(restrictions))
+
+    # Instances are typed in the data graphs and their classes are in the model graphs
+    graphs = model_graphs + [data_graph] + extra_data_graphs
+    columns = CONCISE_COLUMNS if concise else VIOLATION_COLUMNS
+    writer = None
+    if export_format != ExportFormat.TEXT:
+        writer = csv.writer(sys.stdout, delimiter=export_delimiter(export_format))
+        if headers:
+            writer.writerow(columns)
+
+    start = time.perf_counter()
+    results = []
+    printed = 0
+    # Closing the checks early stops the workers from starting more queries
+    with closing(run_checks(restrictions, graphs, jobs, timeout, max_rows)) as checks:
+        for result in checks:
+            results.append(result)
+            name = result.restriction.name()
+            if result.timed_out:
+                print(str_warn(f'{name}: timed out after {result.seconds:.1f}s'), file=sys.stderr)
+            elif result.error is not None:
+                print(str_bad(f'{name}: {result.error}'), file=sys.stderr)
+            else:
+                logger.info('%s: %s (%.3fs)', name, result.status(), result.seconds)
+
+            rows = [concise_row(row) if concise else row for row in result.rows]
+            if max_rows >= 0:
+                rows = rows[:max_rows - printed]
+            if rows:
+                if writer is not None:
+                    writer.writerows(rows)
+                else:
+                    from tabulate import tabulate
+                    print(str_highlight(name))
+                    print(tabulate(rows, headers=columns) if headers else tabulate(rows))
+                    print()
+                sys.stdout.flush()
+                printed += len(rows)
+            if max_rows >= 0 and printed >= max_rows:
+                break
+
+    elapsed = time.perf_counter() - start
+    timed_out = [result for result in results if result.timed_out]
+    failed = [result for result in results if result.error is not None]
+    print(f'Checked {len(results)} of {len(restrictions)} restrictions in {elapsed:.3f}s: '
+          f'{printed} violations, {len(timed_out)} timed out, {len(failed)} failed', file=sys.stderr)
+    if slowest > 0 and results:
+        from tabulate import tabulate
+        table = [[result.restriction.name(), result.seconds, result.status()]
+                 for result in sorted(results, key=lambda result: result.seconds, reverse=True)[:slowest]]
+        print(tabulate(table, headers=['Slowest restrictions', 'Seconds', 'Result'], floatfmt='.3f'), file=sys.stderr)
+    if timed_out or failed:
+        sys.exit(1)
+
+def plan_ingestion_steps(steps: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Split ingestion-steps into groups that can be loaded concurrently.
+
+    OWL uploads and counts are barriers and form groups of their own.
+    Consecutive CSV steps share a group unless they target a class or
+    nodegroup already loaded by that group, and consecutive nodegroup
+    stores share a group unless they store the same nodegroup."""
+
+    plan: List[List[Dict[str, Any]]] = []
+    group: List[Dict[str, Any]] = []
+    targets: Set[str] = set()
+
+    for step in steps:
+        kind = IngestionStep.of(step)
+        if kind in (IngestionStep.CLASS, IngestionStep.NODEGROUP, IngestionStep.NODEGROUP_JSON):
+            target = step['name'] if kind == IngestionStep.NODEGROUP_JSON else step[kind.value]
+            storing = kind == IngestionStep.NODEGROUP_JSON
+            if group and (target in targets or storing != (IngestionStep.of(group[0]) == IngestionStep.NODEGROUP_JSON)):
+                plan.append(group)
+                group = []
+                targets = set()
+            group.append(step)
+            targets.add(target)
+        else:
+            if group:
+                plan.append(group)
+                group = []
+                targets = set()
+            plan.append([step])
+
+    if group:
+        plan.append(group)
+
+    return plan
+
+def load_data_config(config_path: Path, base_url: Url, model_graphs: Optional[List[Url]], data_graphs: Optional[List[Url]], triple_store: Optional[Url], triple_store_type: Optional[str]) -> Tuple[Dict[str, Any], Url, Connection]:
+    """Load a data import.yaml and build the connection it describes. Graphs
+    given on the command line take precedence over the configuration file."""
     with open(config_path, mode='r', encoding='utf-8-sig') as config_file:
         config = yaml.safe_load(config_file)
-        validate(config, INGEST_CSV_CONFIG_SCHEMA)
-
-    steps = config['ingestion-steps']
+        validate_config(config, INGEST_CSV_CONFIG_SCHEMA)
 
     if data_graphs is not None:
         data_graph = data_graphs[0]
@@ -603,8 +1090,6 @@ def ingest_data_driver(config_path: Path, base_url: Url, model_graphs: Optional[
         logger.warning("Defaulting data-graph to %s", DEFAULT_DATA_GRAPH)
         data_graph = DEFAULT_DATA_GRAPH
 
-    base_path = config_path.parent
-
     if data_graphs is not None:
         extra_data_graphs = data_graphs[1:]
     elif 'extra-data-graphs' in config:
@@ -622,62 +1107,210 @@ def ingest_data_driver(config_path: Path, base_url: Url, model_graphs: Optional[
 
     conn = sparql_connection(base_url, model_graphs, data_graph, extra_data_graphs, triple_store, triple_store_type)
 
+    return (config, data_graph, conn)
+
+def ingest_data_driver(config_path: Path, base_url: Url, model_graphs: Optional[List[Url]], data_graphs: Optional[List[Url]], triple_store: Optional[Url], triple_store_type: Optional[str], clear: bool, chunk_rows: Optional[int] = None, jobs: int = 1) -> None:
+    """Use an import.yaml file to ingest multiple CSV files into the data graph."""
+    (config, data_graph, conn) = load_data_config(config_path, base_url, model_graphs, data_graphs, triple_store, triple_store_type)
+    steps = config['ingestion-steps']
+    base_path = config_path.parent
+
     if clear:
         clear_graph(conn)
+        forget_cleared_graphs(triple_store, [Url(data_graph)])
 
-    for step in steps:
+    def load_step(step: Dict[str, Any]) -> Tuple[str, List[str]]:
+        if IngestionStep.of(step) == IngestionStep.CLASS:
+            return load_csv_by_class(conn, step['class'], base_path / step['csv'], chunk_rows)
+        return load_csv(conn, step['nodegroup'], base_path / step['csv'], chunk_rows)
 
-        if 'owl' in step:
+    def run_step(step: Dict[str, Any]) -> None:
+        kind = IngestionStep.of(step)
+
+        if kind == IngestionStep.OWL:
             owl_file = step['owl']
             print(f'Ingesting {str_highlight(str(owl_file)): <40}', end="")
             try:
-                semtk3.upload_owl(base_path / owl_file, conn, "rack", "rack", semtk3.SEMTK3_CONN_DATA)
+                with profile_step('owl', data_graph, Path(owl_file).name, (base_path / owl_file).stat().st_size):
+                    semtk3.upload_owl(base_path / owl_file, conn, "rack", "rack", semtk3.SEMTK3_CONN_DATA)
             except Exception as e:
                 print(str_bad(' FAIL'))
                 raise e
             print(str_good(' OK'))
 
-        elif 'class' in step:
-            ingest_csv_by_class(conn, step['class'], base_path / step['csv'])
+        elif kind == IngestionStep.CLASS:
+            ingest_csv_by_class(conn, step['class'], base_path / step['csv'], chunk_rows)
 
-        elif 'nodegroup' in step:
-            ingest_csv(conn, step['nodegroup'], base_path / step['csv'])
+        elif kind == IngestionStep.NODEGROUP:
+            ingest_csv(conn, step['nodegroup'], base_path / step['csv'], chunk_rows)
 
-        elif 'nodegroup_json' in step:
-            with open(base_path / step['nodegroup_json']) as f:
-                nodegroup_json_str = f.read()
-            name = step['name']
-            comment = step.get('comment', '')
-            creator = step['creator']
-            print(f'Adding nodegroup {str_highlight(name): <40}', end="")
-            try:
-                semtk3.delete_nodegroup_from_store(name) # succeeds even if not found
-                semtk3.store_nodegroup(name, comment, creator, nodegroup_json_str)
-            except Exception as e:
-                print(str_bad(' FAIL'))
-                raise e
-            print(str_good(' OK'))
+        elif kind == IngestionStep.NODEGROUP_JSON:
+            store_steps([step])
 
-        elif 'count' in step:
+        elif kind == IngestionStep.COUNT:
             expected = step['count']
             name = step['nodegroup']
             runtime_constraints = generate_constraints(step.get('constraints', []))
 
             print(f'Counting nodegroup {str_highlight(name): <40}', end="")
 
-            semtk_table = semtk3.count_by_id(name, runtime_constraints=runtime_constraints)
-            got = int(semtk_table.get_rows()[0][0])
+            with profile_step('count', name, ' '.join(step.get('constraints', []))) as profiled:
+                semtk_table = semtk3.count_by_id(name, runtime_constraints=runtime_constraints)
+                got = int(semtk_table.get_rows()[0][0])
+                profiled.rows = got
+                if got != expected:
+                    profiled.status = 'mismatch'
             if got == expected:
                 print(str_good(' OK'))
             else:
                 print(str_bad(f' FAIL got:{got} expected:{expected}'))
 
+    def store_steps(group: List[Dict[str, Any]]) -> None:
+        items = [LocalItem(step['name'], step.get('comment', ''), step['creator'], base_path / step['nodegroup_json']).load() for step in group]
+        sync_nodegroups(base_url, items, jobs)
+
+    def run_steps() -> None:
+        if jobs <= 1:
+            for group in plan_ingestion_steps(steps):
+                if IngestionStep.of(group[0]) == IngestionStep.NODEGROUP_JSON:
+                    store_steps(group)
+                else:
+                    for step in group:
+                        run_step(step)
+            return
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for group in plan_ingestion_steps(steps):
+                if IngestionStep.of(group[0]) == IngestionStep.NODEGROUP_JSON:
+                    store_steps(group)
+                    continue
+                if len(group) == 1:
+                    run_step(group[0])
+                    continue
+
+                futures = [executor.submit(load_step, step) for step in group]
+                try:
+                    # Report in step order so output matches a sequential load
+                    for (step, future) in zip(group, futures):
+                        report_csv_load(step.get('class') or step['nodegroup'], future.result)
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+    try:
+        run_steps()
+    finally:
+        invalidate_graphs([data_graph, NODEGROUP_STORE])
+
+
+class CountCheck:
+    """A nodegroup count to verify, with the expected count when there is one,
+    and the outcome once it has run."""
+
+    def __init__(self, nodegroup: str, constraints: List[str], expected: Optional[int] = None) -> None:
+        self.nodegroup: str = nodegroup
+        self.constraints: List[str] = constraints
+        self.runtime_constraints: List[Any] = generate_constraints(constraints)
+        self.expected: Optional[int] = expected
+        self.got: Optional[int] = None
+        self.error: Optional[str] = None
+        self.seconds: float = 0.0
+
+    def passed(self) -> bool:
+        return self.error is None and (self.expected is None or self.got == self.expected)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'nodegroup': self.nodegroup,
+            'constraints': self.constraints,
+            'expected': self.expected,
+            'got': self.got,
+            'error': self.error,
+            'seconds': round(self.seconds, 3),
+            'passed': self.passed(),
+        }
+
+def run_count_check(check: CountCheck) -> CountCheck:
+    start = time.perf_counter()
+    try:
+        semtk_table = semtk3.count_by_id(check.nodegroup, runtime_constraints=check.runtime_constraints)
+        check.got = int(semtk_table.get_rows()[0][0])
+    except Exception as e:
+        check.error = str(e).strip() or type(e).__name__
+    check.seconds = time.perf_counter() - start
+    return check
+
+def count_checks_from_config(config: Dict[str, Any]) -> List[CountCheck]:
+    """Collect the count steps of a data import.yaml"""
+    return [
+        CountCheck(step['nodegroup'], step.get('constraints', []), step['count'])
+        for step in config['ingestion-steps']
+        if IngestionStep.of(step) == IngestionStep.COUNT
+    ]
+
+def count_checks_from_directory(directory: Path) -> List[CountCheck]:
+    """Collect the nodegroups listed in a store_data.csv; these only need to run"""
+    with open(directory / 'store_data.csv', mode='r', encoding='utf-8-sig') as f:
+        return [CountCheck(row['ID'], []) for row in csv.DictReader(f)]
+
+def verify_counts_driver(config_path: Optional[Path], queries: Optional[Path], base_url: Url, model_graphs: Optional[List[Url]], data_graphs: Optional[List[Url]], triple_store: Optional[Url], triple_store_type: Optional[str], jobs: int, report: Optional[Path]) -> None:
+    """Run count checks concurrently and summarize them in one table."""
+
+    checks = []
+    if config_path is not None:
+        (config, _, conn) = load_data_config(config_path, base_url, model_graphs, data_graphs, triple_store, triple_store_type)
+        checks += count_checks_from_config(config)
+    else:
+        data_graph = data_graphs[0] if data_graphs else None
+        conn = sparql_connection(base_url, model_graphs, data_graph, (data_graphs or [])[1:], triple_store, triple_store_type)
+    if queries is not None:
+        checks += count_checks_from_directory(queries)
+
+    semtk3.SEMTK3_CONN_OVERRIDE = conn
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(run_count_check, checks))
+    elapsed = time.perf_counter() - start
+
+    def outcome(check: CountCheck) -> str:
+        if check.error is not None:
+            return str_bad('ERROR')
+        return str_good('PASS') if check.passed() else str_bad('FAIL')
+
+    rows = [
+        [check.nodegroup, ' '.join(check.constraints), '' if check.expected is None else check.expected,
+         '' if check.got is None else check.got, check.seconds, outcome(check)]
+        for check in results
+    ]
+    from tabulate import tabulate
+    print(tabulate(rows, headers=['Nodegroup', 'Constraints', 'Expected', 'Got', 'Seconds', 'Result'], floatfmt='.3f'))
+
+    failed = [check for check in results if not check.passed()]
+    for check in failed:
+        if check.error is not None:
+            logger.error('%s: %s', check.nodegroup, check.error)
+    summary = f'{len(results) - len(failed)} passed, {len(failed)} failed in {elapsed:.3f}s'
+    print(str_bad(summary) if failed else str_good(summary))
+
+    if report is not None:
+        with open(report, mode='w', encoding='utf-8') as f:
+            json.dump({
+                'passed': len(results) - len(failed),
+                'failed': len(failed),
+                'seconds': round(elapsed, 3),
+                'results': [check.to_json() for check in results],
+            }, f, indent=2)
+
+    if failed:
+        sys.exit(1)
 
 def ingest_owl_driver(config_path: Path, base_url: Url, model_graphs: Optional[List[Url]], triple_store: Optional[Url], triple_store_type: Optional[str], clear: bool) -> None:
     """Use an import.yaml file to ingest multiple OWL files into the model graph."""
     with open(config_path, mode='r', encoding='utf-8-sig') as config_file:
         config = yaml.safe_load(config_file)
-        validate(config, INGEST_OWL_CONFIG_SCHEMA)
+        validate_config(config, INGEST_OWL_CONFIG_SCHEMA)
 
     files = config['files']
     base_path = config_path.parent
@@ -694,24 +1327,55 @@ def ingest_owl_driver(config_path: Path, base_url: Url, model_graphs: Optional[L
 
     if clear:
         clear_graph(conn, which_graph=Graph.MODEL)
+        forget_cleared_graphs(triple_store, model_graphs or [MODEL_GRAPH])
 
-    for file in files:
-        ingest_owl(conn, base_path / file)
+    try:
+        for file in files:
+            ingest_owl(conn, base_path / file)
+    finally:
+        invalidate_graphs(model_graphs or [MODEL_GRAPH])
 
-@with_status('Clearing')
-def clear_driver(base_url: Url, model_graphs: Optional[List[Url]], data_graphs: Optional[List[Url]], triple_store: Optional[Url], triple_store_type: Optional[str], graph: Graph) -> None:
-    """Clear the given data graphs"""
+def list_graphs(base_url: Url, triple_store: Optional[Url], triple_store_type: Optional[str]) -> List[Url]:
+    """List the graphs of the triple store, leaving out SemTK's internal graphs."""
+    conn = sparql_connection(base_url, None, None, [], triple_store, triple_store_type)
+    # Skipping the triple counts keeps this a cheap query
+    return [Url(g) for g in semtk3.get_graph_info(conn, True, True).get_column(0)]
+
+def clear_driver(base_url: Url, model_graphs: Optional[List[Url]], data_graphs: Optional[List[Url]], triple_store: Optional[Url], triple_store_type: Optional[str], graph: Graph, jobs: int = DEFAULT_CLEAR_JOBS, pattern: Optional[str] = None, yes: bool = False) -> None:
+    """Clear the given model or data graphs, and the graphs of the triple store
+    matching pattern, up to jobs at a time"""
+
+    graphs = model_graphs if graph == Graph.MODEL else data_graphs
+    if pattern is not None:
+        regexp = re.compile(pattern)
+        matched = [g for g in list_graphs(base_url, triple_store, triple_store_type) if regexp.search(g)]
+        graphs = list(dict.fromkeys((graphs or []) + matched))
+        if not graphs:
+            print(f'No graphs match {str_highlight(pattern)}: doing nothing.')
+            return
+    targets: List[Url] = graphs or [MODEL_GRAPH if graph == Graph.MODEL else DEFAULT_DATA_GRAPH]
 
     if graph == Graph.MODEL:
-        for model_graph in model_graphs or [MODEL_GRAPH]:
-            print(f"{model_graph} ", end='')
-            conn = sparql_connection(base_url, [model_graph], None, [], triple_store, triple_store_type)
-            clear_graph(conn, which_graph=graph)
-    elif graph == Graph.DATA:
-        for data_graph in data_graphs or [DEFAULT_DATA_GRAPH]:
-            print(f"{data_graph} ", end='')
-            conn = sparql_connection(base_url, None, data_graph, [], triple_store, triple_store_type)
-            clear_graph(conn, which_graph=graph)
+        conns = {g: sparql_connection(base_url, [g], None, [], triple_store, triple_store_type) for g in targets}
+    else:
+        conns = {g: sparql_connection(base_url, None, g, [], triple_store, triple_store_type) for g in targets}
+
+    def on_confirmed() -> None:
+        cleared = []
+        try:
+            for (g, error) in run_batch(lambda g: clear_graph(conns[g], which_graph=graph), targets, jobs):
+                print_outcome(f'Clearing {str_highlight(g)}', error)
+                if error is None:
+                    cleared.append(g)
+        finally:
+            forget_cleared_graphs(triple_store, cleared)
+        if len(cleared) != len(targets):
+            sys.exit(1)
+
+    # Graphs selected by a pattern are shown before anything is cleared
+    if pattern is not None and not yes:
+        print('The following graphs would be cleared: {}'.format(', '.join(str_highlight(g) for g in targets)))
+    confirm(on_confirmed, yes or pattern is None)
 
 def template_driver(base_url: Url, triple_store: Optional[Url], triple_store_type: Optional[str], class_uri: Url, filename: Optional[Path]) -> None:
     conn = sparql_connection(base_url, None, None, [], triple_store, triple_store_type)
@@ -722,10 +1386,72 @@ def template_driver(base_url: Url, triple_store: Optional[Url], triple_store_typ
         with open(filename, 'w') as f:
             f.write(csv)
 
-@with_status('Storing nodegroups')
-def store_nodegroups_driver(directory: Path, base_url: Url) -> None:
+def print_outcome(label: str, error: Optional[BaseException]) -> None:
+    """Print a status line for an operation that ran in the background."""
+    print(f'{label + "...": <60}' + (str_good('OK') if error is None else str_bad('FAIL')))
+    if error is not None:
+        logger.error('%s', str(error).strip() or type(error).__name__)
+
+def sync_nodegroups(base_url: Url, items: List[LocalItem], jobs: int, prune: bool = False, force: bool = False, yes: bool = False) -> None:
+    """Bring the nodegroup store in line with local items: upload new and
+    changed items, skip unchanged ones and, with prune, delete stored items
+    that are missing locally."""
+    index = NodegroupIndex()
+    index.refresh(base_url, semtk3.get_store_table())
+    plan = plan_sync(items, index.items(base_url), prune, force)
+    changed = {item.id for item in plan.changed}
+
+    for item in plan.unchanged:
+        unchanged_step = ProfileStep('nodegroup', item.id, item.json_path.name)
+        unchanged_step.status = 'unchanged'
+        add_step(unchanged_step)
+
+    def upload(item: LocalItem) -> None:
+        with profile_step('nodegroup', item.id, item.json_path.name, len((item.json_str or '').encode('utf-8'))):
+            store_item(item, plan.stored_types.get(item.id))
+
+    stored: Dict[str, str] = {}
+    deleted: List[str] = []
+    failures = 0
+    try:
+        for (item, error) in run_batch(upload, plan.new + plan.changed, jobs):
+            print_outcome(f'{"Replacing" if item.id in changed else "Storing"} {str_highlight(item.id)}', error)
+            if error is None:
+                stored[item.id] = item.digest
+            else:
+                failures += 1
+
+        def on_confirmed() -> None:
+            nonlocal failures
+            for ((item_id, _), error) in run_batch(lambda entry: semtk3.delete_item_from_store(entry[0], entry[1]), plan.prune, jobs):
+                print_outcome(f'Deleting {str_highlight(item_id)}', error)
+                if error is None:
+                    deleted.append(item_id)
+                else:
+                    failures += 1
+
+        if plan.prune:
+            if not yes:
+                print('The following nodegroups would be removed: {}'.format(', '.join(str_highlight(id) for (id, _) in plan.prune)))
+            confirm(on_confirmed, yes)
+    finally:
+        if deleted:
+            forget_nodegroup_store()
+        elif stored or failures:
+            invalidate_graphs([NODEGROUP_STORE])
+        if stored or deleted or failures:
+            index.refresh(base_url, semtk3.get_store_table(), stored)
+        index.save()
+
+    summary = f'Nodegroups: {len(plan.new)} new, {len(plan.changed)} changed, {len(plan.unchanged)} unchanged, {len(deleted)} deleted'
+    print(str_bad(summary) if failures else summary)
+    if failures:
+        raise NodegroupSyncError(f'{failures} nodegroup operations failed')
+
+def store_nodegroups_driver(directory: Path, base_url: Url, jobs: int = DEFAULT_NODEGROUP_JOBS, prune: bool = False, force: bool = False, yes: bool = False) -> None:
+    """Store the nodegroups listed in the store_data.csv of a directory."""
     sparql_connection(base_url, None, None, [], None, None)
-    semtk3.store_nodegroups(directory)
+    sync_nodegroups(base_url, read_store_data(directory), jobs, prune, force, yes)
 
 @with_status('Storing nodegroup')
 def store_nodegroup_driver(name: str, creator: str, filename: str, comment: Optional[str], base_url: Url, kind: str) -> None:
@@ -739,8 +1465,14 @@ def store_nodegroup_driver(name: str, creator: str, filename: str, comment: Opti
     elif kind == 'report':
         item_type = semtk3.STORE_ITEM_TYPE_REPORT
 
-    semtk3.delete_item_from_store(name, item_type) # succeeds even if not found
-    semtk3.store_item(name, comment or '', creator, nodegroup_json_str, item_type)
+    try:
+        semtk3.delete_item_from_store(name, item_type) # succeeds even if not found
+        semtk3.store_item(name, comment or '', creator, nodegroup_json_str, item_type)
+    finally:
+        invalidate_graphs([NODEGROUP_STORE])
+        index = NodegroupIndex()
+        index.invalidate(base_url)
+        index.save()
 
 @with_status('Converting nodegroup to SPARQL')
 def sparql_nodegroup_driver(base_url: Url, filename: str) -> None:
@@ -751,13 +1483,15 @@ def sparql_nodegroup_driver(base_url: Url, filename: str) -> None:
     urlbase = urlorig._replace(netloc=':'.join(
                                     urlorig.netloc.split(':')[:1] + ['12059'])
                                ).geturl()
-    rsp = requests.post(urljoin(urlbase, 'nodeGroup/generateSelect'),
-                        json={'jsonRenderedNodeGroup': nodegroup_json_str})
+    rsp = get_session().post(urljoin(urlbase, 'nodeGroup/generateSelect'),
+                             json={'jsonRenderedNodeGroup': nodegroup_json_str})
     rsp.raise_for_status()
     print(rsp.json()['simpleresults']['SparqlQuery'])
 
-@with_status('Retrieving nodegroups')
-def retrieve_nodegroups_driver(regexp: str, directory: Path, base_url: Url, kind: str) -> None:
+def retrieve_nodegroups_driver(regexp: str, directory: Path, base_url: Url, kind: str, refresh: bool = False) -> None:
+    """Export the items matching regexp into a directory with a store_data.csv.
+    Items are selected using the local index, and items already exported to
+    the directory and unchanged since are not fetched again."""
     sparql_connection(base_url, None, None, [], None, None)
     if kind == 'nodegroup':
         item_type = semtk3.STORE_ITEM_TYPE_NODEGROUP
@@ -765,14 +1499,50 @@ def retrieve_nodegroups_driver(regexp: str, directory: Path, base_url: Url, kind
         item_type = semtk3.STORE_ITEM_TYPE_REPORT
     else:
         item_type = semtk3.STORE_ITEM_TYPE_ALL
-    semtk3.retrieve_items_from_store(regexp, directory, item_type)
 
-def list_nodegroups_driver(base_url: Url) -> None:
+    index = current_index(base_url, refresh)
+    selected = index.select(base_url, [re.compile(regexp)], None if kind == 'all' else item_type_name(item_type))
+    stored = index.items(base_url)
+
+    directory.mkdir(parents=True, exist_ok=True)
+    exported: Dict[str, LocalItem] = {}
+    if (directory / 'store_data.csv').exists():
+        exported = {item.id: item for item in read_store_data(directory) if item.json_path.exists()}
+    current = [id for id in selected if id in exported and stored[id].get('digest') == exported[id].digest]
+    fetch = [id for id in selected if id not in current]
+
+    @with_status(f'Retrieving {len(fetch)} of {len(selected)} nodegroups')
+    def retrieve() -> List[LocalItem]:
+        if not fetch:
+            return []
+        with TemporaryDirectory() as tmpdir:
+            # Only the selected items are fetched, matched by their exact IDs
+            semtk3.retrieve_items_from_store('^(?:' + '|'.join(re.escape(id) for id in fetch) + ')$', tmpdir, item_type)
+            fetched = []
+            for item in read_store_data(Path(tmpdir)):
+                target = directory / item.json_path.name
+                shutil.move(str(item.json_path), target)
+                item.json_path = target
+                fetched.append(item)
+            return fetched
+
+    fetched = {item.id: item for item in retrieve()}
+    for item in fetched.values():
+        index.record_digest(base_url, item.id, item.digest)
+    index.save()
+    write_store_data(directory, [fetched.get(id) or exported[id] for id in selected if id in fetched or id in exported])
+
+def list_nodegroups_driver(base_url: Url, regexp: Optional[str] = None, refresh: bool = False) -> None:
+    """List stored nodegroups from the local index of the store."""
+    sparql_connection(base_url, None, None, [], None, None)
 
     @with_status('Listing nodegroups')
-    def list_nodegroups() -> SemtkTable:
-        sparql_connection(base_url, None, None, [], None, None)
-        return semtk3.get_nodegroup_store_data()
+    def list_nodegroups() -> CachedTable:
+        index = current_index(base_url, refresh)
+        items = index.items(base_url)
+        ids = index.select(base_url, [re.compile(regexp or '')], item_type_name(semtk3.STORE_ITEM_TYPE_NODEGROUP))
+        return CachedTable(['ID', 'comments', 'creationDate', 'creator'],
+                           [[id, items[id]['comments'], items[id]['creationDate'], items[id]['creator']] for id in ids])
 
     print(format_semtk_table(list_nodegroups()))
 
@@ -787,25 +1557,20 @@ def confirm(on_confirmed: Callable[[], None], yes: bool = False) -> None:
     else:
         print(str_bad('Aborted.'))
 
-def delete_nodegroup(nodegroup: str) -> None:
-    @with_status(f'Deleting {str_highlight(nodegroup)}')
-    def delete() -> None:
-        semtk3.delete_nodegroup_from_store(nodegroup)
-    delete()
-
 def delete_store_item(id: str, item_type: str) -> None:
     @with_status(f'Deleting {str_highlight(id)}')
     def delete() -> None:
         semtk3.delete_store_item(id, item_type)
     delete()
 
-def delete_nodegroups_driver(nodegroups: List[str], ignore_nonexistent: bool, yes: bool, use_regexp: bool, base_url: Url) -> None:
+def delete_nodegroups_driver(nodegroups: List[str], ignore_nonexistent: bool, yes: bool, use_regexp: bool, base_url: Url, jobs: int = DEFAULT_NODEGROUP_JOBS) -> None:
     if not nodegroups:
         print('No nodegroups specified for deletion: doing nothing.')
         return
 
     sparql_connection(base_url, None, None, [], None, None)
-    allIDs = semtk3.get_store_table().get_column('ID')
+    # Deletions are selected from the store as it is now, never from a cached index
+    allIDs = list(current_index(base_url, refresh=True).items(base_url))
 
     if use_regexp:
         regexps = [re.compile(regex_str) for regex_str in nodegroups]
@@ -825,11 +1590,22 @@ def delete_nodegroups_driver(nodegroups: List[str], ignore_nonexistent: bool, ye
         print('The following nodegroups would be removed: {}'.format(', '.join(str_highlight(s) for s in to_delete)))
 
     def on_confirmed() -> None:
-        for nodegroup in to_delete:
-            delete_nodegroup(nodegroup)
+        deleted = []
+        try:
+            for (nodegroup, error) in run_batch(semtk3.delete_nodegroup_from_store, to_delete, jobs):
+                print_outcome(f'Deleting {str_highlight(nodegroup)}', error)
+                if error is None:
+                    deleted.append(nodegroup)
+        finally:
+            forget_nodegroup_store()
+            index = NodegroupIndex()
+            index.forget(base_url, deleted)
+            index.save()
+        if len(deleted) != len(to_delete):
+            sys.exit(1)
     confirm(on_confirmed, yes)
 
-def delete_all_nodegroups_driver(yes: bool, base_url: Url) -> None:
+def delete_all_nodegroups_driver(yes: bool, base_url: Url, jobs: int = DEFAULT_NODEGROUP_JOBS) -> None:
     sparql_connection(base_url, None, None, [], None, None)
 
     table = semtk3.get_store_table()
@@ -840,19 +1616,31 @@ def delete_all_nodegroups_driver(yes: bool, base_url: Url) -> None:
         print('The following nodegroups would be removed: {}'.format(' '.join(str_highlight(s) for s in table.get_column(id_col))))
 
     def on_confirmed() -> None:
-
-        for r in table.get_rows():
-            semtk3.delete_item_from_store(r[id_col], r[type_col].split("#")[-1])
+        items = [(r[id_col], r[type_col].split("#")[-1]) for r in table.get_rows()]
+        failed = False
+        try:
+            for ((item_id, _), error) in run_batch(lambda item: semtk3.delete_item_from_store(item[0], item[1]), items, jobs):
+                print_outcome(f'Deleting {str_highlight(item_id)}', error)
+                failed = failed or error is not None
+        finally:
+            forget_nodegroup_store()
+            index = NodegroupIndex()
+            index.forget(base_url, [item_id for (item_id, _) in items])
+            index.save()
+        if failed:
+            sys.exit(1)
 
     confirm(on_confirmed, yes)
 
 def dispatch_data_export(args: SimpleNamespace) -> None:
     conn = sparql_connection(args.base_url, args.model_graph, args.data_graph[0], args.data_graph[1:], args.triple_store, args.triple_store_type)
-    run_query(conn, args.nodegroup, export_format=args.format, headers=not args.no_headers, path=args.file, constraints=args.constraint)
+    cache = QueryCache() if args.cache else None
+    run_query(conn, args.nodegroup, export_format=args.format, headers=not args.no_headers, path=args.file, constraints=args.constraint, page_size=args.page_size, cache=cache)
 
 def dispatch_data_count(args: SimpleNamespace) -> None:
     conn = sparql_connection(args.base_url, args.model_graph, args.data_graph[0], args.data_graph[1:], args.triple_store, args.triple_store_type)
-    run_count_query(conn, args.nodegroup, constraints=args.constraint)
+    cache = QueryCache() if args.cache else None
+    run_count_query(conn, args.nodegroup, constraints=args.constraint, cache=cache)
 
 def dispatch_utility_copygraph(args: SimpleNamespace) -> None:
     """Implementation of utility copygraph command"""
@@ -860,31 +1648,48 @@ def dispatch_utility_copygraph(args: SimpleNamespace) -> None:
 
 def dispatch_manifest_import(args: SimpleNamespace) -> None:
     """Implementation of manifest import subcommand"""
-    ingest_manifest_driver(Path(args.config), args.triple_store, args.triple_store_type, args.clear, args.optimize, args.optimize_url)
+    with profiling(args.profile, 'manifest import'):
+        ingest_manifest_driver(Path(args.config), args.triple_store, args.triple_store_type, args.clear, args.optimize, args.optimize_url, args.force, args.progress_json)
 
 def dispatch_manifest_build(args: SimpleNamespace) -> None:
     """Implementation of manifest import subcommand"""
-    build_manifest_driver(Path(args.config), Path(args.zipfile))
+    build_manifest_driver(Path(args.config), Path(args.zipfile), args.compression_level, args.jobs, Path(args.build_cache) if args.build_cache else None)
 
 def dispatch_data_import(args: SimpleNamespace) -> None:
     """Implementation of the data import subcommand"""
     cliMethod = CLIMethod.DATA_IMPORT
-    ingest_data_driver(Path(args.config), args.base_url, args.model_graph, args.data_graph, args.triple_store, args.triple_store_type, args.clear)
+    with profiling(args.profile, 'data import'):
+        ingest_data_driver(Path(args.config), args.base_url, args.model_graph, args.data_graph, args.triple_store, args.triple_store_type, args.clear, args.chunk_rows, args.jobs)
+
+def dispatch_data_verify(args: SimpleNamespace) -> None:
+    """Implementation of the data verify subcommand"""
+    config = Path(args.config) if args.config is not None else None
+    queries = Path(args.queries) if args.queries is not None else None
+    if config is None and queries is None:
+        logger.error('Nothing to verify: give an import configuration or --queries')
+        sys.exit(1)
+    verify_counts_driver(config, queries, args.base_url, args.model_graph, args.data_graph, args.triple_store, args.triple_store_type, args.jobs, args.report)
 
 def dispatch_data_cardinality(args: SimpleNamespace) -> None:
     """Implementation of the data cardinality subcommand"""
     cliMethod = CLIMethod.DATA_IMPORT
     cardinality_driver(args.base_url, args.model_graph, args.data_graph, args.triple_store, args.triple_store_type,
-                       export_format=args.format, headers=not args.no_headers, concise=args.concise, max_rows=args.max_rows)
+                       export_format=args.format, headers=not args.no_headers, concise=args.concise, max_rows=args.max_rows,
+                       jobs=args.jobs, timeout=args.timeout, slowest=args.slowest, whole=args.whole)
 
 def dispatch_model_import(args: SimpleNamespace) -> None:
     """Implementation of the plumbing model subcommand"""
     cliMethod = CLIMethod.MODEL_IMPORT
-    ingest_owl_driver(Path(args.config), args.base_url, args.model_graph, args.triple_store, args.triple_store_type, args.clear)
+    with profiling(args.profile, 'model import'):
+        ingest_owl_driver(Path(args.config), args.base_url, args.model_graph, args.triple_store, args.triple_store_type, args.clear)
+
+def dispatch_profile_compare(args: SimpleNamespace) -> None:
+    """Implementation of the profile compare subcommand"""
+    profile_compare_driver(args.old, args.new, args.threshold / 100, args.min_seconds)
 
 def dispatch_data_clear(args: SimpleNamespace) -> None:
     """Implementation of the data clear subcommand"""
-    clear_driver(args.base_url, None, args.data_graph, args.triple_store, args.triple_store_type, Graph.DATA)
+    clear_driver(args.base_url, None, args.data_graph, args.triple_store, args.triple_store_type, Graph.DATA, args.jobs, args.pattern, args.yes)
 
 def dispatch_data_template(args: SimpleNamespace) -> None:
     """Implementation of the data template subcommand"""
@@ -892,29 +1697,36 @@ def dispatch_data_template(args: SimpleNamespace) -> None:
 
 def dispatch_model_clear(args: SimpleNamespace) -> None:
     """Implementation of the model clear subcommand"""
-    clear_driver(args.base_url, args.model_graph, None, args.triple_store, args.triple_store_type, Graph.MODEL)
+    clear_driver(args.base_url, args.model_graph, None, args.triple_store, args.triple_store_type, Graph.MODEL, args.jobs, args.pattern, args.yes)
 
 def dispatch_nodegroups_import(args: SimpleNamespace) -> None:
-    store_nodegroups_driver(args.directory, args.base_url)
+    store_nodegroups_driver(Path(args.directory), args.base_url, args.jobs, args.prune, args.force, args.yes)
 
 def dispatch_nodegroups_store(args: SimpleNamespace) -> None:
     store_nodegroup_driver(args.name, args.creator, args.filename, args.comment, args.base_url, args.kind)
 
 def dispatch_nodegroups_export(args: SimpleNamespace) -> None:
-    retrieve_nodegroups_driver(args.regexp, args.directory, args.base_url, args.kind)
+    retrieve_nodegroups_driver(args.regexp, Path(args.directory), args.base_url, args.kind, args.refresh)
 
 def dispatch_nodegroups_list(args: SimpleNamespace) -> None:
-    list_nodegroups_driver(args.base_url)
+    list_nodegroups_driver(args.base_url, args.regexp, args.refresh)
 
 def dispatch_nodegroups_delete(args: SimpleNamespace) -> None:
-    delete_nodegroups_driver(args.nodegroups, args.ignore_nonexistent, args.yes, args.regexp, args.base_url)
+    delete_nodegroups_driver(args.nodegroups, args.ignore_nonexistent, args.yes, args.regexp, args.base_url, args.jobs)
 
 def dispatch_nodegroups_deleteall(args: SimpleNamespace) -> None:
-    delete_all_nodegroups_driver(args.yes, args.base_url)
+    delete_all_nodegroups_driver(args.yes, args.base_url, args.jobs)
 
 def dispatch_nodegroups_sparql(args: SimpleNamespace) -> None:
     sparql_nodegroup_driver(args.base_url, args.filename)
 
+def positive_int(text: str) -> int:
+    """Argument type for options that require a positive integer"""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'must be a positive integer: {text}')
+    return value
+
 def get_argument_parser() -> argparse.ArgumentParser:
 
     parser = argparse.ArgumentParser(description='RACK in a Box toolkit')
@@ -922,6 +1734,9 @@ def get_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument('--triple-store', type=str, default=environ.get('TRIPLE_STORE'), help='Override Fuseki URL')
     parser.add_argument('--triple-store-type', type=str, default=environ.get('TRIPLE_STORE_TYPE'), help='Override Triplestore Type (default: fuseki)')
     parser.add_argument('--log-level', type=str, default=environ.get('LOG_LEVEL', 'INFO'), help='Assign logger severity level')
+    parser.add_argument('--http-retries', type=int, default=int(environ.get('RACK_HTTP_RETRIES') or DEFAULT_RETRIES), help=f'Retries for failed connections and gateway errors (default: {DEFAULT_RETRIES})')
+    parser.add_argument('--http-backoff', type=float, default=float(environ.get('RACK_HTTP_BACKOFF') or DEFAULT_BACKOFF), help=f'Backoff factor in seconds between retries (default: {DEFAULT_BACKOFF})')
+    parser.add_argument('--http-timeout', type=float, default=float(environ.get('RACK_HTTP_TIMEOUT') or 0) or None, help='Seconds to wait for a response from SemTK (default: no limit)')
 
     subparsers = parser.add_subparsers(dest='command')
 
@@ -934,6 +1749,7 @@ def get_argument_parser() -> argparse.ArgumentParser:
     data_subparsers = data_parser.add_subparsers(dest='command')
     data_import_parser = data_subparsers.add_parser('import', help='Import CSV data')
     data_cardinality_parser = data_subparsers.add_parser('cardinality', help='Check data cardinality')
+    data_verify_parser = data_subparsers.add_parser('verify', help='Run count checks concurrently')
     data_export_parser = data_subparsers.add_parser('export', help='Export query results')
     data_count_parser = data_subparsers.add_parser('count', help='Count matched query rows')
     data_clear_parser = data_subparsers.add_parser('clear', help='Clear data graph')
@@ -954,6 +1770,10 @@ def get_argument_parser() -> argparse.ArgumentParser:
     nodegroups_deleteall_parser = nodegroups_subparsers.add_parser('delete-all', help='Delete all nodegroups from RACK')
     nodegroups_sparql_parser = nodegroups_subparsers.add_parser('sparql', help='Show SPARQL query for nodegroup')
 
+    profile_parser = subparsers.add_parser('profile', help='Work with import profiles')
+    profile_subparsers = profile_parser.add_subparsers(dest='command')
+    profile_compare_parser = profile_subparsers.add_parser('compare', help='Compare the step timings of two import profiles')
+
     utility_parser = subparsers.add_parser('utility', help='Tools for manipulating raw data')
     utility_subparsers = utility_parser.add_subparsers(dest='command')
     utility_copygraph_parser = utility_subparsers.add_parser('copygraph', help='merge data from one graph to another')
@@ -962,20 +1782,34 @@ def get_argument_parser() -> argparse.ArgumentParser:
     utility_copygraph_parser.add_argument('--to-graph', type=str, required=True, help='merge to this graph')
     utility_copygraph_parser.set_defaults(func=dispatch_utility_copygraph)
 
+    # bin/rack runs the server itself, since it needs the command line entry point
+    serve_parser = subparsers.add_parser('serve', help='Run commands sent by rack clients from one long-lived process')
+    serve_parser.add_argument('--socket', type=str, default=environ.get('RACK_SERVER') or str(DEFAULT_SOCKET_PATH), help=f'Unix socket to listen on (default: {DEFAULT_SOCKET_PATH})')
+    serve_parser.set_defaults(func=None)
+
     manifest_import_parser.add_argument('config', type=str, help='Manifest YAML file')
     manifest_import_parser.add_argument('--clear', action='store_true', help='Clear footprint before import')
+    manifest_import_parser.add_argument('--force', action='store_true', help='Reload steps that are unchanged since the last import')
+    manifest_import_parser.add_argument('--progress-json', type=Path, metavar='FILE', help='Write progress events to FILE as JSON lines')
+    manifest_import_parser.add_argument('--profile', type=Path, metavar='FILE', help='Write per-step timings to FILE (CSV if it ends in .csv, JSON otherwise)')
     manifest_import_parser.add_argument('--optimize', default=True, action=argparse.BooleanOptionalAction, help='Enable RACK UI optimization when available')
     manifest_import_parser.add_argument('--optimize-url', type=str, help='RACK UI optimization endpoint (e.g. http://localhost:8050/optimize)')
     manifest_import_parser.set_defaults(func=dispatch_manifest_import)
 
     manifest_build_parser.add_argument('config', type=str, help='Manifest YAML file')
     manifest_build_parser.add_argument('zipfile', type=str, help='Ingestion package output file')
+    manifest_build_parser.add_argument('--compression-level', type=int, choices=range(0, 10), default=DEFAULT_COMPRESSION_LEVEL, metavar='LEVEL', help=f'Deflate level from 0 (store uncompressed) to 9 (default: {DEFAULT_COMPRESSION_LEVEL})')
+    manifest_build_parser.add_argument('--jobs', type=positive_int, default=None, help='Number of files to compress concurrently (default: number of CPUs)')
+    manifest_build_parser.add_argument('--build-cache', type=str, default=environ.get('RACK_BUILD_CACHE'), metavar='DIR', help='Reuse files compressed by earlier builds from this directory')
     manifest_build_parser.set_defaults(func=dispatch_manifest_build)
 
     data_import_parser.add_argument('config', type=str, help='Configuration YAML file')
     data_import_parser.add_argument('--model-graph', type=str, action='append', help='Model graph URL')
     data_import_parser.add_argument('--data-graph', type=str, action='append', help='Data graph URL')
     data_import_parser.add_argument('--clear', action='store_true', help='Clear data graph before import')
+    data_import_parser.add_argument('--jobs', type=positive_int, default=1, help='Number of CSV steps to load concurrently between OWL and nodegroup steps')
+    data_import_parser.add_argument('--chunk-rows', type=positive_int, help='Stream each CSV file in chunks of this many rows')
+    data_import_parser.add_argument('--profile', type=Path, metavar='FILE', help='Write per-step timings to FILE (CSV if it ends in .csv, JSON otherwise)')
     data_import_parser.set_defaults(func=dispatch_data_import)
 
     data_cardinality_parser.add_argument('--model-graph', type=str, action='append', help='Model graph URL')
@@ -984,14 +1818,28 @@ def get_argument_parser() -> argparse.ArgumentParser:
     data_cardinality_parser.add_argument('--no-headers', action='store_true', help='Omit header row')
     data_cardinality_parser.add_argument('--max-rows', default=-1, type=int, help='Maximum output rows')
     data_cardinality_parser.add_argument('--concise', default=False, action='store_true', help='Use concise output')
+    data_cardinality_parser.add_argument('--jobs', type=positive_int, default=DEFAULT_CARDINALITY_JOBS, help='Restrictions checked concurrently')
+    data_cardinality_parser.add_argument('--timeout', type=float, default=None, help='Seconds after which the check of one restriction is abandoned')
+    data_cardinality_parser.add_argument('--slowest', type=int, default=DEFAULT_SLOWEST, help='Number of slowest restrictions to list, 0 for none')
+    data_cardinality_parser.add_argument('--whole', default=False, action='store_true', help='Check all restrictions in a single SemTK request')
     data_cardinality_parser.set_defaults(func=dispatch_data_cardinality)
 
+    data_verify_parser.add_argument('config', type=str, nargs='?', help='Configuration YAML file whose count steps are checked')
+    data_verify_parser.add_argument('--queries', type=str, help='Nodegroup directory (with store_data.csv) whose nodegroups must run')
+    data_verify_parser.add_argument('--model-graph', type=str, action='append', help='Model graph URL')
+    data_verify_parser.add_argument('--data-graph', type=str, action='append', help='Data graph URL')
+    data_verify_parser.add_argument('--jobs', type=positive_int, default=8, help='Number of counts to run concurrently')
+    data_verify_parser.add_argument('--report', type=Path, help='Write a JSON report to this file')
+    data_verify_parser.set_defaults(func=dispatch_data_verify)
+
     data_export_parser.add_argument('nodegroup', type=str, help='ID of nodegroup')
     data_export_parser.add_argument('--model-graph', type=str, action='append', help='Model graph URL')
     data_export_parser.add_argument('--data-graph', type=str, required=True, action='append', help='Data graph URL')
     data_export_parser.add_argument('--format', type=ExportFormat, help='Export format', choices=list(ExportFormat), default=ExportFormat.TEXT)
     data_export_parser.add_argument('--no-headers', action='store_true', help='Omit header row')
-    data_export_parser.add_argument('--file', type=Path, help='Output to file')
+    data_export_parser.add_argument('--file', type=Path, help='Output to file (gzip compressed when ending in .gz)')
+    data_export_parser.add_argument('--cache', action='store_true', help='Reuse cached results until the queried graphs change')
+    data_export_parser.add_argument('--page-size', type=positive_int, help='Stream csv or tsv results in pages of this many rows')
     data_export_parser.add_argument('--constraint', type=str, action='append', help='Runtime constraint: key=value')
     data_export_parser.set_defaults(func=dispatch_data_export)
 
@@ -999,9 +1847,13 @@ def get_argument_parser() -> argparse.ArgumentParser:
     data_count_parser.add_argument('--model-graph', type=str, action='append', help='Data graph URL')
     data_count_parser.add_argument('--data-graph', type=str, required=True, action='append', help='Data graph URL')
     data_count_parser.add_argument('--constraint', type=str, action='append', help='Runtime constraint: key=value')
+    data_count_parser.add_argument('--cache', action='store_true', help='Reuse cached results until the queried graphs change')
     data_count_parser.set_defaults(func=dispatch_data_count)
 
     data_clear_parser.add_argument('--data-graph', type=str, action='append', help='Data graph URL')
+    data_clear_parser.add_argument('--pattern', type=str, help='Also clear the graphs of the triple store matching this regular expression')
+    data_clear_parser.add_argument('--jobs', type=positive_int, default=DEFAULT_CLEAR_JOBS, help=f'Number of graphs to clear concurrently (default: {DEFAULT_CLEAR_JOBS})')
+    data_clear_parser.add_argument('--yes', action='store_true', help='Automatically confirm clearing the graphs matching --pattern')
     data_clear_parser.set_defaults(func=dispatch_data_clear)
 
     data_template_parser.add_argument('class_uri', type=str, help='Class URI used to generate ingestion rules')
@@ -1012,11 +1864,19 @@ def get_argument_parser() -> argparse.ArgumentParser:
     model_import_parser.set_defaults(func=dispatch_model_import)
     model_import_parser.add_argument('--clear', action='store_true', help='Clear model graph before import')
     model_import_parser.add_argument('--model-graph', type=str, action='append', help='Model graph URL')
+    model_import_parser.add_argument('--profile', type=Path, metavar='FILE', help='Write per-step timings to FILE (CSV if it ends in .csv, JSON otherwise)')
 
     model_clear_parser.set_defaults(func=dispatch_model_clear)
+    model_clear_parser.add_argument('--pattern', type=str, help='Also clear the graphs of the triple store matching this regular expression')
+    model_clear_parser.add_argument('--jobs', type=positive_int, default=DEFAULT_CLEAR_JOBS, help=f'Number of graphs to clear concurrently (default: {DEFAULT_CLEAR_JOBS})')
+    model_clear_parser.add_argument('--yes', action='store_true', help='Automatically confirm clearing the graphs matching --pattern')
     model_clear_parser.add_argument('--model-graph', type=str, action='append', help='Model graph URL')
 
     nodegroups_import_parser.add_argument('directory', type=str, help='Nodegroup directory')
+    nodegroups_import_parser.add_argument('--jobs', type=positive_int, default=DEFAULT_NODEGROUP_JOBS, help=f'Number of nodegroups to store concurrently (default: {DEFAULT_NODEGROUP_JOBS})')
+    nodegroups_import_parser.add_argument('--force', action='store_true', help='Store nodegroups that are unchanged since they were last stored')
+    nodegroups_import_parser.add_argument('--prune', action='store_true', help='Delete stored nodegroups that are not in the directory')
+    nodegroups_import_parser.add_argument('--yes', action='store_true', help='Automatically confirm deletion')
     nodegroups_import_parser.set_defaults(func=dispatch_nodegroups_import)
 
     nodegroups_store_parser.add_argument('--comment', type=str, help="Nodegroup description")
@@ -1032,17 +1892,28 @@ def get_argument_parser() -> argparse.ArgumentParser:
     nodegroups_export_parser.add_argument('regexp', type=str, help='Nodegroup selection regular expression')
     nodegroups_export_parser.add_argument('directory', type=str, help='Nodegroup directory')
     nodegroups_export_parser.add_argument('--kind', type=str, default='all', choices=['all', 'nodegroup', 'report'], help='Specify kind of object to export')
+    nodegroups_export_parser.add_argument('--refresh', action='store_true', help='Refresh the local nodegroup index before selecting')
     nodegroups_export_parser.set_defaults(func=dispatch_nodegroups_export)
 
+    nodegroups_list_parser.add_argument('regexp', type=str, nargs='?', help='Only list nodegroups matching this regular expression')
+    nodegroups_list_parser.add_argument('--refresh', action='store_true', help='Refresh the local nodegroup index before listing')
     nodegroups_list_parser.set_defaults(func=dispatch_nodegroups_list)
 
     nodegroups_delete_parser.add_argument('nodegroups', type=str, nargs='+', help='IDs of nodegroups to be removed')
     nodegroups_delete_parser.add_argument('--ignore-nonexistent', action='store_true', help='Ignore nonexistent IDs')
     nodegroups_delete_parser.add_argument('--yes', action='store_true', help='Automatically confirm deletion')
     nodegroups_delete_parser.add_argument('--regexp', action='store_true', help='Match nodegroup ID with regular expression')
+    nodegroups_delete_parser.add_argument('--jobs', type=positive_int, default=DEFAULT_NODEGROUP_JOBS, help=f'Number of nodegroups to delete concurrently (default: {DEFAULT_NODEGROUP_JOBS})')
     nodegroups_delete_parser.set_defaults(func=dispatch_nodegroups_delete)
 
     nodegroups_deleteall_parser.add_argument('--yes', action='store_true', help='Automatically confirm deletion')
+    nodegroups_deleteall_parser.add_argument('--jobs', type=positive_int, default=DEFAULT_NODEGROUP_JOBS, help=f'Number of nodegroups to delete concurrently (default: {DEFAULT_NODEGROUP_JOBS})')
     nodegroups_deleteall_parser.set_defaults(func=dispatch_nodegroups_deleteall)
 
+    profile_compare_parser.add_argument('old', type=Path, help='Baseline profile')
+    profile_compare_parser.add_argument('new', type=Path, help='Profile to check against the baseline')
+    profile_compare_parser.add_argument('--threshold', type=float, default=20.0, help='Percentage slowdown of a step counted as a regression (default: 20)')
+    profile_compare_parser.add_argument('--min-seconds', type=float, default=1.0, help='Ignore slowdowns of a step smaller than this many seconds (default: 1.0)')
+    profile_compare_parser.set_defaults(func=dispatch_profile_compare)
+
     return parser
@@ -0,0 +1,142 @@
+"""On-disk cache of nodegroup query results, invalidated by graph generation stamps."""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Iterable, List, Optional
+import uuid
+
+from rack.ledger import NODEGROUP_STORE
+from rack.types import Connection
+
+DEFAULT_CACHE_DIR: Path = Path.home() / '.rack' / 'query-cache'
+DEFAULT_CACHE_SIZE: int = 256 * 1024 * 1024
+
+# Generation stamp bumped by writes whose target graphs are not known
+ALL_GRAPHS = '*'
+
+class CachedTable:
+    """Query results read back from the cache, offering the parts of the
+    SemtkTable interface used when formatting results."""
+
+    def __init__(self, column_names: List[str], rows: List[List[Any]]) -> None:
+        self.column_names: List[str] = column_names
+        self.rows: List[List[Any]] = rows
+
+    def get_column_names(self) -> List[str]:
+        return self.column_names
+
+    def get_rows(self) -> List[List[Any]]:
+        return self.rows
+
+def connection_graphs(conn: Connection) -> List[str]:
+    """List the model and data graphs named in a SemTK connection string."""
+    try:
+        obj = json.loads(conn)
+        return [entry['graph'] for entry in obj.get('model', []) + obj.get('data', [])]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return []
+
+class Generations:
+    """Per-graph generation stamps. A graph gets a new stamp whenever the CLI
+    writes to it, which retires every cached result that read from it.
+
+    Every graph has its own stamp file, replaced as a whole by each bump, so
+    processes bumping graphs concurrently cannot undo each other's bumps."""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory: Path = directory / 'generations'
+
+    def stamp_path(self, graph: str) -> Path:
+        return self.directory / hashlib.sha256(graph.encode()).hexdigest()
+
+    def stamp(self, graph: str) -> Optional[str]:
+        try:
+            return self.stamp_path(graph).read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return None
+
+    def bump(self, graphs: Iterable[str]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for graph in graphs:
+            path = self.stamp_path(graph)
+            tmp = path.with_name(f'{path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp')
+            tmp.write_text(uuid.uuid4().hex, encoding='utf-8')
+            os.replace(tmp, path)
+
+class QueryCache:
+    """Size-bounded least-recently-used cache of select and count results.
+    Entries are keyed by nodegroup ID, runtime constraints, connection and the
+    generation stamps of the graphs in the connection."""
+
+    def __init__(self, directory: Optional[Path] = None, max_bytes: Optional[int] = None) -> None:
+        self.directory: Path = directory or Path(os.environ.get('RACK_QUERY_CACHE') or DEFAULT_CACHE_DIR)
+        self.max_bytes: int = max_bytes if max_bytes is not None else int(os.environ.get('RACK_QUERY_CACHE_SIZE') or DEFAULT_CACHE_SIZE)
+        self.generations: Generations = Generations(self.directory)
+
+    def key(self, kind: str, conn: Connection, nodegroup: str, runtime_constraints: List[Any]) -> str:
+        graphs = sorted(set(connection_graphs(conn)))
+        obj = {
+            'kind': kind,
+            'connection': conn,
+            'nodegroup': nodegroup,
+            'constraints': runtime_constraints,
+            'generations': [self.generations.stamp(g) for g in graphs + [NODEGROUP_STORE, ALL_GRAPHS]],
+        }
+        return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+    def entry_path(self, key: str) -> Path:
+        return self.directory / f'{key}.json'
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self.entry_path(key)
+        try:
+            with open(path, mode='r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        os.utime(path)  # the modification time orders entries for eviction
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.entry_path(key)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with open(tmp, mode='w', encoding='utf-8') as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits its size bound."""
+        entries = []
+        for path in self.directory.glob('*.json'):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def get_table(self, key: str) -> Optional[CachedTable]:
+        value = self.get(key)
+        if value is None:
+            return None
+        return CachedTable(value['columns'], value['rows'])
+
+    def put_table(self, key: str, semtk_table: Any) -> None:
+        self.put(key, {'columns': semtk_table.get_column_names(), 'rows': semtk_table.get_rows()})
+
+def invalidate_graphs(graphs: Iterable[str]) -> None:
+    """Retire cached results that read from any of the given graphs."""
+    cache = QueryCache()
+    # Without a cache directory there are no cached results to retire
+    if cache.directory.exists():
+        cache.generations.bump(graphs)
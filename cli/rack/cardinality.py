@@ -0,0 +1,225 @@
+"""Cardinality checks run one OWL restriction at a time.
+
+SemTK checks every cardinality restriction of the model in one request and
+only answers once the whole report is ready. Here the restrictions are read
+from the model graphs first, and every restriction is checked by a SPARQL
+query of its own that counts the values of its property on the instances of
+its class and keeps the subjects outside the limit. The checks run
+concurrently and report as each one finishes, and a check that runs longer
+than its timeout is reported and abandoned, so one slow restriction does not
+hold back the others."""
+
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Generator, List, Optional, Set, Tuple, cast
+
+from rack.lazy import lazy_import
+from rack.types import Url
+
+if TYPE_CHECKING:
+    import semtk3
+else:
+    semtk3 = lazy_import('semtk3')
+
+# Restrictions checked concurrently by `rack data cardinality`
+DEFAULT_CARDINALITY_JOBS: int = 4
+
+# Slowest restrictions listed after the checks
+DEFAULT_SLOWEST: int = 5
+
+OWL = 'http://www.w3.org/2002/07/owl#'
+
+# Names of the OWL restriction properties, and how a subject's count of values
+# must compare to the limit to violate them
+RESTRICTION_KINDS = {
+    'cardinality': ('cardinality', '!='),
+    'minCardinality': ('min cardinality', '<'),
+    'maxCardinality': ('max cardinality', '>'),
+    'qualifiedCardinality': ('qualified cardinality', '!='),
+    'minQualifiedCardinality': ('min qualified cardinality', '<'),
+    'maxQualifiedCardinality': ('max qualified cardinality', '>'),
+}
+
+VIOLATION_COLUMNS = ['class', 'property', 'restriction', 'limit', 'subject', 'actual_cardinality']
+CONCISE_COLUMNS = ['subject', 'property', 'violation']
+
+RESTRICTIONS_QUERY = """prefix owl:<http://www.w3.org/2002/07/owl#>
+prefix rdfs:<http://www.w3.org/2000/01/rdf-schema#>
+select distinct ?class ?property ?kind ?limit ?onClass
+{{FROM}}
+where {
+    ?class rdfs:subClassOf ?restriction .
+    ?restriction owl:onProperty ?property .
+    ?restriction ?kind ?limit .
+    VALUES ?kind { {{KINDS}} }
+    OPTIONAL { ?restriction owl:onClass ?onClass . }
+    FILTER(isIRI(?class) && isIRI(?property))
+}"""
+
+VIOLATIONS_QUERY = """prefix rdfs:<http://www.w3.org/2000/01/rdf-schema#>
+select ?subject (COUNT(DISTINCT ?object) as ?actual_cardinality)
+{{FROM}}
+where {
+    ?subject a/rdfs:subClassOf* <{{CLASS}}> .
+    {{VALUES}}
+}
+group by ?subject
+having (COUNT(DISTINCT ?object) {{OP}} {{LIMIT}})
+order by ?subject
+{{ROWS}}"""
+
+def from_clauses(graphs: List[Url]) -> str:
+    return '\n'.join(f'FROM <{graph}>' for graph in graphs)
+
+def local_name(uri: str) -> str:
+    return uri.rsplit('#', 1)[-1].rsplit('/', 1)[-1]
+
+class Restriction:
+    """A cardinality restriction of a class on one of its properties."""
+
+    def __init__(self, cls: str, prop: str, kind: str, limit: int, on_class: Optional[str] = None) -> None:
+        self.cls: str = cls
+        self.prop: str = prop
+        self.kind: str = kind
+        self.limit: int = limit
+        self.on_class: Optional[str] = on_class
+
+    def name(self) -> str:
+        return f'{local_name(self.cls)} {local_name(self.prop)} {RESTRICTION_KINDS[self.kind][0]} {self.limit}'
+
+    def violations_query(self, graphs: List[Url], max_rows: int) -> str:
+        """Subjects of the class whose count of values breaks the restriction.
+        Values only count towards a qualified restriction when they belong to
+        its class, and subjects without values only break a minimum."""
+        (_, op) = RESTRICTION_KINDS[self.kind]
+        values = f'?subject <{self.prop}> ?object .'
+        if self.on_class is not None:
+            values += f' ?object a/rdfs:subClassOf* <{self.on_class}> .'
+        if op != '>':
+            values = f'OPTIONAL {{ {values} }}'
+        return (VIOLATIONS_QUERY
+                .replace('{{FROM}}', from_clauses(graphs))
+                .replace('{{CLASS}}', self.cls)
+                .replace('{{VALUES}}', values)
+                .replace('{{OP}}', op)
+                .replace('{{LIMIT}}', str(self.limit))
+                .replace('{{ROWS}}', f'limit {max_rows}' if max_rows >= 0 else ''))
+
+def list_restrictions(model_graphs: List[Url]) -> List[Restriction]:
+    """Read the cardinality restrictions of the model, in a stable order."""
+    query = (RESTRICTIONS_QUERY
+             .replace('{{FROM}}', from_clauses(model_graphs))
+             .replace('{{KINDS}}', ' '.join(f'<{OWL}{kind}>' for kind in RESTRICTION_KINDS)))
+    table = semtk3.query_raw_sparql(query)
+    restrictions = []
+    for row in table.get_rows():
+        (cls, prop, kind, limit, on_class) = (str(cell) for cell in row)
+        restrictions.append(Restriction(cls, prop, local_name(kind), int(limit), on_class or None))
+    return sorted(restrictions, key=lambda r: (r.cls, r.prop, r.kind, r.limit))
+
+def check_restriction(restriction: Restriction, graphs: List[Url], max_rows: int) -> List[List[str]]:
+    """Rows of VIOLATION_COLUMNS for the subjects breaking a restriction."""
+    table = semtk3.query_raw_sparql(restriction.violations_query(graphs, max_rows))
+    return [
+        [restriction.cls, restriction.prop, RESTRICTION_KINDS[restriction.kind][0], str(restriction.limit), str(subject), str(count)]
+        for (subject, count) in table.get_rows()
+    ]
+
+def concise_row(row: List[str]) -> List[str]:
+    (_, prop, kind, limit, subject, count) = row
+    return [subject, local_name(prop), f'{kind} {limit}, has {count}']
+
+class CheckResult:
+    """The outcome of checking one restriction. A check that failed has an
+    error, and one that ran out of time is marked timed_out."""
+
+    def __init__(self, restriction: Restriction, seconds: float, rows: Optional[List[List[str]]] = None,
+                 error: Optional[BaseException] = None, timed_out: bool = False) -> None:
+        self.restriction: Restriction = restriction
+        self.seconds: float = seconds
+        self.rows: List[List[str]] = rows or []
+        self.error: Optional[BaseException] = error
+        self.timed_out: bool = timed_out
+
+    def status(self) -> str:
+        if self.timed_out:
+            return 'timeout'
+        if self.error is not None:
+            return 'failed'
+        return f'{len(self.rows)} violations' if self.rows else 'ok'
+
+def run_checks(restrictions: List[Restriction], graphs: List[Url], jobs: int, timeout: Optional[float] = None, max_rows: int = -1) -> Generator[CheckResult, None, None]:
+    """Check restrictions concurrently, yielding each result as it is ready.
+
+    Requests cannot be interrupted, so a check that outlives its timeout is
+    left to finish on its own daemon thread, and its result is dropped. A
+    new worker takes its place so the other checks keep their concurrency,
+    and the late one retires once its request returns. Workers stop taking
+    checks when the caller stops reading results."""
+    pending: 'queue.Queue[int]' = queue.Queue()
+    for i in range(len(restrictions)):
+        pending.put(i)
+    results: 'queue.Queue[Tuple[int, CheckResult]]' = queue.Queue()
+    running: Dict[int, float] = {}
+    expired: Set[int] = set()
+    stopped = threading.Event()
+    lock = threading.Lock()
+
+    def work() -> None:
+        while not stopped.is_set():
+            try:
+                i = pending.get_nowait()
+            except queue.Empty:
+                return
+            started = time.monotonic()
+            with lock:
+                running[i] = started
+            try:
+                rows = check_restriction(restrictions[i], graphs, max_rows)
+                result = CheckResult(restrictions[i], time.monotonic() - started, rows)
+            except Exception as e:
+                result = CheckResult(restrictions[i], time.monotonic() - started, error=e)
+            with lock:
+                del running[i]
+                if i in expired:
+                    # A replacement worker took over
+                    return
+            results.put((i, result))
+
+    def add_worker() -> None:
+        threading.Thread(target=work, name='rack-cardinality', daemon=True).start()
+
+    for _ in range(max(1, min(jobs, len(restrictions)))):
+        add_worker()
+
+    done: Set[int] = set()
+    try:
+        while len(done) < len(restrictions):
+            wait = None
+            if timeout is not None:
+                with lock:
+                    starts = [started for (i, started) in running.items() if i not in expired]
+                wait = max(0.0, min(starts) + timeout - time.monotonic()) if starts else timeout
+            try:
+                (i, result) = results.get(timeout=wait)
+            except queue.Empty:
+                now = time.monotonic()
+                with lock:
+                    late = [(i, started) for (i, started) in running.items() if i not in expired and now - started >= cast(float, timeout)]
+                    expired.update(i for (i, _) in late)
+                for (i, started) in late:
+                    done.add(i)
+                    if not pending.empty():
+                        add_worker()
+                    yield CheckResult(restrictions[i], now - started, timed_out=True)
+                continue
+            done.add(i)
+            yield result
+    finally:
+        stopped.set()
+        while True:
+            try:
+                pending.get_nowait()
+            except queue.Empty:
+                break
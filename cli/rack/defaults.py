@@ -7,3 +7,6 @@ MODEL_GRAPH: Url = Url("http://rack001/model")
 DEFAULT_DATA_GRAPH = Url("http://rack001/data")
 DEFAULT_TRIPLE_STORE = Url("http://localhost:3030/RACK")
 DEFAULT_TRIPLE_STORE_TYPE = "fuseki"
+
+# Graphs cleared concurrently by `rack data clear` and `rack model clear`
+DEFAULT_CLEAR_JOBS = 4
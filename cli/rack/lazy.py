@@ -0,0 +1,30 @@
+"""Deferred imports, so that a rack command only pays for the libraries it uses."""
+
+import importlib.util
+import sys
+from types import ModuleType
+
+def lazy_import(name: str) -> ModuleType:
+    """Return the named module, postponing its execution until one of its
+    attributes is first used. A missing module is still reported right away.
+
+    Modules imported this way are declared for type checkers with
+
+        if TYPE_CHECKING:
+            import semtk3
+        else:
+            semtk3 = lazy_import('semtk3')
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
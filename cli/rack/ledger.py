@@ -0,0 +1,241 @@
+"""Local ledger of ingestion package content used to skip unchanged steps
+when an ingestion package is imported again."""
+
+import csv
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+import posixpath
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from rack.lazy import lazy_import
+from rack.manifest import Manifest, StepType
+from rack.types import Url
+from rack.defaults import *
+
+if TYPE_CHECKING:
+    import yaml
+else:
+    yaml = lazy_import('yaml')
+
+DEFAULT_LEDGER_PATH: Path = Path.home() / '.rack' / 'ingestion-ledger.json'
+
+# Pseudo-graph under which nodegroup store contents are recorded
+NODEGROUP_STORE = 'nodegroup-store'
+
+class IngestionLedger:
+    """Content hashes of the package steps loaded into each graph, keyed by
+    triple store, manifest name, target graph and step."""
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path: Path = path or Path(os.environ.get('RACK_LEDGER') or DEFAULT_LEDGER_PATH)
+        self.entries: Dict[str, Dict[str, Dict[str, Dict[str, str]]]] = {}
+        if self.path.exists():
+            with open(self.path, mode='r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, mode='w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def lookup(self, triple_store: Url, manifest: str, graph: str, step: str) -> Optional[str]:
+        return self.entries.get(triple_store, {}).get(manifest, {}).get(graph, {}).get(step)
+
+    def record(self, triple_store: Url, manifest: str, graph: str, step: str, digest: str) -> None:
+        self.entries.setdefault(triple_store, {}).setdefault(manifest, {}).setdefault(graph, {})[step] = digest
+
+    def forget_graphs(self, triple_store: Url, graphs: Iterable[str]) -> None:
+        """Drop everything recorded for the given graphs, e.g. after clearing them."""
+        graphs = set(graphs)
+        for manifests in self.entries.get(triple_store, {}).values():
+            for graph in graphs:
+                manifests.pop(graph, None)
+
+class PackageStep:
+    """A step of a manifest in an ingestion package together with the
+    package members it reads and their combined content hash."""
+
+    def __init__(self, step_type: StepType, arg: Any, key: str, graphs: List[str], members: List[str]) -> None:
+        self.step_type: StepType = step_type
+        self.arg: Any = arg
+        self.key: str = key
+        self.graphs: List[str] = graphs
+        self.members: List[str] = members
+        self.digest: Optional[str] = None
+        self.nested: Optional['PackagePlan'] = None
+        self.changed: bool = True
+
+class PackagePlan:
+    """The steps of one (possibly nested) manifest of an ingestion package."""
+
+    def __init__(self, member: str, manifest: Manifest, document: Dict[str, Any], steps: List[PackageStep]) -> None:
+        self.member: str = member
+        self.manifest: Manifest = manifest
+        self.document: Dict[str, Any] = document
+        self.steps: List[PackageStep] = steps
+
+    def any_changed(self) -> bool:
+        return any(step.changed for step in self.steps if step.step_type != StepType.COPYGRAPH)
+
+    def unchanged_steps(self) -> Iterable['PackageStep']:
+        for step in self.steps:
+            if step.nested is not None:
+                yield from step.nested.unchanged_steps()
+            elif not step.changed:
+                yield step
+
+class PackageHasher:
+    """Compute content hashes for the steps of an ingestion package zip."""
+
+    def __init__(self, zipfile: ZipFile) -> None:
+        self.zipfile: ZipFile = zipfile
+        self.names: List[str] = zipfile.namelist()
+        self.file_digests: Dict[str, str] = {}
+        self.file_lines: Dict[str, int] = {}
+
+    def read(self, member: str) -> bytes:
+        return self.zipfile.read(member)
+
+    def read_yaml(self, member: str) -> Any:
+        with self.zipfile.open(member) as f:
+            return yaml.safe_load(io.TextIOWrapper(f, encoding='utf-8-sig'))
+
+    def file_digest(self, member: str) -> str:
+        digest = self.file_digests.get(member)
+        if digest is None:
+            h = hashlib.sha256()
+            lines = 0
+            with self.zipfile.open(member) as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+                    lines += block.count(b'\n')
+            digest = h.hexdigest()
+            self.file_digests[member] = digest
+            self.file_lines[member] = lines
+        return digest
+
+    def line_count(self, member: str) -> int:
+        """Number of lines in a member, counted while it is hashed."""
+        self.file_digest(member)
+        return self.file_lines[member]
+
+    def digest(self, members: List[str]) -> str:
+        h = hashlib.sha256()
+        for member in sorted(members):
+            h.update(f'{member}\0{self.file_digest(member)}\n'.encode())
+        return h.hexdigest()
+
+    def model_step(self, member: str) -> PackageStep:
+        obj = self.read_yaml(member)
+        base = posixpath.dirname(member)
+        members = [member] + [posixpath.normpath(posixpath.join(base, f)) for f in obj['files']]
+        graphs = obj.get('model-graphs') or [MODEL_GRAPH]
+        if isinstance(graphs, str):
+            graphs = [graphs]
+        return PackageStep(StepType.MODEL, None, f'model:{member}', list(graphs), members)
+
+    def data_step(self, member: str) -> PackageStep:
+        obj = self.read_yaml(member)
+        base = posixpath.dirname(member)
+        members = [member]
+        for step in obj['ingestion-steps']:
+            for field in ['owl', 'csv', 'nodegroup_json']:
+                if field in step:
+                    members.append(posixpath.normpath(posixpath.join(base, step[field])))
+        graphs = [obj.get('data-graph', DEFAULT_DATA_GRAPH)]
+        return PackageStep(StepType.DATA, None, f'data:{member}', graphs, members)
+
+    def nodegroups_step(self, directory: str) -> PackageStep:
+        store_data = posixpath.join(directory, 'store_data.csv')
+        members = [store_data]
+        with self.zipfile.open(store_data) as f:
+            for row in csv.DictReader(io.TextIOWrapper(f, encoding='utf-8-sig')):
+                members.append(posixpath.join(directory, row['jsonFile']))
+        return PackageStep(StepType.NODEGROUPS, None, f'nodegroups:{directory}', [NODEGROUP_STORE], members)
+
+    def plan(self, member: str) -> PackagePlan:
+        """Hash every step of the manifest at the given member, recursively."""
+        document = self.read_yaml(member)
+        manifest = Manifest.fromZip(self.zipfile, member)
+        base = posixpath.dirname(member)
+
+        steps = []
+        for (step_type, arg) in manifest.steps:
+            if step_type == StepType.COPYGRAPH:
+                step = PackageStep(step_type, arg, f'copygraph:{arg[0]}:{arg[1]}', [arg[1]], [])
+            else:
+                path = posixpath.normpath(posixpath.join(base, arg))
+                if step_type == StepType.MODEL:
+                    step = self.model_step(path)
+                elif step_type == StepType.DATA:
+                    step = self.data_step(path)
+                elif step_type == StepType.NODEGROUPS:
+                    step = self.nodegroups_step(path)
+                else:
+                    nested = self.plan(path)
+                    step = PackageStep(step_type, arg, f'manifest:{path}', [], [])
+                    step.nested = nested
+                step.arg = arg
+                if step.nested is None:
+                    step.digest = self.digest(step.members)
+            steps.append(step)
+
+        return PackagePlan(member, manifest, document, steps)
+
+def mark_changed(plan: PackagePlan, ledger: IngestionLedger, triple_store: Url, force: bool) -> bool:
+    """Compare the steps of a package against the ledger, marking the ones that
+    need to be loaded again. Returns whether anything changed."""
+    for step in plan.steps:
+        if step.nested is not None:
+            step.changed = mark_changed(step.nested, ledger, triple_store, force)
+        elif step.step_type != StepType.COPYGRAPH:
+            step.changed = force or any(
+                ledger.lookup(triple_store, plan.manifest.getName(), graph, step.key) != step.digest
+                for graph in step.graphs)
+    changed = plan.any_changed()
+    for step in plan.steps:
+        if step.step_type == StepType.COPYGRAPH:
+            step.changed = changed
+    return changed
+
+def record_loaded(plan: PackagePlan, ledger: IngestionLedger, triple_store: Url) -> None:
+    """Record the hashes of the steps loaded from a package."""
+    for step in plan.steps:
+        if step.nested is not None:
+            if step.changed:
+                record_loaded(step.nested, ledger, triple_store)
+        elif step.changed and step.digest is not None:
+            for graph in step.graphs:
+                ledger.record(triple_store, plan.manifest.getName(), graph, step.key, step.digest)
+
+def write_reduced_package(hasher: PackageHasher, plan: PackagePlan, out: Path) -> None:
+    """Write an ingestion package containing only the changed steps of a plan."""
+
+    with ZipFile(out, mode='w', compression=ZIP_DEFLATED) as zout:
+        written = set()
+
+        def write_plan(p: PackagePlan) -> None:
+            document = dict(p.document)
+            document['steps'] = [
+                original for (original, step) in zip(p.document.get('steps', []), p.steps)
+                if step.changed
+            ]
+            zout.writestr(p.member, yaml.safe_dump(document))
+            written.add(p.member)
+            for step in p.steps:
+                if not step.changed:
+                    continue
+                if step.nested is not None:
+                    write_plan(step.nested)
+                for member in step.members:
+                    if member not in written:
+                        zout.writestr(hasher.zipfile.getinfo(member), hasher.read(member))
+                        written.add(member)
+
+        write_plan(plan)
@@ -1,14 +1,18 @@
 from enum import Enum
-from jsonschema import validate
+from rack.lazy import lazy_import
 from rack.types import Connection, Url
-import os
-import os.path
+import io
 from pathlib import Path
-import shutil
-from tempfile import TemporaryDirectory
-from typing import Any, Dict, List, Tuple, Optional
-import yaml
-import semtk3
+import posixpath
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Tuple, Optional
+from zipfile import ZipFile
+
+if TYPE_CHECKING:
+    import yaml
+    import semtk3
+else:
+    yaml = lazy_import('yaml')
+    semtk3 = lazy_import('semtk3')
 
 from rack.defaults import *
 
@@ -100,6 +104,20 @@ class StepType(Enum):
     COPYGRAPH = 5
 
 
+def find_toplevel_manifest(names: Iterable[str]) -> str:
+    """Locate the top-level manifest.yaml among the members of a package zip,
+    either at the root or inside a single top-level directory."""
+    names = list(names)
+    if 'manifest.yaml' in names:
+        return 'manifest.yaml'
+    top_level = {name.split('/', 1)[0] for name in names}
+    if len(top_level) == 1:
+        candidate = f'{top_level.pop()}/manifest.yaml'
+        if candidate in names:
+            return candidate
+    raise FileNotFoundError('manifest.yaml')
+
+
 class Manifest:
     def __init__(self, name: str, description: Optional[str] = None) -> None:
         self.name: str = name
@@ -164,25 +182,37 @@ class Manifest:
 
     @staticmethod
     def getToplevelManifest(zipfile: Path) -> 'Manifest':
-        with TemporaryDirectory() as tmpdir_str:
-            tmpdir = Path(tmpdir_str)
-
-            shutil.unpack_archive(zipfile, tmpdir)
+        """Read the top-level manifest of an ingestion package zip file. Only
+        the manifest member is decompressed, not the rest of the package."""
+        with ZipFile(zipfile) as package_zip:
+            return Manifest.fromZip(package_zip, find_toplevel_manifest(package_zip.namelist()))
 
-            top_level_entries = os.listdir(tmpdir)
-            if "manifest.yaml" in top_level_entries:
-                manifest_path = tmpdir / "manifest.yaml"
-            elif len(top_level_entries) == 1 and os.path.isdir(tmpdir / top_level_entries[0]):
-                manifest_path = tmpdir / top_level_entries[0] / "manifest.yaml"
-            else:
-                raise FileNotFoundError("manifest.yaml")
+    @staticmethod
+    def getManifests(zipfile: Path) -> Dict[str, 'Manifest']:
+        """Read the top-level manifest of an ingestion package zip file and
+        every manifest nested in it, keyed by member name, top-level first."""
+        manifests: Dict[str, Manifest] = {}
+        with ZipFile(zipfile) as package_zip:
+            def visit(member: str) -> None:
+                manifest = Manifest.fromZip(package_zip, member)
+                manifests[member] = manifest
+                for (stepType, stepFile) in manifest.steps:
+                    if stepType == StepType.MANIFEST:
+                        visit(posixpath.normpath(posixpath.join(posixpath.dirname(member), stepFile)))
+            visit(find_toplevel_manifest(package_zip.namelist()))
+        return manifests
 
-            with open(manifest_path, mode='r', encoding='utf-8-sig') as manifest_file:
-                return Manifest.fromYAML(manifest_file)
+    @staticmethod
+    def fromZip(package_zip: ZipFile, member: str) -> 'Manifest':
+        """Populate a Manifest from a YAML member of an open zip file."""
+        with package_zip.open(member) as manifest_file:
+            return Manifest.fromYAML(io.TextIOWrapper(manifest_file, encoding='utf-8-sig'))
 
     @staticmethod
     def fromYAML(src: Any) -> 'Manifest':
         """Populate a Manifest using a YAML file following the MANIFEST_SCHEMA."""
+        from jsonschema import validate
+
         obj = yaml.safe_load(src)
         validate(obj, MANIFEST_SCHEMA)
 
@@ -0,0 +1,227 @@
+"""Local index of the SemTK nodegroup store, and bulk synchronization of a
+directory of nodegroups with the store.
+
+The index holds the ID, comments, creator, creation date and item type of
+every stored item, so that listing and selecting items by regular expression
+run locally. It is refreshed from the store table, which carries no JSON,
+once it is older than RACK_NODEGROUP_INDEX_MAX_AGE seconds or when asked to.
+
+The store does not report content hashes either, so the index also records
+the hash of every item rack stored or exported, together with the creation
+date the store gave the item. An item whose local content hashes the same
+as the recorded hash, and whose creation date in the store is unchanged,
+is skipped by imports and exports. Items can be uploaded and deleted in
+parallel."""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import csv
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from rack.lazy import lazy_import
+from rack.types import Url
+
+if TYPE_CHECKING:
+    import semtk3
+    from semtk3.semtktable import SemtkTable
+else:
+    semtk3 = lazy_import('semtk3')
+
+DEFAULT_NODEGROUP_INDEX_PATH: Path = Path.home() / '.rack' / 'nodegroup-index.json'
+
+# Seconds after which the index is refreshed before it is used
+DEFAULT_INDEX_MAX_AGE: float = 300.0
+
+# Columns of the store_data.csv files written by exports
+STORE_DATA_FIELDS = ['ID', 'comments', 'creator', 'jsonFile', 'itemType']
+
+# Nodegroups stored or deleted concurrently, within the HTTP connection pool size
+DEFAULT_NODEGROUP_JOBS: int = 8
+
+# Item type of store_data.csv rows that do not give one
+DEFAULT_ITEM_TYPE = 'PrefabNodeGroup'
+
+T = TypeVar('T')
+
+class NodegroupSyncError(Exception):
+    """Raised when some uploads or deletions of a synchronization failed,
+    after the others have completed and the index has been saved."""
+
+class LocalItem:
+    """A nodegroup or report described by a row of a store_data.csv file."""
+
+    def __init__(self, item_id: str, comments: str, creator: str, json_path: Path, item_type: str = DEFAULT_ITEM_TYPE) -> None:
+        self.id: str = item_id
+        self.comments: str = comments
+        self.creator: str = creator
+        self.json_path: Path = json_path
+        self.item_type: str = item_type
+        self.json_str: Optional[str] = None
+        self.digest: str = ''
+
+    def load(self) -> 'LocalItem':
+        """Read the JSON of the item and hash it along with its metadata."""
+        with open(self.json_path, mode='r', encoding='utf-8-sig') as f:
+            self.json_str = f.read()
+        h = hashlib.sha256()
+        for part in [self.item_type, self.comments, self.creator, self.json_str]:
+            h.update(part.encode('utf-8') + b'\0')
+        self.digest = h.hexdigest()
+        return self
+
+def read_store_data(directory: Path) -> List[LocalItem]:
+    """Read the items listed in the store_data.csv of a nodegroups directory."""
+    with open(directory / 'store_data.csv', mode='r', encoding='utf-8-sig') as f:
+        return [
+            LocalItem(row['ID'], row.get('comments') or '', row.get('creator') or '', directory / row['jsonFile'],
+                      row.get('itemType') or DEFAULT_ITEM_TYPE).load()
+            for row in csv.DictReader(f)
+        ]
+
+def item_type_name(item_type: str) -> str:
+    """The store reports item types as URIs; store_data.csv uses the local name."""
+    return item_type.split('#')[-1]
+
+class NodegroupIndex:
+    """What rack knows about the nodegroup store of each SemTK instance: the
+    metadata of every item, and the content hash of the items rack stored."""
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path: Path = path or Path(os.environ.get('RACK_NODEGROUP_INDEX') or DEFAULT_NODEGROUP_INDEX_PATH)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if self.path.exists():
+            with open(self.path, mode='r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        with open(tmp, mode='w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def store(self, base_url: Url) -> Dict[str, Any]:
+        return self.entries.setdefault(base_url, {'refreshed': 0.0, 'items': {}})
+
+    def items(self, base_url: Url) -> Dict[str, Dict[str, str]]:
+        return self.store(base_url)['items']
+
+    def stale(self, base_url: Url, max_age: float) -> bool:
+        return time.time() - self.store(base_url)['refreshed'] > max_age
+
+    def invalidate(self, base_url: Url) -> None:
+        """Make the next use of the index refresh it, e.g. after a write whose effect is unknown."""
+        self.store(base_url)['refreshed'] = 0.0
+
+    def refresh(self, base_url: Url, table: 'SemtkTable', stored: Optional[Dict[str, str]] = None) -> None:
+        """Replace the metadata of a store with a fresh copy of its table. The
+        hash of an item is only kept while its creation date is unchanged,
+        except for the items just stored, whose hashes are given in stored."""
+        stored = stored or {}
+        columns = table.get_column_names()
+        old = self.items(base_url)
+        new: Dict[str, Dict[str, str]] = {}
+        for row in table.get_rows():
+            fields = dict(zip(columns, (str(cell) for cell in row)))
+            entry = {
+                'comments': fields.get('comments', ''),
+                'creator': fields.get('creator', ''),
+                'creationDate': fields.get('creationDate', ''),
+                'itemType': item_type_name(fields.get('itemType', DEFAULT_ITEM_TYPE)),
+            }
+            previous = old.get(fields['ID'], {})
+            if fields['ID'] in stored:
+                entry['digest'] = stored[fields['ID']]
+            elif 'digest' in previous and previous.get('creationDate') == entry['creationDate']:
+                entry['digest'] = previous['digest']
+            new[fields['ID']] = entry
+        self.entries[base_url] = {'refreshed': time.time(), 'items': new}
+
+    def record_digest(self, base_url: Url, item_id: str, digest: str) -> None:
+        entry = self.items(base_url).get(item_id)
+        if entry is not None:
+            entry['digest'] = digest
+
+    def select(self, base_url: Url, regexps: List['re.Pattern[str]'], item_type: Optional[str] = None) -> List[str]:
+        """IDs of the items matching any of the regular expressions, and of the
+        given item type unless it is None."""
+        return [
+            id for (id, entry) in sorted(self.items(base_url).items())
+            if (item_type is None or entry.get('itemType') == item_type) and any(r.search(id) for r in regexps)
+        ]
+
+    def forget(self, base_url: Url, ids: Iterable[str]) -> None:
+        items = self.items(base_url)
+        for item_id in ids:
+            items.pop(item_id, None)
+
+def index_max_age() -> float:
+    return float(os.environ.get('RACK_NODEGROUP_INDEX_MAX_AGE') or DEFAULT_INDEX_MAX_AGE)
+
+def current_index(base_url: Url, refresh: bool = False) -> NodegroupIndex:
+    """Load the index, refreshing the entries of a store when they are stale."""
+    index = NodegroupIndex()
+    if refresh or index.stale(base_url, index_max_age()):
+        index.refresh(base_url, semtk3.get_store_table())
+        index.save()
+    return index
+
+def write_store_data(directory: Path, items: List[LocalItem]) -> None:
+    with open(directory / 'store_data.csv', mode='w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(STORE_DATA_FIELDS)
+        for item in items:
+            writer.writerow([item.id, item.comments, item.creator, os.path.relpath(item.json_path, directory), item.item_type])
+
+class SyncPlan:
+    """What to do to make the store hold the items of a directory."""
+
+    def __init__(self) -> None:
+        self.new: List[LocalItem] = []
+        self.changed: List[LocalItem] = []
+        self.unchanged: List[LocalItem] = []
+        self.prune: List[Tuple[str, str]] = []
+        # Item type under which each changed item is stored now
+        self.stored_types: Dict[str, str] = {}
+
+def plan_sync(local: List[LocalItem], stored: Dict[str, Dict[str, str]], prune: bool = False, force: bool = False) -> SyncPlan:
+    """Compare local items against the index of a store. With prune, stored
+    items of the same types that are missing locally are deleted."""
+    plan = SyncPlan()
+    for item in local:
+        entry = stored.get(item.id)
+        if entry is None:
+            plan.new.append(item)
+        elif force or entry.get('digest') != item.digest or entry.get('itemType') != item.item_type:
+            plan.changed.append(item)
+            plan.stored_types[item.id] = entry.get('itemType', DEFAULT_ITEM_TYPE)
+        else:
+            plan.unchanged.append(item)
+
+    if prune:
+        ids = {item.id for item in local}
+        types = {item.item_type for item in local}
+        plan.prune = [(id, entry['itemType']) for (id, entry) in sorted(stored.items()) if id not in ids and entry.get('itemType') in types]
+    return plan
+
+def run_batch(action: Callable[[T], Any], items: List[T], jobs: int) -> Iterator[Tuple[T, Optional[BaseException]]]:
+    """Apply action to items concurrently, yielding each item with the
+    exception it raised, if any, as it completes."""
+    if not items:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(items)))) as executor:
+        futures = {executor.submit(action, item): item for item in items}
+        for future in as_completed(futures):
+            yield (futures[future], future.exception())
+
+def store_item(item: LocalItem, stored_type: Optional[str] = None) -> None:
+    """Upload one item. The store has no update, so an item already stored,
+    under stored_type, is deleted first."""
+    if stored_type is not None:
+        semtk3.delete_item_from_store(item.id, stored_type)
+    semtk3.store_item(item.id, item.comments, item.creator, item.json_str, item.item_type)
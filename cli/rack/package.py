@@ -0,0 +1,321 @@
+"""Single-pass, reproducible writer for ingestion package zip files, with an
+optional cache of compressed files shared between builds."""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import json
+import os
+from pathlib import Path
+import posixpath
+import shutil
+import sys
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from typing import IO, Any, Dict, List, Optional, Set, Tuple, Union, cast
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+import zlib
+
+DEFAULT_COMPRESSION_LEVEL: int = 6
+
+# Files at least this large are compressed ahead of time by worker threads
+PARALLEL_THRESHOLD: int = 1 << 20
+
+CHUNK_SIZE: int = 1 << 20
+
+# Compressed data kept in memory per worker before spilling to disk
+SPOOL_SIZE: int = 64 << 20
+
+DEFAULT_BUILD_CACHE_SIZE: int = 8 << 30
+
+# Oldest and newest CPython versions whose ZipFile internals write_deflated
+# has been checked against
+RAW_WRITE_VERSIONS: Tuple[Tuple[int, int], Tuple[int, int]] = ((3, 8), (3, 13))
+
+# Every member gets the same metadata, so that identical inputs produce a
+# byte-identical package on any machine
+FIXED_DATE_TIME: Tuple[int, int, int, int, int, int] = (1980, 1, 1, 0, 0, 0)
+FILE_ATTRIBUTES: int = 0o100644 << 16
+DIRECTORY_ATTRIBUTES: int = (0o40755 << 16) | 0x10  # with the MS-DOS directory flag
+
+class DeflatedFile:
+    """Raw deflate stream of a file together with the sizes and CRC that go
+    into its zip headers."""
+
+    def __init__(self, data: IO[bytes], file_size: int, compress_size: int, crc: int) -> None:
+        self.data: IO[bytes] = data
+        self.file_size: int = file_size
+        self.compress_size: int = compress_size
+        self.crc: int = crc
+
+def deflate_file(path: Path, level: int, out: Optional[IO[bytes]] = None) -> DeflatedFile:
+    """Compress a file the way zipfile does for ZIP_DEFLATED members, into
+    out or else a temporary file."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    if out is None:
+        out = cast(IO[bytes], SpooledTemporaryFile(max_size=SPOOL_SIZE))
+    crc = 0
+    file_size = 0
+    with open(path, mode='rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            crc = zlib.crc32(block, crc)
+            file_size += len(block)
+            out.write(compressor.compress(block))
+    out.write(compressor.flush())
+    compress_size = out.tell()
+    out.seek(0)
+    return DeflatedFile(out, file_size, compress_size, crc)
+
+def raw_writes_supported(zf: ZipFile) -> bool:
+    """Whether write_deflated can copy compressed data into zf as is. This
+    relies on ZipFile internals, which are only trusted on the CPython
+    versions in RAW_WRITE_VERSIONS."""
+    (oldest, newest) = RAW_WRITE_VERSIONS
+    return (sys.implementation.name == 'cpython' and oldest <= sys.version_info[:2] <= newest
+            and all(hasattr(zf, name) for name in ['_lock', '_writing', '_didModify', '_writecheck', 'fp', 'start_dir']))
+
+def write_deflated(zf: ZipFile, zinfo: ZipInfo, deflated: DeflatedFile, level: int) -> None:
+    """Append a member whose data was compressed by deflate_file.
+
+    zipfile has no public API for storing data it did not compress itself.
+    Where raw_writes_supported, this does what ZipFile.open(zinfo, 'w') does
+    with the sizes known upfront. Elsewhere the data is decompressed and
+    written with ZipFile.writestr, which compresses it again to the same
+    bytes but holds the whole file in memory."""
+    if not raw_writes_supported(zf):
+        decompressor = zlib.decompressobj(-15)
+        data = b''.join(decompressor.decompress(block) for block in iter(lambda: deflated.data.read(CHUNK_SIZE), b'')) + decompressor.flush()
+        zf.writestr(zinfo, data, compress_type=ZIP_DEFLATED, compresslevel=level)
+        return
+
+    internals = cast(Any, zf)
+    zinfo.compress_type = ZIP_DEFLATED
+    zinfo.file_size = deflated.file_size
+    zinfo.compress_size = deflated.compress_size
+    zinfo.CRC = deflated.crc
+    zinfo.flag_bits = 0x00
+    with internals._lock:
+        if internals._writing:
+            raise ValueError("Can't write to the ZIP file while there is another write handle open on it.")
+        internals.fp.seek(internals.start_dir)
+        zinfo.header_offset = internals.fp.tell()
+        internals._writecheck(zinfo)
+        internals._didModify = True
+        internals.fp.write(zinfo.FileHeader())
+        shutil.copyfileobj(deflated.data, internals.fp, CHUNK_SIZE)
+        internals.start_dir = internals.fp.tell()
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def member_info(name: str, attributes: int = FILE_ATTRIBUTES) -> ZipInfo:
+    zinfo = ZipInfo(name, date_time=FIXED_DATE_TIME)
+    zinfo.create_system = 3  # Unix, whichever system builds the package
+    zinfo.external_attr = attributes
+    return zinfo
+
+class BuildCache:
+    """Directory of compressed package files shared between builds, keyed by
+    content hash and compression level. The content hashes of source files
+    are remembered by path, size and modification time, so unchanged files
+    are neither read nor compressed again."""
+
+    def __init__(self, directory: Path, max_bytes: Optional[int] = None) -> None:
+        self.directory: Path = directory
+        self.max_bytes: int = max_bytes if max_bytes is not None else int(os.environ.get('RACK_BUILD_CACHE_SIZE') or DEFAULT_BUILD_CACHE_SIZE)
+        self.index_path: Path = directory / 'index.json'
+        self.objects: Path = directory / 'objects'
+        self.index: Dict[str, List[Any]] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+        try:
+            with open(self.index_path, mode='r', encoding='utf-8') as f:
+                self.index = dict(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def digest(self, path: Path) -> str:
+        st = path.stat()
+        entry = self.index.get(str(path))
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return str(entry[2])
+        digest = file_digest(path)
+        self.index[str(path)] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def object_path(self, digest: str, level: int) -> Path:
+        return self.objects / f'{digest}-{level}.deflate'
+
+    def get(self, digest: str, level: int) -> Optional[DeflatedFile]:
+        path = self.object_path(digest, level)
+        try:
+            with open(path.with_suffix('.json'), mode='r', encoding='utf-8') as f:
+                meta = json.load(f)
+            data = open(path, mode='rb')
+        except (FileNotFoundError, ValueError):
+            return None
+        os.utime(path)  # the modification time orders objects for eviction
+        self.hits += 1
+        return DeflatedFile(data, meta['file_size'], meta['compress_size'], meta['crc'])
+
+    def put(self, digest: str, level: int, source: Path) -> DeflatedFile:
+        """Compress source into the cache and return the cached copy."""
+        self.objects.mkdir(parents=True, exist_ok=True)
+        path = self.object_path(digest, level)
+        with NamedTemporaryFile(dir=self.objects, suffix='.tmp', delete=False) as tmp:
+            deflated = deflate_file(source, level, cast(IO[bytes], tmp))
+        os.replace(tmp.name, path)
+        meta = {'file_size': deflated.file_size, 'compress_size': deflated.compress_size, 'crc': deflated.crc}
+        with NamedTemporaryFile(mode='w', dir=self.objects, suffix='.tmp', delete=False) as tmp_meta:
+            json.dump(meta, tmp_meta)
+        os.replace(tmp_meta.name, path.with_suffix('.json'))
+        self.misses += 1
+        return DeflatedFile(open(path, mode='rb'), deflated.file_size, deflated.compress_size, deflated.crc)
+
+    def save(self) -> None:
+        """Save the content hash index and evict least recently used objects
+        until the cache fits its size bound."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_name(f'{self.index_path.name}.{os.getpid()}.tmp')
+        with open(tmp, mode='w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+
+        entries = []
+        for path in self.objects.glob('*.deflate'):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            path.with_suffix('.json').unlink(missing_ok=True)
+            total -= size
+
+class PackageWriter:
+    """Members of an ingestion package, written into a zip file in one pass
+    straight from their source files. Files with identical content are only
+    stored once; add_file returns the name under which a file ended up."""
+
+    def __init__(self, cache: Optional[BuildCache] = None) -> None:
+        self.cache: Optional[BuildCache] = cache
+        self.members: Dict[str, Union[Path, bytes]] = {}
+        self.directories: Set[str] = set()
+        self.by_source: Dict[Path, str] = {}
+        self.by_size: Dict[int, List[str]] = {}
+        self.digests: Dict[Path, str] = {}
+        self.duplicates: int = 0
+
+    def digest(self, path: Path) -> str:
+        digest = self.digests.get(path)
+        if digest is None:
+            digest = self.cache.digest(path) if self.cache is not None else file_digest(path)
+            self.digests[path] = digest
+        return digest
+
+    def deflate(self, path: Path, level: int) -> DeflatedFile:
+        if self.cache is None:
+            return deflate_file(path, level)
+        digest = self.digest(path)
+        return self.cache.get(digest, level) or self.cache.put(digest, level, path)
+
+    def add_parents(self, arcname: str) -> None:
+        parent = posixpath.dirname(arcname)
+        while parent and parent not in self.directories:
+            self.directories.add(parent)
+            parent = posixpath.dirname(parent)
+
+    def add_bytes(self, arcname: str, data: bytes) -> None:
+        self.add_parents(arcname)
+        self.members[arcname] = data
+
+    def add_file(self, arcname: str, path: Path) -> str:
+        path = path.resolve()
+        existing = self.by_source.get(path)
+        if existing is not None:
+            self.duplicates += 1
+            return existing
+
+        # Only files of equal size can be identical, so only those get hashed
+        size = path.stat().st_size
+        for other in self.by_size.get(size, []):
+            other_path = cast(Path, self.members[other])
+            if self.digest(other_path) == self.digest(path):
+                self.by_source[path] = other
+                self.duplicates += 1
+                return other
+
+        self.add_parents(arcname)
+        self.members[arcname] = path
+        self.by_source[path] = arcname
+        self.by_size.setdefault(size, []).append(arcname)
+        return arcname
+
+    def write(self, out: Path, compression_level: int = DEFAULT_COMPRESSION_LEVEL, jobs: Optional[int] = None) -> str:
+        """Write the package to out, replacing it only once it is complete.
+        Returns the SHA-256 digest of the package, which only changes when
+        its contents do."""
+        workers = jobs or os.cpu_count() or 1
+        compression = ZIP_DEFLATED if compression_level > 0 else ZIP_STORED
+        tmp = out.with_name(f'{out.name}.{os.getpid()}.tmp')
+
+        names = sorted([f'{d}/' for d in self.directories] + list(self.members))
+        sources = {name: source for (name, source) in self.members.items() if isinstance(source, Path)}
+        if self.cache is not None:
+            # Digests come from the cache index when the sources are unchanged
+            for source in sources.values():
+                self.digest(source)
+
+        try:
+            with ZipFile(tmp, mode='w', compression=compression, compresslevel=compression_level) as zf, \
+                 ThreadPoolExecutor(max_workers=workers) as executor:
+
+                # Keep a bounded window of large files compressing ahead of the writer
+                pending: Dict[str, Future[DeflatedFile]] = {}
+                upcoming = iter([
+                    name for name in names
+                    if compression == ZIP_DEFLATED and name in sources and sources[name].stat().st_size >= PARALLEL_THRESHOLD
+                ])
+
+                def refill() -> None:
+                    while len(pending) < 2 * workers:
+                        name = next(upcoming, None)
+                        if name is None:
+                            return
+                        pending[name] = executor.submit(self.deflate, sources[name], compression_level)
+
+                try:
+                    for name in names:
+                        refill()
+                        if name.endswith('/'):
+                            zf.writestr(member_info(name, DIRECTORY_ATTRIBUTES), b'')
+                        elif name not in sources:
+                            zf.writestr(member_info(name), cast(bytes, self.members[name]), compress_type=compression, compresslevel=compression_level)
+                        elif compression == ZIP_STORED:
+                            zinfo = member_info(name)
+                            zinfo.file_size = sources[name].stat().st_size  # decides whether ZIP64 is needed
+                            with open(sources[name], mode='rb') as src, zf.open(zinfo, mode='w') as dst:
+                                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+                        else:
+                            # Small files are compressed here, so every file gets the same bytes
+                            deflated = pending.pop(name).result() if name in pending else self.deflate(sources[name], compression_level)
+                            with deflated.data:
+                                write_deflated(zf, member_info(name), deflated, compression_level)
+                finally:
+                    for future in pending.values():
+                        future.cancel()
+            os.replace(tmp, out)
+        finally:
+            tmp.unlink(missing_ok=True)
+            if self.cache is not None:
+                self.cache.save()
+
+        return file_digest(out)
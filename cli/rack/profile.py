@@ -0,0 +1,189 @@
+"""Per-step timing profiles of imports.
+
+`--profile FILE` on `rack manifest import`, `rack data import` and `rack model
+import` records the wall time, bytes sent, rows ingested and server warnings
+of every step of the import: OWL uploads, CSV ingestion, nodegroup stores,
+count checks and, for ingestion packages, copygraph steps. Profiles are
+written as JSON, or as CSV when FILE ends in .csv, and two of them can be
+compared with `rack profile compare` to spot steps that got slower between
+data drops."""
+
+from contextlib import contextmanager
+import csv
+import json
+import logging
+from pathlib import Path
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+PROFILE_FIELDS = ['kind', 'target', 'name', 'seconds', 'bytes', 'rows', 'warnings', 'status']
+
+logger = logging.getLogger(__name__)
+
+class ProfileStep:
+    """Measurements of one step of an import. Steps are identified by their
+    kind, the nodegroup, class or graph they target and the file they read."""
+
+    def __init__(self, kind: str, target: str, name: str = '', size: int = 0) -> None:
+        self.kind: str = kind
+        self.target: str = target
+        self.name: str = name
+        self.seconds: float = 0.0
+        self.bytes: int = size
+        self.rows: Optional[int] = None
+        self.warnings: int = 0
+        self.status: str = 'ok'
+
+    def key(self) -> Tuple[str, str, str]:
+        return (self.kind, self.target, self.name)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'kind': self.kind,
+            'target': self.target,
+            'name': self.name,
+            'seconds': round(self.seconds, 3),
+            'bytes': self.bytes,
+            'rows': self.rows,
+            'warnings': self.warnings,
+            'status': self.status,
+        }
+
+    @staticmethod
+    def from_json(obj: Dict[str, Any]) -> 'ProfileStep':
+        """Read a step written by to_json, or a CSV row of the same fields."""
+        step = ProfileStep(obj['kind'], obj['target'], obj.get('name') or '', int(obj.get('bytes') or 0))
+        step.seconds = float(obj['seconds'])
+        rows = obj.get('rows')
+        step.rows = None if rows is None or rows == '' else int(rows)
+        step.warnings = int(obj.get('warnings') or 0)
+        step.status = obj.get('status') or 'ok'
+        return step
+
+class Profile:
+    """The steps of one import command, in the order they started."""
+
+    def __init__(self, command: str) -> None:
+        self.command: str = command
+        self.seconds: float = 0.0
+        self.steps: List[ProfileStep] = []
+        self.lock: threading.Lock = threading.Lock()
+
+    def add(self, step: ProfileStep) -> None:
+        with self.lock:
+            self.steps.append(step)
+
+    def write(self, path: Path) -> None:
+        with open(path, mode='w', encoding='utf-8', newline='') as f:
+            if path.suffix.lower() == '.csv':
+                writer = csv.DictWriter(f, fieldnames=PROFILE_FIELDS)
+                writer.writeheader()
+                for step in self.steps:
+                    writer.writerow(step.to_json())
+            else:
+                json.dump({
+                    'command': self.command,
+                    'seconds': round(self.seconds, 3),
+                    'steps': [step.to_json() for step in self.steps],
+                }, f, indent=2)
+
+    @staticmethod
+    def read(path: Path) -> 'Profile':
+        with open(path, mode='r', encoding='utf-8-sig', newline='') as f:
+            if path.suffix.lower() == '.csv':
+                profile = Profile('')
+                profile.steps = [ProfileStep.from_json(row) for row in csv.DictReader(f)]
+                profile.seconds = sum(step.seconds for step in profile.steps)
+            else:
+                obj = json.load(f)
+                profile = Profile(obj.get('command', ''))
+                profile.steps = [ProfileStep.from_json(step) for step in obj['steps']]
+                profile.seconds = float(obj.get('seconds', 0.0))
+        return profile
+
+# The profile of the command that is running, if it was asked for
+_active: Optional[Profile] = None
+
+@contextmanager
+def profiling(path: Optional[Path], command: str) -> Iterator[None]:
+    """Record the steps of a command and write them to path, even when the
+    command fails part way. Does nothing when path is None."""
+    global _active
+    if path is None:
+        yield
+        return
+
+    profile = Profile(command)
+    _active = profile
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _active = None
+        profile.seconds = time.perf_counter() - start
+        profile.write(path)
+        logger.info('Wrote profile of %d steps to %s', len(profile.steps), path)
+
+def add_step(step: ProfileStep) -> None:
+    """Add a step measured elsewhere to the active profile."""
+    profile = _active
+    if profile is not None:
+        profile.add(step)
+
+@contextmanager
+def profile_step(kind: str, target: str, name: str = '', size: int = 0) -> Iterator[ProfileStep]:
+    """Time the body as one step of the active profile. The body can fill in
+    the bytes, rows and warnings it knows about."""
+    step = ProfileStep(kind, target, name, size)
+    add_step(step)
+    start = time.perf_counter()
+    try:
+        yield step
+    except BaseException:
+        step.status = 'failed'
+        raise
+    finally:
+        step.seconds = time.perf_counter() - start
+
+class StepComparison:
+    """A step of two profiles side by side. Either side is None when the step
+    only appears in one of them."""
+
+    def __init__(self, key: Tuple[str, str, str], old: Optional[ProfileStep], new: Optional[ProfileStep]) -> None:
+        self.key: Tuple[str, str, str] = key
+        self.old: Optional[ProfileStep] = old
+        self.new: Optional[ProfileStep] = new
+
+    def change(self) -> Optional[float]:
+        """Relative change in wall time, e.g. 0.25 for 25% slower."""
+        if self.old is None or self.new is None or self.old.seconds <= 0:
+            return None
+        return self.new.seconds / self.old.seconds - 1
+
+    def regressed(self, threshold: float, min_seconds: float) -> bool:
+        if self.old is None or self.new is None or self.new.seconds - self.old.seconds < min_seconds:
+            return False
+        change = self.change()
+        return change is None or change > threshold
+
+def compare_profiles(old: Profile, new: Profile) -> List[StepComparison]:
+    """Pair up the steps of two profiles. Repeated steps are paired in order."""
+    def keyed(profile: Profile) -> Dict[Tuple[str, str, str], List[ProfileStep]]:
+        steps: Dict[Tuple[str, str, str], List[ProfileStep]] = {}
+        for step in profile.steps:
+            steps.setdefault(step.key(), []).append(step)
+        return steps
+
+    old_steps = keyed(old)
+    new_steps = keyed(new)
+    comparisons = []
+    for key in list(new_steps) + [key for key in old_steps if key not in new_steps]:
+        olds = old_steps.get(key, [])
+        news = new_steps.get(key, [])
+        for i in range(max(len(olds), len(news))):
+            comparisons.append(StepComparison(
+                key,
+                olds[i] if i < len(olds) else None,
+                news[i] if i < len(news) else None))
+    return comparisons
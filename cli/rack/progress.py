@@ -0,0 +1,220 @@
+"""Progress and throughput reporting for `rack manifest import`.
+
+The size of every step of an ingestion package is known before anything is
+sent to RACK: the bytes of the package members it reads and the rows of its
+CSV files. While SemTK loads the package it streams INFO lines, and a step is
+taken to have started when one of those lines names one of its files (or,
+for a copygraph step, both of its graphs). The steps before it are then
+complete, which gives the throughput and an estimate of the time remaining.
+
+Machine-readable events are written as JSON lines, one object per event:
+
+    {"event": "start", "steps": 12, "bytes": 104857600, "rows": 250000, ...}
+    {"event": "step", "step": 3, "key": "data:data/data.yaml", ...}
+    {"event": "heartbeat", "idle": 30.0, ...}
+    {"event": "finish", "status": "ok", ...}
+
+Heartbeats are written while waiting for RACK, so a consumer can tell a slow
+step from a stalled one."""
+
+import json
+from pathlib import Path
+import posixpath
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, TextIO
+
+from rack.ledger import PackageHasher, PackagePlan
+from rack.manifest import StepType
+from rack.profile import ProfileStep
+
+# Seconds between heartbeat events while no step completes
+HEARTBEAT_INTERVAL: float = 10.0
+
+class ProgressStep:
+    """A step that will be loaded, with the names that identify it in the
+    streamed output and its size."""
+
+    def __init__(self, key: str, names: List[str], size: int, rows: int, require_all: bool = False) -> None:
+        self.key: str = key
+        self.size: int = size
+        self.rows: int = rows
+        self.patterns: List['re.Pattern[str]'] = [re.compile(r'(?<![\w.-])' + re.escape(name) + r'(?![\w.-])') for name in names]
+        self.require_all: bool = require_all
+
+    def matches(self, msg: str) -> bool:
+        found = (pattern.search(msg) is not None for pattern in self.patterns)
+        return all(found) if self.require_all else any(found)
+
+def plan_progress_steps(hasher: PackageHasher, plan: PackagePlan) -> List[ProgressStep]:
+    """List the steps of a package that will be loaded, in load order."""
+    steps = []
+    for step in plan.steps:
+        if step.nested is not None:
+            steps.extend(plan_progress_steps(hasher, step.nested))
+        elif step.changed:
+            if step.step_type == StepType.COPYGRAPH:
+                progress_step = ProgressStep(step.key, list(step.arg), 0, 0, require_all=True)
+            else:
+                size = sum(hasher.zipfile.getinfo(member).file_size for member in step.members)
+                rows = 0
+                if step.step_type == StepType.DATA:
+                    rows = sum(max(hasher.line_count(member) - 1, 0) for member in step.members if member.lower().endswith('.csv'))
+                progress_step = ProgressStep(step.key, [posixpath.basename(member) for member in step.members], size, rows)
+            steps.append(progress_step)
+    return steps
+
+def format_bytes(size: float) -> str:
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024
+    return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    (minutes, seconds) = divmod(seconds, 60)
+    (hours, minutes) = divmod(minutes, 60)
+    return f'{hours}:{minutes:02}:{seconds:02}' if hours else f'{minutes}:{seconds:02}'
+
+class IngestionProgress:
+    """Track the steps of an ingestion package load from its streamed output."""
+
+    def __init__(self, steps: List[ProgressStep], events_path: Optional[Path] = None, heartbeat: float = HEARTBEAT_INTERVAL) -> None:
+        self.steps: List[ProgressStep] = steps
+        self.events_path: Optional[Path] = events_path
+        self.heartbeat: float = heartbeat
+        self.total_bytes: int = sum(step.size for step in steps)
+        self.total_rows: int = sum(step.rows for step in steps)
+        self.current: int = -1
+        self.started_at: List[Optional[float]] = [None] * len(steps)
+        self.step_warnings: List[int] = [0] * len(steps)
+        self.finished: Optional[float] = None
+        self.status: str = 'ok'
+        self.completed: int = 0
+        self.warnings: int = 0
+        self.errors: int = 0
+        self.started: float = time.monotonic()
+        self.last_change: float = self.started
+        self.lock: threading.Lock = threading.Lock()
+        self.stopped: threading.Event = threading.Event()
+        self.events: Optional[TextIO] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.started = self.last_change = time.monotonic()
+        if self.events_path is not None:
+            self.events = open(self.events_path, mode='w', encoding='utf-8', buffering=1)
+        self.emit('start', **self.snapshot())
+        if self.events is not None and self.heartbeat > 0:
+            self.thread = threading.Thread(target=self.beat, name='rack-progress', daemon=True)
+            self.thread.start()
+
+    def beat(self) -> None:
+        while not self.stopped.wait(self.heartbeat):
+            with self.lock:
+                self.emit('heartbeat', idle=round(time.monotonic() - self.last_change, 3), **self.snapshot())
+
+    def emit(self, event: str, **fields: Any) -> None:
+        if self.events is not None:
+            self.events.write(json.dumps({'event': event, **fields}) + '\n')
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        done_bytes = sum(step.size for step in self.steps[:self.completed])
+        done_rows = sum(step.rows for step in self.steps[:self.completed])
+        bytes_per_second = done_bytes / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if bytes_per_second > 0:
+            eta = round((self.total_bytes - done_bytes) / bytes_per_second, 3)
+        return {
+            'completed': self.completed,
+            'steps': len(self.steps),
+            'bytes_done': done_bytes,
+            'bytes': self.total_bytes,
+            'rows_done': done_rows,
+            'rows': self.total_rows,
+            'elapsed': round(elapsed, 3),
+            'bytes_per_second': round(bytes_per_second, 1),
+            'rows_per_second': round(done_rows / elapsed if elapsed > 0 else 0.0, 1),
+            'eta': eta,
+            'warnings': self.warnings,
+            'errors': self.errors,
+        }
+
+    def observe(self, level: str, msg: str) -> Optional[str]:
+        """Account for one streamed line. Returns a progress report when a new step started."""
+        with self.lock:
+            if level == 'WARNING':
+                self.warnings += 1
+                if self.current >= 0:
+                    self.step_warnings[self.current] += 1
+            elif level == 'ERROR':
+                self.errors += 1
+            if level != 'INFO':
+                return None
+
+            # Steps load in order, so only look at the current one and those after it
+            index = next((i for i in range(max(self.current, 0), len(self.steps)) if self.steps[i].matches(msg)), None)
+            if index is None or index == self.current:
+                return None
+
+            self.current = index
+            self.completed = index
+            self.last_change = self.started_at[index] = time.monotonic()
+            snapshot = self.snapshot()
+            self.emit('step', step=index + 1, key=self.steps[index].key, **snapshot)
+            return self.report(snapshot)
+
+    def finish(self, status: str) -> None:
+        """Stop reporting. A load that succeeded has completed every step."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            self.finished = time.monotonic()
+            self.status = status
+            if status == 'ok':
+                self.completed = len(self.steps)
+            self.emit('finish', status=status, **self.snapshot())
+            if self.events is not None:
+                self.events.close()
+                self.events = None
+
+    def profile_steps(self) -> List[ProfileStep]:
+        """Per-step measurements once the load has finished. A step runs until
+        the next one starts; steps never named in the output are not timed."""
+        finished = self.finished or time.monotonic()
+        profile_steps = []
+        for (i, step) in enumerate(self.steps):
+            (kind, _, target) = step.key.partition(':')
+            profiled = ProfileStep(kind, target, size=step.size)
+            started = self.started_at[i]
+            if started is None:
+                profiled.status = 'untimed'
+            else:
+                ended = next((t for t in self.started_at[i + 1:] if t is not None), finished)
+                profiled.seconds = ended - started
+                profiled.warnings = self.step_warnings[i]
+                if self.status != 'ok' and i == self.current:
+                    profiled.status = self.status
+            if kind == StepType.DATA.name.lower():
+                profiled.rows = step.rows
+            profile_steps.append(profiled)
+        return profile_steps
+
+    @staticmethod
+    def report(snapshot: Dict[str, Any]) -> str:
+        line = (f"Progress: {snapshot['completed']}/{snapshot['steps']} steps, "
+                f"{format_bytes(snapshot['bytes_done'])} of {format_bytes(snapshot['bytes'])}, "
+                f"{format_bytes(snapshot['bytes_per_second'])}/s, {snapshot['rows_per_second']:,.0f} rows/s")
+        if snapshot['eta'] is not None:
+            line += f", ETA {format_duration(snapshot['eta'])}"
+        return line
+
+    def summary(self) -> str:
+        snapshot = self.snapshot()
+        return (f"Loaded {snapshot['steps']} steps, {format_bytes(snapshot['bytes'])} and {snapshot['rows']:,} rows "
+                f"in {format_duration(snapshot['elapsed'])} "
+                f"({format_bytes(snapshot['bytes_per_second'])}/s, {snapshot['rows_per_second']:,.0f} rows/s)")
@@ -0,0 +1,240 @@
+"""Long-lived `rack serve` daemon that runs CLI commands sent over a Unix socket.
+
+The daemon keeps the imported modules, compiled schemas and HTTP connection
+pools of one Python process warm across commands. Commands run one at a time
+in the daemon process itself, with the working directory, standard streams
+and rack environment variables of the client. Output is streamed back as
+JSON lines:
+
+    {"stream": "stdout", "data": "..."}
+    {"stream": "stderr", "data": "..."}
+    {"exit": 0}
+
+A command reading its standard input (such as a confirmation prompt) sends
+{"stdin": "readline"} and waits for the client to answer with the next line
+of its own standard input, {"stdin": "..."}, empty at the end of input.
+
+Process-wide state that commands change (log levels, the connection of
+semtk3, the requests module semtk3 uses) is restored after every command,
+so that one command does not leak settings into the next.
+
+The client side lives in bin/rack so that it runs before any of the heavy
+imports when RACK_SERVER is set."""
+
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import sys
+import threading
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, TextIO, Tuple, cast
+
+from rack.session import uninstall_session
+
+DEFAULT_SOCKET_PATH: Path = Path.home() / '.rack' / 'rack.sock'
+
+logger = logging.getLogger(__name__)
+
+class StreamForwarder(io.TextIOBase):
+    """Text stream that forwards writes to the client as JSON lines."""
+
+    def __init__(self, conn: socket.socket, name: str, lock: threading.Lock) -> None:
+        super().__init__()
+        self.conn: socket.socket = conn
+        self.name: str = name
+        self.lock: threading.Lock = lock
+        self.disconnected: bool = False
+
+    def send(self, message: Dict[str, Any]) -> None:
+        with self.lock:
+            if self.disconnected:
+                return
+            try:
+                self.conn.sendall(json.dumps(message).encode() + b'\n')
+            except OSError:
+                # The client went away; let the command finish quietly
+                self.disconnected = True
+
+    def write(self, s: str) -> int:
+        if s:
+            self.send({'stream': self.name, 'data': s})
+        return len(s)
+
+    def writable(self) -> bool:
+        return True
+
+    def isatty(self) -> bool:
+        return False
+
+class StdinForwarder:
+    """Text stream that reads lines from the client's standard input. It
+    offers what input() and line-by-line reads use of a text stream."""
+
+    def __init__(self, reader: BinaryIO, stdout: StreamForwarder) -> None:
+        self.reader: BinaryIO = reader
+        self.stdout: StreamForwarder = stdout
+        self.eof: bool = False
+
+    def readline(self) -> str:
+        if self.eof or self.stdout.disconnected:
+            return ''
+        self.stdout.send({'stdin': 'readline'})
+        line = self.reader.readline()
+        data = str(json.loads(line).get('stdin', '')) if line else ''
+        if not data:
+            self.eof = True
+        return data
+
+    def read(self, size: Optional[int] = -1) -> str:
+        lines = []
+        length = 0
+        while size is None or size < 0 or length < size:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+            length += len(line)
+        return ''.join(lines)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.readline, '')
+
+    def readable(self) -> bool:
+        return True
+
+    def isatty(self) -> bool:
+        return False
+
+def save_globals() -> Callable[[], None]:
+    """Record the process-wide state that commands change, and return a
+    function putting it back."""
+    root_level = logging.getLogger().level
+    levels = {name: log.level for (name, log) in logging.Logger.manager.loggerDict.items() if isinstance(log, logging.Logger)}
+    semtk3 = sys.modules.get('semtk3')
+    conn_override = getattr(semtk3, 'SEMTK3_CONN_OVERRIDE', None)
+    rack = sys.modules.get('rack')
+    cli_method = getattr(rack, 'cliMethod', None)
+
+    def restore() -> None:
+        logging.getLogger().setLevel(root_level)
+        for (name, log) in list(logging.Logger.manager.loggerDict.items()):
+            if isinstance(log, logging.Logger):
+                log.setLevel(levels.get(name, logging.NOTSET))
+        semtk3 = sys.modules.get('semtk3')
+        if semtk3 is not None:
+            setattr(semtk3, 'SEMTK3_CONN_OVERRIDE', conn_override)
+        rack = sys.modules.get('rack')
+        if rack is not None and cli_method is not None:
+            setattr(rack, 'cliMethod', cli_method)
+        uninstall_session()
+
+    return restore
+
+def exit_code(exc: SystemExit) -> Tuple[int, Optional[str]]:
+    """Translate SystemExit into a process exit code and message, as the interpreter does."""
+    if exc.code is None:
+        return (0, None)
+    if isinstance(exc.code, int):
+        return (exc.code, None)
+    return (1, str(exc.code))
+
+def swap_log_streams(old: Any, new: Any) -> List[logging.StreamHandler]:
+    """Point every logging handler writing to old at new instead."""
+    loggers = [logging.getLogger()] + [l for l in logging.Logger.manager.loggerDict.values() if isinstance(l, logging.Logger)]
+    swapped = []
+    for log in loggers:
+        for handler in log.handlers:
+            if isinstance(handler, logging.StreamHandler) and handler.stream is old:
+                handler.setStream(new)
+                swapped.append(handler)
+    return swapped
+
+def handle_request(conn: socket.socket, run: Callable[[List[str]], None]) -> None:
+    """Run one forwarded command with the client's working directory,
+    settings and standard streams. The request carries the environment
+    variables rack reads, with null for those the client has not set."""
+    with conn, conn.makefile('rb') as reader:
+        line = reader.readline()
+        if not line:
+            return
+        request = json.loads(line)
+
+        lock = threading.Lock()
+        stdout = StreamForwarder(conn, 'stdout', lock)
+        stderr = StreamForwarder(conn, 'stderr', lock)
+        stdin = StdinForwarder(cast(BinaryIO, reader), stdout)
+
+        restore_globals = save_globals()
+        saved_cwd = os.getcwd()
+        saved_environ = dict(os.environ)
+        saved_stdin, saved_stdout, saved_stderr = sys.stdin, sys.stdout, sys.stderr
+        swapped = swap_log_streams(saved_stderr, stderr)
+        code = 0
+        try:
+            os.chdir(request['cwd'])
+            for (name, value) in request['env'].items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            sys.stdin, sys.stdout, sys.stderr = cast(TextIO, stdin), cast(TextIO, stdout), cast(TextIO, stderr)
+            run(request['argv'])
+        except SystemExit as exc:
+            (code, message) = exit_code(exc)
+            if message:
+                stderr.write(message + '\n')
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Command failed: %s', ' '.join(request['argv']))
+            code = 1
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = saved_stdin, saved_stdout, saved_stderr
+            for handler in swapped:
+                handler.setStream(saved_stderr)
+            os.environ.clear()
+            os.environ.update(saved_environ)
+            os.chdir(saved_cwd)
+            restore_globals()
+        stdout.send({'exit': code})
+
+def serve(socket_path: Path, run: Callable[[List[str]], None]) -> None:
+    """Accept commands on a Unix socket until interrupted."""
+    if not hasattr(socket, 'AF_UNIX'):
+        logger.error('rack serve requires Unix domain socket support')
+        sys.exit(1)
+
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(socket_path))
+        logger.error('Another rack server is already listening on %s', socket_path)
+        sys.exit(1)
+    except OSError:
+        # Nothing is listening, so any socket file left behind is stale
+        socket_path.unlink(missing_ok=True)
+    finally:
+        probe.close()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        # Create the socket without permissions for anyone else, so that no
+        # other user can connect between bind and chmod
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(str(socket_path))
+        finally:
+            os.umask(old_umask)
+        os.chmod(socket_path, 0o600)
+        server.listen()
+        print(f'Listening on {socket_path} (set RACK_SERVER={socket_path} to use it)', flush=True)
+        try:
+            while True:
+                (conn, _) = server.accept()
+                try:
+                    handle_request(conn, run)
+                except (OSError, ValueError, KeyError) as exc:
+                    logger.warning('Dropped malformed or broken request: %s', exc)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            socket_path.unlink(missing_ok=True)
@@ -0,0 +1,137 @@
+"""Shared keep-alive HTTP session for the SemTK services and triple store.
+
+semtk3 sends each request through the module-level functions of requests,
+which opens a fresh connection every time. Installing the session routes
+those calls through one pooled requests.Session instead, so a command only
+pays connection setup once per service."""
+
+import sys
+import threading
+from typing import TYPE_CHECKING, Any, Optional, Tuple
+
+from rack.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import requests
+else:
+    requests = lazy_import('requests')
+
+DEFAULT_RETRIES: int = 3
+DEFAULT_BACKOFF: float = 0.5
+DEFAULT_CONNECT_TIMEOUT: float = 10.0
+
+# Enough pools for every SemTK service port plus the triple store
+POOL_CONNECTIONS: int = 32
+POOL_MAXSIZE: int = 16
+
+class SessionConfig:
+    """Retry, backoff and timeout settings of the shared session"""
+
+    def __init__(self, retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF, read_timeout: Optional[float] = None) -> None:
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.read_timeout: Optional[float] = read_timeout
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, SessionConfig) and vars(self) == vars(other)
+
+    def timeout(self) -> Tuple[float, Optional[float]]:
+        return (DEFAULT_CONNECT_TIMEOUT, self.read_timeout)
+
+def build_session(config: SessionConfig) -> 'requests.Session':
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # POST is not in Retry's default allowed methods, so ingestion requests
+    # are only retried when the connection could not be established at all.
+    retry = Retry(
+        total=config.retries,
+        connect=config.retries,
+        read=config.retries,
+        status=config.retries,
+        backoff_factor=config.backoff,
+        status_forcelist=[502, 503, 504],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class PooledRequests:
+    """Stand-in for the requests module whose request functions go through a
+    shared session. Everything else (exceptions, models) is requests' own."""
+
+    def __init__(self, session: 'requests.Session', config: SessionConfig) -> None:
+        self.session: 'requests.Session' = session
+        self.config: SessionConfig = config
+
+    def request(self, method: str, url: str, **kwargs: Any) -> 'requests.Response':
+        kwargs.setdefault('timeout', self.config.timeout())
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs: Any) -> 'requests.Response':
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, data: Any = None, json: Any = None, **kwargs: Any) -> 'requests.Response':
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+    def put(self, url: str, data: Any = None, **kwargs: Any) -> 'requests.Response':
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def delete(self, url: str, **kwargs: Any) -> 'requests.Response':
+        return self.request('DELETE', url, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(requests, name)
+
+_lock = threading.Lock()
+_config = SessionConfig()
+_pooled: Optional[PooledRequests] = None
+
+def configure_session(config: SessionConfig) -> None:
+    """Set the retry and timeout settings. Open connections are kept unless
+    the settings change."""
+    global _config, _pooled
+    with _lock:
+        if config == _config:
+            return
+        _config = config
+        if _pooled is not None:
+            _pooled.session.close()
+            _pooled = None
+
+def get_session() -> PooledRequests:
+    """Return the shared session, creating it on first use, and make sure the
+    loaded semtk3 modules send their requests through it."""
+    global _pooled
+    with _lock:
+        if _pooled is None:
+            _pooled = PooledRequests(build_session(_config), _config)
+        for name, module in list(sys.modules.items()):
+            if (name == 'semtk3' or name.startswith('semtk3.')) and getattr(module, 'requests', None) is requests:
+                setattr(module, 'requests', _pooled)
+        return _pooled
+
+def restore_semtk3_requests() -> None:
+    for name, module in list(sys.modules.items()):
+        if (name == 'semtk3' or name.startswith('semtk3.')) and isinstance(getattr(module, 'requests', None), PooledRequests):
+            setattr(module, 'requests', requests)
+
+def uninstall_session() -> None:
+    """Give semtk3 back the requests module, keeping the pooled connections
+    open for the next get_session, e.g. between the commands of a server."""
+    with _lock:
+        restore_semtk3_requests()
+
+def close_session() -> None:
+    """Close the pooled connections, e.g. at the end of a command."""
+    global _pooled
+    with _lock:
+        if _pooled is None:
+            return
+        _pooled.session.close()
+        _pooled = None
+        restore_semtk3_requests()
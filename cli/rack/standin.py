@@ -0,0 +1,416 @@
+"""In-process stand-in for the SemTK services used by rack.
+
+Tests and benchmarks need a RACK to talk to, and RACK-in-a-box needs Docker.
+StandIn replaces the semtk3 functions that reach SemTK with ones that keep
+their data in memory, for as long as it is installed:
+
+    with StandIn(latency={'ingest': 0.05}, row_latency=0.0001).installed() as standin:
+        ingest_data_driver(...)
+        assert standin.calls['ingest'] == 3
+
+The stand-in works at the level of rows rather than triples. Ingesting a CSV
+by nodegroup or by class stores its rows in the data graph of the connection
+under that nodegroup or class, and selecting or counting by the same ID reads
+them back. Runtime constraints are not applied. OWL uploads record the file
+name in their graph, and the nodegroup store keeps every item. Ingestion
+packages are loaded step by step in the same way, with the members each YAML
+file names resolved relative to its directory in the zip.
+
+Every request is held for a fixed time per operation plus a time per row, and
+slots bounds how many requests are served at once, so throughput can be
+measured deterministically. Functions of semtk3 that do not reach SemTK, such
+as build_connection_str, are left alone.
+
+isolated_state keeps the ledger, query cache and nodegroup index of rack in a
+scratch directory, so that tests and benchmarks leave ~/.rack alone."""
+
+from collections import Counter
+from contextlib import contextmanager
+import csv
+from datetime import datetime
+import json
+import os
+from io import StringIO
+from pathlib import Path
+import posixpath
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+from zipfile import ZipFile
+
+from rack.cache import CachedTable
+from rack.lazy import lazy_import
+from rack.manifest import find_toplevel_manifest
+from rack.nodegroups import DEFAULT_ITEM_TYPE, STORE_DATA_FIELDS
+
+if TYPE_CHECKING:
+    import semtk3
+    import yaml
+else:
+    semtk3 = lazy_import('semtk3')
+    yaml = lazy_import('yaml')
+
+# Operations whose latency can be set, and the semtk3 functions that perform them
+OPERATIONS = {
+    'ingest': ['ingest_by_id', 'ingest_using_class_template'],
+    'owl': ['upload_owl'],
+    'select': ['select_by_id'],
+    'count': ['count_by_id'],
+    'store': ['store_item', 'get_store_table', 'retrieve_items_from_store',
+              'delete_item_from_store', 'delete_store_item', 'delete_nodegroup_from_store'],
+    'graph': ['clear_graph', 'copy_graph', 'get_graph_info'],
+    'package': ['load_ingestion_package'],
+    'service': ['set_host', 'check_services'],
+}
+
+STORE_TABLE_COLUMNS = ['ID', 'comments', 'creator', 'creationDate', 'itemType']
+
+# Environment variables locating the local state of rack, and their file names
+STATE_VARIABLES = {
+    'RACK_LEDGER': 'ledger.json',
+    'RACK_QUERY_CACHE': 'query-cache',
+    'RACK_NODEGROUP_INDEX': 'nodegroup-index.json',
+}
+
+@contextmanager
+def isolated_state(directory: Path) -> Iterator[None]:
+    """Keep the local state of rack in directory for the duration of the block."""
+    saved = {name: os.environ.get(name) for name in STATE_VARIABLES}
+    for (name, file_name) in STATE_VARIABLES.items():
+        os.environ[name] = str(directory / file_name)
+    try:
+        yield
+    finally:
+        for (name, value) in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+class Table(CachedTable):
+    """Results in the shape of a SemtkTable."""
+
+    def get_num_rows(self) -> int:
+        return len(self.rows)
+
+    def get_column_index(self, name: str) -> int:
+        return self.column_names.index(name)
+
+    def get_column(self, column: Any) -> List[Any]:
+        i = column if isinstance(column, int) else self.get_column_index(column)
+        return [row[i] for row in self.rows]
+
+class PackageResponse:
+    """The streamed log of an ingestion package load, one line per step."""
+
+    def __init__(self, lines: List[str]) -> None:
+        self.lines: List[str] = lines
+
+    def iter_lines(self) -> Iterator[bytes]:
+        for line in self.lines:
+            yield line.encode('utf-8')
+
+class Graph:
+    """The rows ingested into a graph, by nodegroup or class, and its OWL files."""
+
+    def __init__(self) -> None:
+        self.rows: Dict[str, List[Dict[str, str]]] = {}
+        self.owl: List[str] = []
+
+    def size(self) -> int:
+        return sum(len(rows) for rows in self.rows.values()) + len(self.owl)
+
+class StandIn:
+    """An in-memory SemTK. latency maps operations (the keys of OPERATIONS)
+    to seconds per request, and row_latency adds seconds per row sent or
+    returned. slots bounds the requests served concurrently."""
+
+    def __init__(self, latency: Optional[Dict[str, float]] = None, row_latency: float = 0.0, slots: Optional[int] = None) -> None:
+        unknown = set(latency or {}) - set(OPERATIONS)
+        if unknown:
+            raise ValueError(f'Unknown operations: {", ".join(sorted(unknown))}')
+        self.latency: Dict[str, float] = dict(latency or {})
+        self.row_latency: float = row_latency
+        self.slots: Optional[threading.BoundedSemaphore] = threading.BoundedSemaphore(slots) if slots else None
+        self.graphs: Dict[str, Graph] = {}
+        self.store: Dict[str, Dict[str, str]] = {}
+        self.calls: 'Counter[str]' = Counter()
+        self.in_flight: int = 0
+        self.peak: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    @contextmanager
+    def serving(self, operation: str, rows: int = 0) -> Iterator[None]:
+        """Hold a request for its simulated service time."""
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            with self.lock:
+                self.calls[operation] += 1
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+            delay = self.latency.get(operation, 0.0) + self.row_latency * rows
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                yield
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+    @contextmanager
+    def installed(self) -> Iterator['StandIn']:
+        """Route the semtk3 functions that reach SemTK to this stand-in."""
+        names = [name for names in OPERATIONS.values() for name in names]
+        # Reading an attribute first makes a lazily imported semtk3 load
+        saved_override = getattr(semtk3, 'SEMTK3_CONN_OVERRIDE', None)
+        saved = {name: vars(semtk3)[name] for name in names if name in vars(semtk3)}
+        for name in names:
+            setattr(semtk3, name, getattr(self, name))
+        try:
+            yield self
+        finally:
+            for name in names:
+                if name in saved:
+                    setattr(semtk3, name, saved[name])
+                else:
+                    delattr(semtk3, name)
+            semtk3.SEMTK3_CONN_OVERRIDE = saved_override
+
+    def graph(self, uri: str) -> Graph:
+        with self.lock:
+            return self.graphs.setdefault(uri, Graph())
+
+    @staticmethod
+    def connection_graph(conn: Optional[str], which: str = 'data', index: int = 0) -> str:
+        obj = json.loads(conn or semtk3.SEMTK3_CONN_OVERRIDE)
+        return str(obj[which][index]['graph'])
+
+    def rows_of(self, item_id: str) -> List[Dict[str, str]]:
+        """The rows ingested under an ID into the data graphs of the current
+        connection. Without one, nodegroups query every graph."""
+        if semtk3.SEMTK3_CONN_OVERRIDE is None:
+            with self.lock:
+                uris = sorted(self.graphs)
+        else:
+            uris = [entry['graph'] for entry in json.loads(semtk3.SEMTK3_CONN_OVERRIDE).get('data', [])]
+        rows: List[Dict[str, str]] = []
+        for uri in uris:
+            rows.extend(self.graph(uri).rows.get(item_id, []))
+        return rows
+
+    # The methods below keep the signatures of the semtk3 functions they
+    # replace, including the arguments a stand-in has no use for
+    # pylint: disable=unused-argument
+
+    # Services
+
+    def set_host(self, host: str) -> None:
+        with self.serving('service'):
+            pass
+
+    def check_services(self) -> bool:
+        with self.serving('service'):
+            return True
+
+    # Ingestion
+
+    def ingest(self, item_id: str, csv_str: str, conn: Optional[str]) -> Tuple[str, str]:
+        rows = list(csv.DictReader(StringIO(csv_str)))
+        with self.serving('ingest', len(rows)):
+            graph = self.graph(self.connection_graph(conn))
+            with self.lock:
+                graph.rows.setdefault(item_id, []).extend(rows)
+        return (f'{len(rows)}\tFailures: 0', '')
+
+    def ingest_by_id(self, nodegroup_id: str, csv_str: str, conn: Optional[str] = None) -> Tuple[str, str]:
+        return self.ingest(nodegroup_id, csv_str, conn)
+
+    def ingest_using_class_template(self, class_uri: str, csv_str: str, conn: Optional[str] = None) -> Tuple[str, str]:
+        return self.ingest(class_uri, csv_str, conn)
+
+    def upload_owl(self, owl_file_path: Any, conn: str, user_name: str, password: str, model_or_data: str = 'model', conn_index: int = 0) -> None:
+        with self.serving('owl'):
+            name = Path(owl_file_path).name
+            if not Path(owl_file_path).exists():
+                raise FileNotFoundError(str(owl_file_path))
+            graph = self.graph(self.connection_graph(conn, model_or_data, conn_index))
+            with self.lock:
+                graph.owl.append(name)
+
+    # Queries
+
+    def select_by_id(self, nodegroup_id: str, limit_override: int = 0, offset_override: int = 0, runtime_constraints: Any = None, **kwargs: Any) -> Table:
+        rows = self.rows_of(nodegroup_id)
+        columns = list(rows[0]) if rows else []
+        rows = rows[offset_override:]
+        if limit_override > 0:
+            rows = rows[:limit_override]
+        with self.serving('select', len(rows)):
+            return Table(columns, [[row.get(column, '') for column in columns] for row in rows])
+
+    def count_by_id(self, nodegroup_id: str, runtime_constraints: Any = None, **kwargs: Any) -> Table:
+        with self.serving('count'):
+            return Table(['count'], [[len(self.rows_of(nodegroup_id))]])
+
+    # Nodegroup store
+
+    def store_item(self, item_id: str, comments: str, creator: str, json_str: str, item_type: str) -> None:
+        with self.serving('store'):
+            with self.lock:
+                if item_id in self.store:
+                    raise Exception(f'Item already exists in the store: {item_id}')
+                self.store[item_id] = {
+                    'comments': comments,
+                    'creator': creator,
+                    'creationDate': datetime.now().isoformat(),
+                    'itemType': item_type,
+                    'json': json_str,
+                }
+
+    def get_store_table(self, *args: Any) -> Table:
+        with self.serving('store'), self.lock:
+            return Table(list(STORE_TABLE_COLUMNS), [
+                [item_id] + [item[column] for column in STORE_TABLE_COLUMNS[1:]] for (item_id, item) in sorted(self.store.items())
+            ])
+
+    def retrieve_items_from_store(self, regex: str, folder: str, item_type: str) -> None:
+        with self.serving('store'), self.lock:
+            pattern = re.compile(regex)
+            all_types = getattr(semtk3, 'STORE_ITEM_TYPE_ALL', 'All')
+            found = [(item_id, item) for (item_id, item) in sorted(self.store.items())
+                     if pattern.search(item_id) and (item_type == all_types or item['itemType'] == item_type)]
+            with open(os.path.join(folder, 'store_data.csv'), mode='w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(STORE_DATA_FIELDS)
+                for (item_id, item) in found:
+                    with open(os.path.join(folder, f'{item_id}.json'), mode='w', encoding='utf-8') as g:
+                        g.write(item['json'])
+                    writer.writerow([item_id, item['comments'], item['creator'], f'{item_id}.json', item['itemType']])
+
+    def delete_item_from_store(self, item_id: str, item_type: str) -> None:
+        with self.serving('store'), self.lock:
+            item = self.store.get(item_id)
+            if item is None or item['itemType'] != item_type:
+                raise Exception(f'Item does not exist in the store: {item_id}')
+            del self.store[item_id]
+
+    def delete_store_item(self, item_id: str, item_type: str) -> None:
+        self.delete_item_from_store(item_id, item_type)
+
+    def delete_nodegroup_from_store(self, item_id: str) -> None:
+        self.delete_item_from_store(item_id, getattr(semtk3, 'STORE_ITEM_TYPE_NODEGROUP', 'PrefabNodeGroup'))
+
+    # Graphs
+
+    def clear_graph(self, conn: str, which: str = 'data', index: int = 0) -> None:
+        with self.serving('graph'):
+            uri = self.connection_graph(conn, which, index)
+            with self.lock:
+                self.graphs.pop(uri, None)
+
+    def copy_graph(self, from_graph: str, to_graph: str, *args: Any) -> Dict[str, str]:
+        source = self.graph(from_graph)
+        with self.serving('graph', source.size()):
+            target = self.graph(to_graph)
+            with self.lock:
+                for (item_id, rows) in source.rows.items():
+                    target.rows.setdefault(item_id, []).extend(rows)
+                target.owl.extend(source.owl)
+        return {'message': f'Copied {from_graph} to {to_graph}'}
+
+    def get_graph_info(self, conn: str, exclude_internal: bool = True, skip_counts: bool = False) -> Table:
+        with self.serving('graph'), self.lock:
+            return Table(['graph', 'count'], [[uri, graph.size()] for (uri, graph) in sorted(self.graphs.items())])
+
+    # Ingestion packages
+
+    def load_ingestion_package(self, triple_store: str, triple_store_type: str, package_path: Any, clear: bool, default_model_graph: str, default_data_graph: str) -> PackageResponse:
+        lines: List[str] = []
+        with self.serving('package'), ZipFile(package_path) as package:
+            names = set(package.namelist())
+
+            def read(base: str, name: str) -> bytes:
+                member = posixpath.normpath(posixpath.join(base, name))
+                if member not in names:
+                    raise FileNotFoundError(f'{name} (from {base or "the package root"})')
+                return package.read(member)
+
+            def graphs_of(value: Any, default: str) -> List[str]:
+                if value is None:
+                    return [default]
+                return [value] if isinstance(value, str) else list(value)
+
+            def load_model(member: str) -> None:
+                obj = yaml.safe_load(read('', member))
+                base = posixpath.dirname(member)
+                graph = self.graph(graphs_of(obj.get('model-graphs'), default_model_graph)[0])
+                for name in obj['files']:
+                    read(base, name)
+                    lines.append(f'INFO: Loading {posixpath.basename(name)}')
+                    with self.lock:
+                        graph.owl.append(posixpath.basename(name))
+
+            def load_data(member: str) -> None:
+                obj = yaml.safe_load(read('', member))
+                base = posixpath.dirname(member)
+                graph = self.graph(obj.get('data-graph', default_data_graph))
+                for step in obj['ingestion-steps']:
+                    if 'csv' in step:
+                        rows = list(csv.DictReader(StringIO(read(base, step['csv']).decode('utf-8-sig'))))
+                        lines.append(f'INFO: Loading {posixpath.basename(step["csv"])}')
+                        with self.lock:
+                            graph.rows.setdefault(step.get('class') or step['nodegroup'], []).extend(rows)
+                    elif 'owl' in step:
+                        read(base, step['owl'])
+                        lines.append(f'INFO: Loading {posixpath.basename(step["owl"])}')
+                        with self.lock:
+                            graph.owl.append(posixpath.basename(step['owl']))
+                    elif 'nodegroup_json' in step:
+                        store(step['name'], step.get('comment', ''), step['creator'], read(base, step['nodegroup_json']), DEFAULT_ITEM_TYPE)
+
+            def store(item_id: str, comments: str, creator: str, json_bytes: bytes, item_type: str) -> None:
+                with self.lock:
+                    self.store[item_id] = {
+                        'comments': comments,
+                        'creator': creator,
+                        'creationDate': datetime.now().isoformat(),
+                        'itemType': item_type,
+                        'json': json_bytes.decode('utf-8-sig'),
+                    }
+
+            def load_nodegroups(directory: str) -> None:
+                lines.append(f'INFO: Loading {posixpath.join(directory, "store_data.csv")}')
+                for row in csv.DictReader(StringIO(read(directory, 'store_data.csv').decode('utf-8-sig'))):
+                    store(row['ID'], row['comments'], row['creator'], read(directory, row['jsonFile']), row.get('itemType') or DEFAULT_ITEM_TYPE)
+
+            def load_manifest(member: str) -> None:
+                obj = yaml.safe_load(read('', member))
+                base = posixpath.dirname(member)
+                if clear:
+                    footprint = obj.get('footprint', {})
+                    with self.lock:
+                        for uri in footprint.get('model-graphs', []) + footprint.get('data-graphs', []):
+                            self.graphs.pop(uri, None)
+                for step in obj.get('steps', []):
+                    ((kind, arg),) = step.items()
+                    if kind == 'copygraph':
+                        lines.append(f'INFO: Copying {arg["from-graph"]} to {arg["to-graph"]}')
+                        (source, target) = (self.graph(arg['from-graph']), self.graph(arg['to-graph']))
+                        with self.lock:
+                            for (item_id, rows) in source.rows.items():
+                                target.rows.setdefault(item_id, []).extend(rows)
+                            target.owl.extend(source.owl)
+                        continue
+                    path = posixpath.normpath(posixpath.join(base, arg))
+                    {'model': load_model, 'data': load_data, 'nodegroups': load_nodegroups, 'manifest': load_manifest}[kind](path)
+
+            try:
+                load_manifest(find_toplevel_manifest(names))
+            except (FileNotFoundError, KeyError) as e:
+                lines.append(f'ERROR: File not found in package: {e}')
+        return PackageResponse(lines)
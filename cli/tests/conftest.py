@@ -3,11 +3,14 @@
 
 import pytest
 
+from pathlib import Path
 from time import sleep
-from typing import Any
+from typing import Any, Iterator
 
 from semtk3 import check_services, set_host
 
+from rack.standin import StandIn, isolated_state
+
 @pytest.fixture(scope="session")
 def rack_in_a_box(docker_ip: str, docker_services: Any) -> str:
     """Ensure that RACK-in-a-box is up and responsive."""
@@ -17,3 +20,9 @@ def rack_in_a_box(docker_ip: str, docker_services: Any) -> str:
          timeout=240.0, pause=0.1, check=lambda: check_services()
     )
     return url
+
+@pytest.fixture
+def semtk_standin(tmp_path: Path) -> Iterator[StandIn]:
+    """An in-memory SemTK, with the ledger, query cache and nodegroup index kept in tmp_path."""
+    with isolated_state(tmp_path), StandIn().installed() as standin:
+        yield standin
@@ -5,9 +5,35 @@ Run with pytest.
 
 Expects to be run inside the RACK repo.
 """
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import json
+import os
+import re
 from pathlib import Path
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+from zipfile import ZipFile
 
-from rack import ingest_data_driver, ingest_owl_driver, run_query, sparql_connection, Url
+import pytest
+
+from rack import ExportFormat, Graph, build_manifest_driver, cardinality_driver, store_nodegroups_driver, clear_driver, combine_ingestion_status, delete_all_nodegroups_driver, delete_nodegroups_driver, ingest_csv_chunks, ingest_data_driver, ingest_manifest_driver, ingest_owl_driver, iter_csv_chunks, plan_ingestion_steps, profile_compare_driver, run_query, sparql_connection, Connection, Url
+import rack
+import rack.package
+from rack.cache import QueryCache
+from rack.cardinality import Restriction, list_restrictions, run_checks
+from rack.ledger import IngestionLedger, PackageHasher, mark_changed, record_loaded
+from rack.manifest import Manifest
+from rack.nodegroups import LocalItem, NodegroupIndex, NodegroupSyncError, current_index, plan_sync, read_store_data, write_store_data
+from rack.profile import Profile, profiling
+from rack.progress import IngestionProgress, plan_progress_steps
+from rack.server import handle_request
+from rack.session import PooledRequests, close_session, get_session
+from rack.standin import StandIn
 
 
 def test_load_owl(rack_in_a_box: str) -> None:
@@ -17,3 +43,701 @@ def test_load_owl(rack_in_a_box: str) -> None:
 def test_run_query(rack_in_a_box: str) -> None:
     conn = sparql_connection(Url(rack_in_a_box), None, None, [], None, None)
     run_query(conn, "Ingest-SystemComponent")
+
+def test_iter_csv_chunks(tmp_path: Path) -> None:
+    csv_path = tmp_path / "input.csv"
+    csv_path.write_text('identifier,description\nA,"two\nlines"\nB,b\nC,"say ""hi"""\n', encoding='utf-8')
+    chunks = list(iter_csv_chunks(csv_path, 2))
+    assert chunks == [
+        'identifier,description\nA,"two\nlines"\nB,b\n',
+        'identifier,description\nC,"say ""hi"""\n',
+    ]
+
+def test_combine_ingestion_status() -> None:
+    assert combine_ingestion_status(["8\tFailures: 0", "3\tFailures: 1"]) == "11\tFailures: 1"
+
+def test_profile_records_and_compares_steps(tmp_path: Path) -> None:
+    csv_file = tmp_path / "B.csv"
+    csv_file.write_text("identifier\nB1\nB2\nB3\n")
+
+    delay = 0.0
+
+    def ingest(chunk: str) -> Tuple[str, str]:
+        time.sleep(delay)
+        return (f"{chunk.count(chr(10)) - 1} records ingested", "odd value\n")
+
+    for (path, delay) in [(tmp_path / "old.json", 0.01), (tmp_path / "new.csv", 0.05)]:
+        with profiling(path, "data import"):
+            ingest_csv_chunks(ingest, csv_file, 2, "http://arcos.rack/B#B")
+
+    old = Profile.read(tmp_path / "old.json")
+    new = Profile.read(tmp_path / "new.csv")
+    assert [step.to_json()["name"] for step in old.steps] == ["B.csv"]
+    assert old.steps[0].rows == new.steps[0].rows == 3
+    assert old.steps[0].warnings == 2 and old.steps[0].bytes == 2 * len("identifier\n") + len("B1\nB2\nB3\n")
+
+    profile_compare_driver(tmp_path / "old.json", tmp_path / "new.csv", 0.2, 1.0)
+    with pytest.raises(SystemExit):
+        profile_compare_driver(tmp_path / "old.json", tmp_path / "new.csv", 0.2, 0.0)
+
+def test_plan_ingestion_steps() -> None:
+    steps: List[Dict[str, Any]] = [
+        {'nodegroup': 'ingest_A', 'csv': 'A1.csv'},
+        {'class': 'http://arcos.rack/B#B', 'csv': 'B.csv'},
+        {'nodegroup': 'ingest_A', 'csv': 'A2.csv'},
+        {'owl': 'extra.owl'},
+        {'nodegroup_json': 'A.json', 'name': 'query A', 'creator': 'rack'},
+        {'nodegroup_json': 'B.json', 'name': 'query B', 'creator': 'rack'},
+        {'nodegroup_json': 'A2.json', 'name': 'query A', 'creator': 'rack'},
+        {'count': 1, 'nodegroup': 'query A'},
+    ]
+    assert plan_ingestion_steps(steps) == [steps[0:2], steps[2:3], steps[3:4], steps[4:6], steps[6:7], steps[7:8]]
+
+def test_nodegroup_sync_skips_unchanged_items(tmp_path: Path) -> None:
+    directory = tmp_path / "nodegroups"
+    directory.mkdir()
+    (directory / "store_data.csv").write_text("ID,comments,creator,jsonFile\nquery A,first,rack,A.json\nquery B,second,rack,B.json\n")
+    (directory / "A.json").write_text('{"sNodeList": []}')
+    (directory / "B.json").write_text('{"sNodeList": [1]}')
+
+    class Table:
+        def __init__(self, rows: List[List[str]]) -> None:
+            self.rows = rows
+        def get_column_names(self) -> List[str]:
+            return ["ID", "comments", "creationDate", "creator", "itemType"]
+        def get_rows(self) -> List[List[str]]:
+            return self.rows
+
+    index = NodegroupIndex(tmp_path / "index.json")
+    store = Url("http://localhost")
+    index.refresh(store, Table([["query B", "second", "2024-01-01", "rack", "http://research.ge.com/semtk/services#PrefabNodeGroup"],
+                                ["old", "", "2023-01-01", "rack", "http://research.ge.com/semtk/services#PrefabNodeGroup"]]))
+    items = read_store_data(directory)
+    plan = plan_sync(items, index.items(store), prune=True)
+    assert [item.id for item in plan.new] == ["query A"]
+    assert [item.id for item in plan.changed] == ["query B"]
+    assert plan.prune == [("old", "PrefabNodeGroup")]
+
+    stored = {item.id: item.digest for item in items}
+    index.refresh(store, Table([["query A", "first", "2024-02-01", "rack", "PrefabNodeGroup"],
+                                ["query B", "second", "2024-02-01", "rack", "PrefabNodeGroup"]]), stored)
+    index.save()
+    index = NodegroupIndex(tmp_path / "index.json")
+    assert len(plan_sync(items, index.items(store)).unchanged) == 2
+
+    # Someone else stored query B again
+    index.refresh(store, Table([["query A", "first", "2024-02-01", "rack", "PrefabNodeGroup"],
+                                ["query B", "second", "2024-03-01", "rack", "Report"]]))
+    plan = plan_sync(items, index.items(store))
+    assert [item.id for item in plan.changed] == ["query B"] and plan.stored_types == {"query B": "Report"}
+
+    assert index.select(store, [re.compile("^query")]) == ["query A", "query B"]
+    assert index.select(store, [re.compile("B$"), re.compile("A$")], "PrefabNodeGroup") == ["query A"]
+    assert not index.stale(store, 60)
+    index.invalidate(store)
+    assert index.stale(store, 60)
+
+def test_store_data_round_trip(tmp_path: Path) -> None:
+    (tmp_path / "A.json").write_text('{"sNodeList": []}')
+    write_store_data(tmp_path, [LocalItem("query, A", "a \"quoted\" comment", "rack", tmp_path / "A.json", "Report").load()])
+    [item] = read_store_data(tmp_path)
+    assert (item.id, item.comments, item.item_type, item.json_str) == ("query, A", 'a "quoted" comment', "Report", '{"sNodeList": []}')
+
+def test_clear_graphs_matching_pattern(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    class Table:
+        def get_column(self, i: int) -> List[str]:
+            return ["http://rack001/data", "http://rack001/overlay1", "http://rack001/overlay2", "uri://DefaultGraph"]
+
+    cleared: List[str] = []
+    monkeypatch.setenv("RACK_LEDGER", str(tmp_path / "ledger.json"))
+    monkeypatch.setattr(rack.semtk3, "get_graph_info", lambda conn, exclude_internal, skip_counts: Table())
+    monkeypatch.setattr(rack.semtk3, "clear_graph", lambda conn, which, n: cleared.append(json.loads(conn)["data"][0]["graph"]))
+    monkeypatch.setattr(rack.semtk3, "build_connection_str", lambda name, tst, ts, models, data, extra: json.dumps({"data": [{"graph": data}]}))
+
+    clear_driver(Url("http://localhost"), None, [Url("http://rack001/data")], None, None, Graph.DATA, 2, "overlay", True)
+    assert sorted(cleared) == ["http://rack001/data", "http://rack001/overlay1", "http://rack001/overlay2"]
+
+def test_cardinality_checks_stream_and_time_out(monkeypatch: pytest.MonkeyPatch) -> None:
+    class Table:
+        def __init__(self, rows: List[List[str]]) -> None:
+            self.rows = rows
+
+        def get_rows(self) -> List[List[str]]:
+            return self.rows
+
+    def query_raw_sparql(query: str) -> Table:
+        if "owl:onProperty" in query:
+            return Table([
+                ["http://arcos.rack/B#B", "http://arcos.rack/B#slow", "http://www.w3.org/2002/07/owl#minCardinality", "1", ""],
+                ["http://arcos.rack/A#A", "http://arcos.rack/A#name", "http://www.w3.org/2002/07/owl#maxCardinality", "1", ""],
+            ])
+        if "#slow>" in query:
+            time.sleep(1.0)
+            return Table([])
+        assert "FROM <http://rack001/data>" in query and "> 1)" in query
+        return Table([["http://example/a1", "2"]])
+
+    monkeypatch.setattr(rack.semtk3, "query_raw_sparql", query_raw_sparql, raising=False)
+    restrictions = list_restrictions([Url("http://rack001/model")])
+    assert [r.name() for r in restrictions] == ["A name max cardinality 1", "B slow min cardinality 1"]
+    assert "OPTIONAL" in restrictions[1].violations_query([Url("http://rack001/data")], -1)
+
+    start = time.monotonic()
+    results = list(run_checks(restrictions, [Url("http://rack001/model"), Url("http://rack001/data")], 2, timeout=0.2))
+    assert time.monotonic() - start < 0.9
+    assert [result.status() for result in results] == ["1 violations", "timeout"]
+    assert results[0].rows == [["http://arcos.rack/A#A", "http://arcos.rack/A#name", "max cardinality", "1", "http://example/a1", "2"]]
+
+def test_cardinality_checks_keep_to_jobs(monkeypatch: pytest.MonkeyPatch) -> None:
+    class Table:
+        def get_rows(self) -> List[List[str]]:
+            return []
+
+    lock = threading.Lock()
+    started: List[str] = []
+    in_flight = 0
+    peak = 0
+    def query_raw_sparql(query: str) -> Table:
+        nonlocal in_flight, peak
+        slow = "#P0>" in query
+        with lock:
+            started.append(query)
+            if not slow:
+                in_flight += 1
+                peak = max(peak, in_flight)
+        time.sleep(0.4 if slow else 0.1)
+        if not slow:
+            with lock:
+                in_flight -= 1
+        return Table()
+
+    monkeypatch.setattr(rack.semtk3, "query_raw_sparql", query_raw_sparql, raising=False)
+    restrictions = [Restriction("http://arcos.rack/A#A", f"http://arcos.rack/A#P{i}", "maxCardinality", 1, None) for i in range(8)]
+    graphs = [Url("http://rack001/data")]
+
+    # The worker of a timed out check retires once its query returns
+    results = list(run_checks(restrictions, graphs, 1, timeout=0.25))
+    assert [result.status() for result in results].count("timeout") == 1
+    assert len(started) == 8 and peak == 1
+
+    # No new checks start once the caller stops reading
+    started.clear()
+    checks = run_checks(restrictions[1:], graphs, 2)
+    next(checks)
+    checks.close()
+    count = len(started)
+    time.sleep(0.3)
+    assert len(started) == count < 7
+
+def test_cardinality_driver_output_and_status(semtk_standin: StandIn, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]) -> None:
+    class Table:
+        def __init__(self, rows: List[List[str]]) -> None:
+            self.rows = rows
+
+        def get_rows(self) -> List[List[str]]:
+            return self.rows
+
+    healthy = True
+    def query_raw_sparql(query: str) -> Table:
+        if "owl:onProperty" in query:
+            return Table([
+                ["http://arcos.rack/A#A", "http://arcos.rack/A#name", "http://www.w3.org/2002/07/owl#maxCardinality", "1", ""],
+                ["http://arcos.rack/B#B", "http://arcos.rack/B#slow", "http://www.w3.org/2002/07/owl#minCardinality", "1", ""],
+                ["http://arcos.rack/C#C", "http://arcos.rack/C#bad", "http://www.w3.org/2002/07/owl#maxCardinality", "1", ""],
+            ])
+        if "#name>" in query:
+            return Table([["http://example/a1", "2"], ["http://example/a2", "3"]])
+        if not healthy and "#slow>" in query:
+            time.sleep(1.0)
+        if not healthy and "#bad>" in query:
+            raise Exception("query failed")
+        return Table([["http://example/c1", "2"]] if "#bad>" in query else [])
+
+    monkeypatch.setattr(rack.semtk3, "query_raw_sparql", query_raw_sparql, raising=False)
+    def check(export_format: ExportFormat, max_rows: int, concise: bool = False, timeout: float = 5.0) -> None:
+        cardinality_driver(Url("http://localhost"), None, [Url("http://rack001/data")], None, None, True, export_format, concise, max_rows, jobs=1, timeout=timeout)
+
+    # Rows stop at max_rows, across restrictions
+    check(ExportFormat.CSV, 2)
+    (out, err) = capsys.readouterr()
+    assert out.splitlines() == [
+        ",".join(rack.cardinality.VIOLATION_COLUMNS),
+        "http://arcos.rack/A#A,http://arcos.rack/A#name,max cardinality,1,http://example/a1,2",
+        "http://arcos.rack/A#A,http://arcos.rack/A#name,max cardinality,1,http://example/a2,3",
+    ]
+    assert "Checked 1 of 3 restrictions" in err and "2 violations, 0 timed out, 0 failed" in err
+
+    check(ExportFormat.CSV, -1)
+    (out, err) = capsys.readouterr()
+    assert out.splitlines()[-1] == "http://arcos.rack/C#C,http://arcos.rack/C#bad,max cardinality,1,http://example/c1,2"
+    assert "Checked 3 of 3 restrictions" in err and "3 violations" in err
+
+    check(ExportFormat.TEXT, -1, concise=True)
+    out = capsys.readouterr().out
+    assert "A name max cardinality 1" in out and "C bad max cardinality 1" in out and "B slow" not in out
+    assert re.search(r"http://example/a2\s+name\s+max cardinality 1, has 3", out)
+
+    # Timeouts and failures are reported and fail the command
+    healthy = False
+    with pytest.raises(SystemExit) as exit_info:
+        check(ExportFormat.CSV, -1, timeout=0.2)
+    assert exit_info.value.code == 1
+    err = capsys.readouterr().err
+    assert "B slow min cardinality 1: timed out" in err and "C bad max cardinality 1: query failed" in err
+    assert "2 violations, 1 timed out, 1 failed" in err
+
+def test_standin_ingests_and_queries(tmp_path: Path, semtk_standin: StandIn, capsys: pytest.CaptureFixture[str]) -> None:
+    (tmp_path / "A.csv").write_text("identifier,title\nA1,one\nA2,two\nA3,three\n", encoding="utf-8")
+    (tmp_path / "B.csv").write_text("identifier\nB1\n", encoding="utf-8")
+    (tmp_path / "import.yaml").write_text(
+        "data-graph: http://rack001/standin\n"
+        "ingestion-steps:\n"
+        "- {nodegroup: ingest_A, csv: A.csv}\n"
+        "- {class: 'http://arcos.rack/B#B', csv: B.csv}\n"
+        "- {count: 3, nodegroup: ingest_A}\n", encoding="utf-8")
+
+    semtk_standin.latency["ingest"] = 0.05
+    ingest_data_driver(tmp_path / "import.yaml", Url("http://localhost"), None, None, None, None, False, chunk_rows=1, jobs=3)
+    assert semtk_standin.calls["ingest"] == 4 and semtk_standin.peak >= 2
+    assert len(semtk_standin.graph("http://rack001/standin").rows["ingest_A"]) == 3
+
+    conn = sparql_connection(Url("http://localhost"), None, Url("http://rack001/standin"), [], None, None)
+    capsys.readouterr()
+    run_query(conn, "ingest_A", ExportFormat.CSV)
+    assert capsys.readouterr().out.split() == ["identifier,title", "A1,one", "A2,two", "A3,three"]
+
+    clear_driver(Url("http://localhost"), None, [Url("http://rack001/standin")], None, None, Graph.DATA)
+    assert "http://rack001/standin" not in semtk_standin.graphs
+
+def test_ingest_stores_nodegroups_between_parallel_loads(tmp_path: Path, semtk_standin: StandIn, monkeypatch: pytest.MonkeyPatch) -> None:
+    (tmp_path / "A.csv").write_text("identifier\nA1\nA2\n", encoding="utf-8")
+    (tmp_path / "B.csv").write_text("identifier\nB1\n", encoding="utf-8")
+    (tmp_path / "query_A.json").write_text('{"sNodeGroup": {}}', encoding="utf-8")
+    (tmp_path / "query_B.json").write_text('{"sNodeGroup": {}}', encoding="utf-8")
+    (tmp_path / "import.yaml").write_text(
+        "data-graph: http://rack001/standin\n"
+        "ingestion-steps:\n"
+        "- {nodegroup_json: query_A.json, name: query_A, creator: rack}\n"
+        "- {nodegroup_json: query_B.json, name: query_B, creator: rack}\n"
+        "- {nodegroup: ingest_A, csv: A.csv}\n"
+        "- {nodegroup: ingest_B, csv: B.csv}\n", encoding="utf-8")
+
+    ingest_data_driver(tmp_path / "import.yaml", Url("http://localhost"), None, None, None, None, False, jobs=2)
+    assert sorted(semtk_standin.store) == ["query_A", "query_B"]
+    assert semtk_standin.calls["ingest"] == 2
+    assert len(semtk_standin.graph("http://rack001/standin").rows["ingest_B"]) == 1
+
+    # Failed uploads are raised once the others are done
+    def refuse(*args: Any) -> None:
+        raise Exception("store unavailable")
+    monkeypatch.setattr(rack.semtk3, "store_item", refuse)
+    (tmp_path / "query_A.json").write_text('{"sNodeGroup": {"changed": true}}', encoding="utf-8")
+    with pytest.raises(NodegroupSyncError, match="1 nodegroup operations failed"):
+        ingest_data_driver(tmp_path / "import.yaml", Url("http://localhost"), None, None, None, None, False, jobs=2)
+    assert sorted(semtk_standin.store) == ["query_B"]
+
+def test_paged_export(tmp_path: Path, semtk_standin: StandIn, capsys: pytest.CaptureFixture[str], caplog: pytest.LogCaptureFixture) -> None:
+    rows = [{"identifier": f"A{i}"} for i in range(4)]
+    semtk_standin.graph("http://rack001/standin").rows["query_A"] = rows
+    semtk_standin.graph("http://rack001/standin").rows["query_B"] = rows
+    returned = [{"SparqlID": "?A", "isReturned": False, "propList": [{"SparqlID": "?identifier", "isReturned": True}]}]
+    semtk_standin.store_item("query_A", "", "", json.dumps({"sNodeGroup": {"sNodeList": returned, "orderBy": [{"sparqlID": "?identifier"}]}}), "PrefabNodeGroup")
+    semtk_standin.store_item("query_B", "", "", json.dumps({"sNodeGroup": {"sNodeList": returned, "orderBy": []}}), "PrefabNodeGroup")
+    conn = sparql_connection(Url("http://localhost"), None, Url("http://rack001/standin"), [], None, None)
+
+    # A page count that divides the rows exactly ends on an empty page
+    run_query(conn, "query_A", ExportFormat.CSV, path=tmp_path / "A.csv.gz", page_size=2)
+    with gzip.open(tmp_path / "A.csv.gz", mode="rt", encoding="utf-8") as f:
+        assert f.read().split() == ["identifier", "A0", "A1", "A2", "A3"]
+    assert semtk_standin.calls["select"] == 3
+
+    # Otherwise a short page ends it
+    rows.append({"identifier": "A4"})
+    capsys.readouterr()
+    run_query(conn, "query_A", ExportFormat.TSV, headers=False, page_size=2)
+    assert capsys.readouterr().out.split() == ["A0", "A1", "A2", "A3", "A4"]
+    assert semtk_standin.calls["select"] == 6
+
+    # A nodegroup that does not order its rows is exported with a single query
+    run_query(conn, "query_B", ExportFormat.CSV, page_size=2)
+    assert capsys.readouterr().out.split() == ["identifier", "A0", "A1", "A2", "A3", "A4"]
+    assert semtk_standin.calls["select"] == 7
+    assert "does not order its results by ?identifier" in caplog.text
+
+def test_verify_counts(tmp_path: Path, semtk_standin: StandIn, capsys: pytest.CaptureFixture[str]) -> None:
+    graph = semtk_standin.graph("http://rack001/standin")
+    graph.rows["ingest_A"] = [{"identifier": "A1"}, {"identifier": "A2"}]
+    graph.rows["ingest_B"] = [{"identifier": "B1"}]
+    (tmp_path / "queries").mkdir()
+    (tmp_path / "queries" / "store_data.csv").write_text("ID,comments,creator,jsonFile\ningest_B,,rack,B.json\n", encoding="utf-8")
+    (tmp_path / "pass.yaml").write_text(
+        "data-graph: http://rack001/standin\n"
+        "ingestion-steps:\n"
+        "- {count: 2, nodegroup: ingest_A}\n", encoding="utf-8")
+    (tmp_path / "fail.yaml").write_text(
+        "data-graph: http://rack001/standin\n"
+        "ingestion-steps:\n"
+        "- {count: 2, nodegroup: ingest_A}\n"
+        "- {count: 3, nodegroup: ingest_B}\n", encoding="utf-8")
+
+    rack.verify_counts_driver(tmp_path / "pass.yaml", tmp_path / "queries", Url("http://localhost"), None, None, None, None, 2, tmp_path / "pass.json")
+    assert "2 passed, 0 failed" in capsys.readouterr().out
+    report = json.loads((tmp_path / "pass.json").read_text(encoding="utf-8"))
+    assert (report["passed"], report["failed"]) == (2, 0)
+    assert [(r["nodegroup"], r["expected"], r["got"]) for r in report["results"]] == [("ingest_A", 2, 2), ("ingest_B", None, 1)]
+
+    with pytest.raises(SystemExit) as raised:
+        rack.verify_counts_driver(tmp_path / "fail.yaml", None, Url("http://localhost"), None, None, None, None, 2, tmp_path / "fail.json")
+    assert raised.value.code == 1
+    assert "1 passed, 1 failed" in capsys.readouterr().out
+    report = json.loads((tmp_path / "fail.json").read_text(encoding="utf-8"))
+    assert [(r["nodegroup"], r["got"], r["passed"]) for r in report["results"]] == [("ingest_A", 2, True), ("ingest_B", 1, False)]
+
+def test_store_nodegroups_replaces_other_item_types(tmp_path: Path, semtk_standin: StandIn) -> None:
+    (tmp_path / "store_data.csv").write_text("ID,comments,creator,jsonFile\nquery_A,,rack,A.json\n", encoding="utf-8")
+    (tmp_path / "A.json").write_text("{}", encoding="utf-8")
+    semtk_standin.store_item("query_A", "", "rack", "{}", "Report")
+
+    store_nodegroups_driver(tmp_path, Url("http://localhost"), jobs=1)
+    assert semtk_standin.store["query_A"]["itemType"] == "PrefabNodeGroup"
+
+def test_delete_nodegroups_refreshes_index(semtk_standin: StandIn) -> None:
+    semtk_standin.store_item("query_A", "", "rack", "{}", "PrefabNodeGroup")
+    assert list(current_index(Url("http://localhost")).items(Url("http://localhost"))) == ["query_A"]
+
+    # The store changes behind the back of a fresh index
+    semtk_standin.store_item("query_B", "", "rack", "{}", "PrefabNodeGroup")
+    del semtk_standin.store["query_A"]
+    delete_nodegroups_driver(["^query_"], False, True, True, Url("http://localhost"), jobs=1)
+    assert semtk_standin.store == {}
+    assert list(current_index(Url("http://localhost")).items(Url("http://localhost"))) == []
+
+def test_deleted_nodegroups_are_stored_again(tmp_path: Path, semtk_standin: StandIn, capsys: pytest.CaptureFixture[str]) -> None:
+    src = tmp_path / "src"
+    (src / "queries").mkdir(parents=True)
+    (src / "queries" / "store_data.csv").write_text("ID,comments,creator,jsonFile\nquery_A,,rack,A.json\n", encoding="utf-8")
+    (src / "queries" / "A.json").write_text("{}", encoding="utf-8")
+    (src / "manifest.yaml").write_text("name: queries\nsteps:\n- nodegroups: queries\n", encoding="utf-8")
+    build_manifest_driver(src / "manifest.yaml", tmp_path / "package")
+
+    ingest_manifest_driver(tmp_path / "package.zip", None, None, False, False)
+    assert list(semtk_standin.store) == ["query_A"]
+    capsys.readouterr()
+    ingest_manifest_driver(tmp_path / "package.zip", None, None, False, False)
+    assert "is unchanged since its last import" in capsys.readouterr().out
+
+    delete_all_nodegroups_driver(True, Url("http://localhost"), jobs=1)
+    assert semtk_standin.store == {}
+    ingest_manifest_driver(tmp_path / "package.zip", None, None, False, False)
+    assert "unchanged" not in capsys.readouterr().out
+    assert list(semtk_standin.store) == ["query_A"]
+
+def test_ledger_skips_unchanged_steps(tmp_path: Path) -> None:
+    package = tmp_path / "package.zip"
+    with ZipFile(package, "w") as z:
+        z.writestr("manifest.yaml", "name: example\nsteps:\n- data: data/data.yaml\n- model: model/model.yaml\n")
+        z.writestr("data/data.yaml", "ingestion-steps:\n- {class: 'http://arcos.rack/B#B', csv: B.csv}\n")
+        z.writestr("data/B.csv", "identifier\nB1\n")
+        z.writestr("model/model.yaml", "files: [extra.owl]\n")
+        z.writestr("model/extra.owl", "<rdf:RDF/>\n")
+
+    ledger = IngestionLedger(tmp_path / "ledger.json")
+    store = Url("http://localhost:3030/RACK")
+    with ZipFile(package) as z:
+        plan = PackageHasher(z).plan("manifest.yaml")
+        assert mark_changed(plan, ledger, store, False)
+        record_loaded(plan, ledger, store)
+        assert not mark_changed(plan, ledger, store, False)
+        assert mark_changed(plan, ledger, store, True)
+
+    ledger.forget_graphs(store, ["http://rack001/data"])
+    with ZipFile(package) as z:
+        plan = PackageHasher(z).plan("manifest.yaml")
+        assert mark_changed(plan, ledger, store, False)
+        assert [step.key for step in plan.unchanged_steps()] == ["model:model/model.yaml"]
+
+def test_progress_tracks_streamed_steps(tmp_path: Path) -> None:
+    package = tmp_path / "package.zip"
+    with ZipFile(package, "w") as z:
+        z.writestr("manifest.yaml", "name: example\nsteps:\n- model: model/model.yaml\n- data: data/data.yaml\n")
+        z.writestr("model/model.yaml", "files: [extra.owl]\n")
+        z.writestr("model/extra.owl", "<rdf:RDF/>\n")
+        z.writestr("data/data.yaml", "ingestion-steps:\n- {class: 'http://arcos.rack/B#B', csv: B.csv}\n")
+        z.writestr("data/B.csv", "identifier\nB1\nB2\nB3\n")
+
+    events = tmp_path / "progress.jsonl"
+    with ZipFile(package) as z:
+        hasher = PackageHasher(z)
+        progress = IngestionProgress(plan_progress_steps(hasher, hasher.plan("manifest.yaml")), events)
+        assert progress.total_bytes == sum(info.file_size for info in z.infolist() if info.filename != "manifest.yaml")
+    assert [step.rows for step in progress.steps] == [0, 3]
+
+    progress.start()
+    assert progress.observe("INFO", "Load OWL extra.owl") is not None
+    assert progress.observe("INFO", "Still loading extra.owl") is None
+    assert progress.observe("WARNING", "B.csv looks odd") is None
+    assert progress.observe("INFO", "Load CSV AB.csv") is None
+    report = progress.observe("INFO", "Load CSV B.csv")
+    assert report is not None and report.startswith("Progress: 1/2 steps")
+    progress.finish("ok")
+
+    lines = [json.loads(line) for line in events.read_text().splitlines()]
+    assert [line["event"] for line in lines] == ["start", "step", "step", "finish"]
+    assert lines[2]["key"] == "data:data/data.yaml" and lines[2]["warnings"] == 1
+    assert lines[-1]["status"] == "ok" and lines[-1]["rows_done"] == 3
+
+def test_manifest_read_from_zip(tmp_path: Path) -> None:
+    package = tmp_path / "package.zip"
+    with ZipFile(package, "w") as z:
+        z.writestr("pkg/manifest.yaml", "name: top\nsteps:\n- manifest: nested/manifest.yaml\n")
+        z.writestr("pkg/nested/manifest.yaml", "name: nested\nfootprint: {data-graphs: ['http://rack001/data']}\n")
+
+    assert Manifest.getToplevelManifest(package).getName() == "top"
+    manifests = Manifest.getManifests(package)
+    assert list(manifests) == ["pkg/manifest.yaml", "pkg/nested/manifest.yaml"]
+    assert manifests["pkg/nested/manifest.yaml"].getDatagraphsFootprint() == ["http://rack001/data"]
+
+def test_build_manifest_stores_duplicates_once(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Send every file through the worker threads
+    monkeypatch.setattr(rack.package, "PARALLEL_THRESHOLD", 0)
+
+    src = tmp_path / "src"
+    for name in ["a", "b"]:
+        (src / name).mkdir(parents=True)
+        (src / name / "manifest.yaml").write_text(f"name: {name}\nsteps:\n- data: data.yaml\n")
+        (src / name / "data.yaml").write_text("ingestion-steps:\n- {class: 'http://arcos.rack/B#B', csv: B.csv}\n")
+        (src / name / "B.csv").write_text("identifier\nB1\n")
+    (src / "manifest.yaml").write_text("name: top\nsteps:\n- manifest: a/manifest.yaml\n- manifest: b/manifest.yaml\n")
+
+    build_manifest_driver(src / "manifest.yaml", tmp_path / "package", compression_level=9, jobs=2)
+
+    with ZipFile(tmp_path / "package.zip") as z:
+        assert z.testzip() is None
+        csvs = [name for name in z.namelist() if name.endswith("B.csv")]
+        assert len(csvs) == 1
+        plan = PackageHasher(z).plan("manifest.yaml")
+        for step in plan.steps:
+            assert csvs[0] in step.members
+
+def test_build_manifest_duplicates_load_from_other_directories(tmp_path: Path, semtk_standin: StandIn, capsys: pytest.CaptureFixture[str]) -> None:
+    src = tmp_path / "src"
+    for name in ["a", "b"]:
+        (src / name).mkdir(parents=True)
+        (src / name / "manifest.yaml").write_text(f"name: {name}\nsteps:\n- model: model.yaml\n- data: data.yaml\n")
+        (src / name / "model.yaml").write_text("files: [shared.owl]\n")
+        (src / name / "shared.owl").write_text("<rdf:RDF/>\n")
+        (src / name / "data.yaml").write_text("ingestion-steps:\n- {class: 'http://arcos.rack/B#B', csv: B.csv}\n")
+        (src / name / "B.csv").write_text("identifier\nB1\n")
+    (src / "manifest.yaml").write_text("name: top\nsteps:\n- manifest: a/manifest.yaml\n- manifest: b/manifest.yaml\n")
+    build_manifest_driver(src / "manifest.yaml", tmp_path / "package")
+
+    with ZipFile(tmp_path / "package.zip") as z:
+        assert "../../00_a/01_model/shared.owl" in z.read("03_b/04_model/model.yaml").decode("utf-8-sig")
+        assert "../../00_a/02_data/B.csv" in z.read("03_b/05_data/data.yaml").decode("utf-8-sig")
+        plan = PackageHasher(z).plan("manifest.yaml")
+        assert all(member in z.namelist() for step in plan.steps for member in step.members)
+
+    capsys.readouterr()
+    ingest_manifest_driver(tmp_path / "package.zip", None, None, False, False)
+    assert "ERROR" not in capsys.readouterr().out
+    rows = [row for graph in semtk_standin.graphs.values() for row in graph.rows.get("http://arcos.rack/B#B", [])]
+    owl = [name for graph in semtk_standin.graphs.values() for name in graph.owl]
+    assert rows == [{"identifier": "B1"}] * 2
+    assert owl == ["shared.owl"] * 2
+
+    ingest_manifest_driver(tmp_path / "package.zip", None, None, False, False)
+    assert "unchanged since its last import" in capsys.readouterr().out
+
+def test_build_manifest_is_reproducible(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "manifest.yaml").write_text("name: top\nsteps:\n- data: data.yaml\n")
+    (src / "data.yaml").write_text("ingestion-steps:\n- {class: 'http://arcos.rack/B#B', csv: B.csv}\n")
+    (src / "B.csv").write_text("identifier\nB1\n")
+
+    cache = tmp_path / "cache"
+    build_manifest_driver(src / "manifest.yaml", tmp_path / "first", build_cache=cache)
+    os.utime(src / "B.csv", (0, 0))
+    build_manifest_driver(src / "manifest.yaml", tmp_path / "second", build_cache=cache, jobs=1)
+
+    assert (tmp_path / "first.zip").read_bytes() == (tmp_path / "second.zip").read_bytes()
+    assert "reused 1 compressed files, compressed 0" in capsys.readouterr().out
+
+def test_package_writes_without_zipfile_internals(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    (tmp_path / "A.csv").write_text("identifier\n" + "".join(f"A{i}\n" for i in range(50000)))
+    (tmp_path / "B.csv").write_text("identifier\nB1\n")
+    writer = rack.package.PackageWriter()
+    writer.add_file("data/A.csv", tmp_path / "A.csv")
+    writer.add_file("data/B.csv", tmp_path / "B.csv")
+    writer.add_bytes("manifest.yaml", b"name: top\n")
+
+    with ZipFile(tmp_path / "empty.zip", mode="w") as zf:
+        assert rack.package.raw_writes_supported(zf) == ((3, 8) <= sys.version_info[:2] <= (3, 13))
+    writer.write(tmp_path / "raw.zip", compression_level=9)
+    monkeypatch.setattr(rack.package, "RAW_WRITE_VERSIONS", ((0, 0), (0, 0)))
+    with ZipFile(tmp_path / "empty.zip", mode="w") as zf:
+        assert not rack.package.raw_writes_supported(zf)
+    writer.write(tmp_path / "public.zip", compression_level=9)
+
+    assert (tmp_path / "raw.zip").read_bytes() == (tmp_path / "public.zip").read_bytes()
+    with ZipFile(tmp_path / "public.zip") as zf:
+        assert zf.testzip() is None
+        assert zf.read("data/A.csv") == (tmp_path / "A.csv").read_bytes()
+
+def test_query_cache(tmp_path: Path) -> None:
+    cache = QueryCache(tmp_path, max_bytes=100)
+    conn = Connection('{"model": [{"graph": "http://rack001/model"}], "data": [{"graph": "http://rack001/data"}]}')
+    key = cache.key('count', conn, 'query A', [])
+    cache.put(key, 42)
+    assert cache.get(key) == 42
+
+    # Writing to a graph of the connection retires the entry
+    cache.generations.bump(['http://rack001/data'])
+    assert cache.key('count', conn, 'query A', []) != key
+
+    # Concurrent bumps of different graphs all take effect
+    graphs = [f'http://rack001/g{i}' for i in range(20)]
+    before = [cache.generations.stamp(g) for g in graphs]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda g: cache.generations.bump([g]), graphs))
+    assert all(cache.generations.stamp(g) not in (None, old) for (g, old) in zip(graphs, before))
+
+    # Entries beyond the size bound are evicted, least recently used first
+    for i in range(10):
+        cache.put(f'filler{i}', 'x' * 20)
+    assert cache.get(key) is None
+
+def test_session_routes_semtk3_requests() -> None:
+    import requests
+    import semtk3.restclient
+    session = get_session()
+    try:
+        assert semtk3.restclient.requests is session
+        assert isinstance(session, PooledRequests)
+        assert session.RequestException is requests.RequestException
+    finally:
+        close_session()
+    assert semtk3.restclient.requests is requests
+
+def test_server_runs_forwarded_command(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    def run(argv: List[str]) -> None:
+        print(f"{os.getcwd()} {os.environ['RACK_TEST']} {os.environ.get('RACK_LEDGER')} {' '.join(argv)}")
+        print("oops", file=sys.stderr)
+        sys.exit(3)
+
+    monkeypatch.setenv('RACK_LEDGER', 'server.json')
+    (client, server) = socket.socketpair()
+    request = {'argv': ['data', 'count'], 'cwd': str(tmp_path), 'env': {'RACK_TEST': 'yes', 'RACK_LEDGER': None}}
+    client.sendall(json.dumps(request).encode() + b'\n')
+    cwd = os.getcwd()
+    handle_request(server, run)
+    assert os.getcwd() == cwd and 'RACK_TEST' not in os.environ
+    assert os.environ['RACK_LEDGER'] == 'server.json'
+
+    with client, client.makefile('rb') as reader:
+        messages = [json.loads(line) for line in reader]
+    assert messages == [
+        {'stream': 'stdout', 'data': f'{tmp_path} yes None data count'},
+        {'stream': 'stdout', 'data': '\n'},
+        {'stream': 'stderr', 'data': 'oops'},
+        {'stream': 'stderr', 'data': '\n'},
+        {'exit': 3},
+    ]
+
+def test_client_forwards_only_rack_variables(tmp_path: Path) -> None:
+    requests: List[Dict[str, Any]] = []
+
+    def accept(listener: socket.socket) -> None:
+        (conn, _) = listener.accept()
+        with conn, conn.makefile('rb') as reader:
+            requests.append(json.loads(reader.readline()))
+            conn.sendall(b'{"exit": 0}\n')
+
+    cli = Path(__file__).resolve().parent.parent
+    socket_path = tmp_path / "rack.sock"
+    env = dict(os.environ, RACK_SERVER=str(socket_path), BASE_URL='http://semtk', RACK_SECRET='hidden')
+    env.pop('LOG_LEVEL', None)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(str(socket_path))
+        listener.listen()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            accepted = executor.submit(accept, listener)
+            subprocess.run([sys.executable, str(cli / "bin" / "rack"), "data", "count"], env=env, check=True, timeout=30)
+            accepted.result(timeout=10)
+
+    forwarded = requests[0]['env']
+    assert 'RACK_SECRET' not in forwarded and 'PATH' not in forwarded
+    assert forwarded['BASE_URL'] == 'http://semtk'
+    assert forwarded['LOG_LEVEL'] is None
+
+def test_server_forwards_stdin_and_resets_globals(tmp_path: Path) -> None:
+    import logging
+    import semtk3
+
+    def run(argv: List[str]) -> None:
+        logging.getLogger().setLevel(logging.DEBUG)
+        logging.getLogger('rack').setLevel(logging.DEBUG)
+        semtk3.SEMTK3_CONN_OVERRIDE = 'command connection'
+        print('Confirm [y/N]')
+        print('confirmed' if input().lower() == 'y' else 'aborted')
+        print(f'then {input()!r}')
+
+    def client(sock: socket.socket, lines: List[str]) -> List[Dict[str, Any]]:
+        messages = []
+        with sock, sock.makefile('rb') as reader, sock.makefile('wb') as writer:
+            request = {'argv': [], 'cwd': str(tmp_path), 'env': {}}
+            writer.write(json.dumps(request).encode() + b'\n')
+            writer.flush()
+            for line in reader:
+                message = json.loads(line)
+                messages.append(message)
+                if 'stdin' in message:
+                    writer.write(json.dumps({'stdin': lines.pop(0) if lines else ''}).encode() + b'\n')
+                    writer.flush()
+        return messages
+
+    root_level = logging.getLogger().level
+    rack_level = logging.getLogger('rack').level
+    semtk3.SEMTK3_CONN_OVERRIDE = None
+    (client_sock, server_sock) = socket.socketpair()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        replies = executor.submit(client, client_sock, ['y\n', 'more\n'])
+        handle_request(server_sock, run)
+        messages = replies.result(timeout=10)
+
+    output = ''.join(m['data'] for m in messages if m.get('stream') == 'stdout')
+    assert output == "Confirm [y/N]\nconfirmed\nthen 'more'\n"
+    assert [m for m in messages if 'stdin' in m] == [{'stdin': 'readline'}, {'stdin': 'readline'}]
+    assert messages[-1] == {'exit': 0}
+    assert logging.getLogger().level == root_level
+    assert logging.getLogger('rack').level == rack_level
+    assert semtk3.SEMTK3_CONN_OVERRIDE is None
+
+# Cold-start ceiling for `rack --help`, overridable for slow machines
+STARTUP_BUDGET_SECONDS = float(os.environ.get('RACK_STARTUP_BUDGET') or 0.5)
+
+# Submodules that are only present once their (heavy) package has really loaded
+HEAVY_MODULES = ['semtk3.restclient', 'requests.sessions', 'yaml.loader', 'jsonschema.validators', 'tabulate']
+
+def test_help_cold_start() -> None:
+    cli = Path(__file__).resolve().parent.parent
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(cli), os.environ.get('PYTHONPATH', '')]))
+
+    probe = 'import sys, rack; rack.get_argument_parser().format_help(); print(" ".join(m for m in sys.argv[1:] if m in sys.modules))'
+    loaded = subprocess.run([sys.executable, '-c', probe] + HEAVY_MODULES, env=env, check=True, capture_output=True, text=True).stdout.split()
+    assert loaded == []
+
+    # Exiting from inside a command must not load the modules of the error handlers either
+    probe = ('import runpy, sys\n'
+             f'main = runpy.run_path({str(cli / "bin" / "rack")!r}, run_name="rack_cli")["main"]\n'
+             'try:\n    main([])\nexcept SystemExit:\n    pass\n'
+             'print(" ".join(m for m in sys.argv[1:] if m in sys.modules))')
+    loaded = subprocess.run([sys.executable, '-c', probe] + HEAVY_MODULES, env=env, check=True, capture_output=True, text=True).stdout.split()
+    assert loaded == []
+
+    def run_help() -> float:
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(cli / 'bin' / 'rack'), '--help'], env=env, check=True, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - start
+
+    assert min(run_help() for _ in range(3)) < STARTUP_BUDGET_SECONDS